@@ -0,0 +1,193 @@
+"""
+上传请求的准入控制
+
+突发的大批量上传会同时耗尽 uploads/ 磁盘、内存和 CPU。请求进入前先检查：
+- admission_max_jobs:       同时处理中的上传请求数上限，超出返回 503
+- admission_max_queued_mb:  已接收但尚未处理完的字节数上限，超出返回 503（单个请求本身超出返回 413）
+- admission_per_client:     每个客户端同时处理中的请求数上限，超出返回 429
+- upload_max_files:         单个请求中的文件数上限
+客户端按直连地址区分；只有直连地址属于 trusted_proxies（逗号分隔的地址或网段）时才采用 X-Forwarded-For，
+否则任何客户端都能每次换一个伪造的地址绕过单客户端限制。
+拒绝时立即返回并带 Retry-After，过载时服务按可预期的方式降级而不是一起变慢直至崩溃。
+/health 导出当前负载，饱和时返回 503，供负载均衡器把流量转到其它节点。
+"""
+import ipaddress
+import logging
+import threading
+from contextlib import contextmanager
+from config_manager import config
+import metrics
+
+_MB = 1024 * 1024
+
+
+class Rejected(Exception):
+    """请求未被准入"""
+
+    def __init__(self, status_code, reason, retry_after):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def parse_networks(value):
+    """把 "10.0.0.1, 10.1.0.0/16" 或地址列表解析为网段列表，无效条目忽略"""
+    if isinstance(value, str):
+        value = value.split(",")
+    networks = []
+    for entry in value or ():
+        entry = str(entry).strip()
+        if not entry:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(entry, strict=False))
+        except ValueError:
+            logging.warning("忽略无效的 trusted_proxies 条目: %s", entry)
+    return networks
+
+
+def _in_networks(address, networks):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+
+def client_address(peer, forwarded, trusted):
+    """
+    请求的客户端地址：直连地址 peer 不是可信代理时直接使用它；
+    否则从 X-Forwarded-For 右侧开始跳过可信代理，取第一个不可信的地址
+    """
+    if not peer:
+        return "unknown"
+    if not forwarded or not _in_networks(peer, trusted):
+        return peer
+    hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _in_networks(hop, trusted):
+            return hop
+    return hops[0] if hops else peer
+
+
+class _Ticket:
+    """一个已准入的请求；未声明 Content-Length 时随接收进度追加占用的字节数"""
+    __slots__ = ("controller", "client", "nbytes")
+
+    def __init__(self, controller, client, nbytes):
+        self.controller = controller
+        self.client = client
+        self.nbytes = nbytes
+
+    def add_bytes(self, nbytes):
+        self.controller._add_bytes(nbytes)
+        self.nbytes += nbytes
+
+
+class AdmissionController:
+    """max_jobs / max_queued_bytes / per_client 为 0 时表示不限制；trusted_proxies 为可信代理网段"""
+
+    def __init__(self, max_jobs=0, max_queued_bytes=0, per_client=0, retry_after=5, trusted_proxies=()):
+        self.max_jobs = max_jobs
+        self.max_queued_bytes = max_queued_bytes
+        self.per_client = per_client
+        self.retry_after = retry_after
+        self.trusted_proxies = parse_networks(trusted_proxies)
+        self.in_flight = 0
+        self.queued_bytes = 0
+        self.rejected = 0
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _reject(self, status_code, reason):
+        # 需持有锁
+        self.rejected += 1
+        metrics.admission_rejected.inc(reason=str(status_code))
+        raise Rejected(status_code, reason, self.retry_after)
+
+    def client_id(self, peer, forwarded=""):
+        """按直连地址和 X-Forwarded-For 确定计入单客户端限制的地址"""
+        return client_address(peer, forwarded, self.trusted_proxies)
+
+    def acquire(self, client, declared_bytes=0):
+        """准入一个请求，返回凭据；超出限制时抛出 Rejected"""
+        with self._lock:
+            if self.max_queued_bytes and declared_bytes > self.max_queued_bytes:
+                self._reject(413, "请求体超过上限")
+            if self.per_client and self._clients.get(client, 0) >= self.per_client:
+                self._reject(429, "该客户端同时进行的上传过多")
+            if self.max_jobs and self.in_flight >= self.max_jobs:
+                self._reject(503, "服务繁忙，上传任务已满")
+            if self.max_queued_bytes and self.queued_bytes + declared_bytes > self.max_queued_bytes:
+                self._reject(503, "服务繁忙，待处理数据已满")
+            self.in_flight += 1
+            self.queued_bytes += declared_bytes
+            self._clients[client] = self._clients.get(client, 0) + 1
+            self._publish()
+        return _Ticket(self, client, declared_bytes)
+
+    def _add_bytes(self, nbytes):
+        with self._lock:
+            if self.max_queued_bytes and self.queued_bytes + nbytes > self.max_queued_bytes:
+                self._reject(503, "服务繁忙，待处理数据已满")
+            self.queued_bytes += nbytes
+            self._publish()
+
+    def release(self, ticket):
+        with self._lock:
+            self.in_flight -= 1
+            self.queued_bytes -= ticket.nbytes
+            remaining = self._clients.get(ticket.client, 0) - 1
+            if remaining > 0:
+                self._clients[ticket.client] = remaining
+            else:
+                self._clients.pop(ticket.client, None)
+            self._publish()
+
+    @contextmanager
+    def admit(self, client, declared_bytes=0):
+        ticket = self.acquire(client, declared_bytes)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def _publish(self):
+        # 需持有锁
+        metrics.queue_depth.set(self.in_flight, queue="admitted")
+        metrics.admission_queued_bytes.set(self.queued_bytes)
+
+    def saturated(self):
+        with self._lock:
+            return bool((self.max_jobs and self.in_flight >= self.max_jobs)
+                        or (self.max_queued_bytes and self.queued_bytes >= self.max_queued_bytes))
+
+    def status(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_jobs": self.max_jobs,
+                "queued_bytes": self.queued_bytes,
+                "max_queued_bytes": self.max_queued_bytes,
+                "clients": len(self._clients),
+                "rejected": self.rejected,
+            }
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    """返回全局准入控制器，限制取自配置"""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController(
+                max_jobs=int(config.get("admission_max_jobs", 8)),
+                max_queued_bytes=int(config.get("admission_max_queued_mb", 1024) * _MB),
+                per_client=int(config.get("admission_per_client", 2)),
+                retry_after=int(config.get("admission_retry_after", 5)),
+                trusted_proxies=config.get("trusted_proxies", ""))
+        return _controller
@@ -0,0 +1,141 @@
+"""
+压缩包导入
+
+税务平台导出的发票通常是一个 ZIP。直接从压缩包流中逐个读取成员交给 InvoiceProcessor，
+不解压到磁盘；只处理 .pdf/.ofd 成员，其余成员和目录忽略。
+
+防止压缩炸弹的限制（均可配置）：
+- archive_max_members:   成员数上限
+- archive_max_member_mb: 单个成员解压后大小上限（按实际读出的字节数检查，不信任头部声明）
+- archive_max_total_mb:  整个压缩包解压后总大小上限
+- archive_max_ratio:     单个成员的压缩比上限
+"""
+import logging
+import os
+import zipfile
+from config_manager import config
+from invoice_processor import InvoiceResult, SUPPORTED_EXTENSIONS
+import executors
+import metrics
+import output_layout
+
+ARCHIVE_EXTENSIONS = ('.zip',)
+# 监控目录中处理完的压缩包移入该隐藏子目录，补扫和监控都会跳过它
+IMPORTED_DIR = ".archives"
+
+_MB = 1024 * 1024
+# ZIP 未设置 UTF-8 标志时，文件名按 cp437 解码；国内工具打包的文件名实际是 GBK
+_UTF8_FLAG = 0x800
+
+
+class ArchiveLimitError(ValueError):
+    """压缩包超出导入限制"""
+
+
+def is_archive(file_name):
+    return file_name.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def member_name(info):
+    """还原成员文件名"""
+    name = info.filename
+    if not info.flag_bits & _UTF8_FLAG:
+        try:
+            name = name.encode("cp437").decode("gbk")
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return name
+
+
+class ArchiveReader:
+    """按顺序读取压缩包中的发票成员，逐个生成 (成员名, 字节)，超出限制的成员记入 errors"""
+
+    def __init__(self, source, max_members=None, max_member_mb=None, max_total_mb=None, max_ratio=None):
+        self.source = source
+        self.max_members = max_members if max_members is not None else config.get("archive_max_members", 2000)
+        self.max_member_bytes = int((max_member_mb if max_member_mb is not None
+                                     else config.get("archive_max_member_mb", 50)) * _MB)
+        self.max_total_bytes = int((max_total_mb if max_total_mb is not None
+                                    else config.get("archive_max_total_mb", 512)) * _MB)
+        self.max_ratio = max_ratio if max_ratio is not None else config.get("archive_max_ratio", 200)
+        self.total_bytes = 0
+        self.errors = []    # [(成员名, 错误信息)]
+
+    def __iter__(self):
+        with zipfile.ZipFile(self.source) as archive:
+            members = [info for info in archive.infolist()
+                       if not info.is_dir() and member_name(info).lower().endswith(SUPPORTED_EXTENSIONS)]
+            if len(members) > self.max_members:
+                raise ArchiveLimitError(f"压缩包成员过多: {len(members)} > {self.max_members}")
+            for info in members:
+                name = member_name(info)
+                try:
+                    data = self._read(archive, info)
+                except ArchiveLimitError as e:
+                    if self.total_bytes > self.max_total_bytes:
+                        raise
+                    self.errors.append((name, str(e)))
+                    continue
+                except Exception as e:
+                    self.errors.append((name, f"读取压缩包成员失败: {e}"))
+                    continue
+                yield name, data
+
+    def _read(self, archive, info):
+        if info.file_size > self.max_member_bytes:
+            raise ArchiveLimitError(f"成员过大: {info.file_size} 字节")
+        if info.compress_size and info.file_size / info.compress_size > self.max_ratio:
+            raise ArchiveLimitError(f"压缩比异常: {info.file_size / info.compress_size:.0f}")
+        with metrics.timed("archive_read"), archive.open(info) as f:
+            # 头部声明的大小可能是伪造的，多读一个字节判断实际大小
+            data = f.read(self.max_member_bytes + 1)
+        if len(data) > self.max_member_bytes:
+            raise ArchiveLimitError("成员解压后超过大小上限")
+        self.total_bytes += len(data)
+        if self.total_bytes > self.max_total_bytes:
+            raise ArchiveLimitError(f"压缩包解压后超过总大小上限 {self.max_total_bytes // _MB} MB")
+        return data
+
+
+def process_archive(source, processor, label=None, output_dir=None, workers=None):
+    """
+    用 processor 处理压缩包中的每张发票，返回每个成员的 InvoiceResult。
+    source 为路径或可 seek 的文件对象；label 是结果中压缩包的显示名；
+    output_dir 为空时只识别不落盘，否则识别后的成员按布局写入该目录
+    """
+    label = label or (os.path.basename(source) if isinstance(source, str) else "archive.zip")
+    if workers is None:
+        workers = int(config.get("archive_workers", 0)) or executors.workers_for("process")
+    reader = ArchiveReader(source)
+    members = ((f"{label}/{name}", data) for name, data in reader)
+    results = []
+    try:
+        # 逐个收集：读取中途超限时，已处理（可能已落盘）的成员结果仍然保留
+        for result in processor.process_many(members, workers=workers, output_dir=output_dir):
+            results.append(result)
+    except (ArchiveLimitError, zipfile.BadZipFile) as e:
+        logging.error(f"导入压缩包失败 {label}: {e}")
+        result = InvoiceResult(label)
+        result.error = str(e)
+        results.append(result)
+    for name, error in reader.errors:
+        logging.warning(f"跳过压缩包成员 {label}/{name}: {error}")
+        result = InvoiceResult(f"{label}/{name}")
+        result.error = error
+        results.append(result)
+    logging.info(f"压缩包 {label} 处理完成: {sum(r.success for r in results)}/{len(results)} 个成员成功")
+    return results
+
+
+def ingest_file(path, processor, workers=None):
+    """
+    导入监控目录中的压缩包：成员按布局归档到压缩包所在目录，
+    压缩包本身移入 IMPORTED_DIR，避免重启补扫时再次导入
+    """
+    base_dir = output_layout.default_base_dir(path)
+    try:
+        return process_archive(path, processor, output_dir=base_dir, workers=workers)
+    finally:
+        imported = output_layout.place(path, os.path.basename(path),
+                                       base_dir=os.path.join(base_dir, IMPORTED_DIR), layout="flat")
+        logging.info(f"压缩包已移入: {imported}")
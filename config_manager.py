@@ -21,8 +21,77 @@ class ConfigManager:
             "rename_with_amount": True,
             "ui_port": 8080,
             "log_level": "INFO",
+            "log_format": "text",
+            "log_debug_sample": 1.0,
             "temp_dir": "./tmp",
-            "supported_formats": [".pdf", ".ofd"]
+            "supported_formats": [".pdf", ".ofd"],
+            "metrics_enabled": True,
+            "profile_enabled": False,
+            "profile_threshold_ms": 2000,
+            "profiles_dir": "./profiles",
+            "profile_max_mb": 100,
+            "worker_pool_enabled": False,
+            "render_workers": 0,
+            "decode_workers": 0,
+            "multi_invoice": False,
+            "split_multi_invoice": False,
+            "page_scan_workers": 0,
+            "qr_downscale": 1,
+            "qr_binarize": True,
+            "qr_locate": True,
+            "qr_cache_enabled": True,
+            "qr_cache_size": 512,
+            "qr_cache_path": "./data/qr_location_cache.json",
+            "output_layout": "flat",
+            "rollups_enabled": True,
+            "rollups_path": "./data/rollups.db",
+            "watch_coalesce_ms": 1000,
+            "watch_coalesce_max_ms": 5000,
+            "watch_catchup": True,
+            "scheduler_workers": 0,
+            "scheduler_interactive_limit": 0,
+            "scheduler_watch_limit": 0,
+            "scheduler_catchup_limit": 0,
+            "scheduler_aging_seconds": 30,
+            "scheduler_interactive_reserved": 1,
+            "claim_enabled": False,
+            "node_id": "",
+            "claim_lease_seconds": 120,
+            "watch_backend": "native",
+            "watch_poll_min_ms": 500,
+            "watch_poll_max_ms": 10000,
+            "journal_enabled": True,
+            "journal_path": "./data/journal.log",
+            "journal_fsync": False,
+            "journal_compact_every": 1000,
+            "journal_margin_seconds": 120,
+            "render_memory_budget_mb": 256,
+            "render_buffer_pool_size": 8,
+            "fitz_store_limit_mb": 64,
+            "extract_concurrency": 4,
+            "archive_max_members": 2000,
+            "archive_max_member_mb": 50,
+            "archive_max_total_mb": 512,
+            "archive_max_ratio": 200,
+            "archive_workers": 0,
+            "upload_max_file_mb": 50,
+            "upload_max_files": 500,
+            "admission_max_jobs": 8,
+            "admission_max_queued_mb": 1024,
+            "admission_per_client": 2,
+            "admission_retry_after": 5,
+            "trusted_proxies": "",
+            "executor_render": "auto",
+            "executor_decode": "auto",
+            "executor_process": "auto",
+            "executor_io": "auto",
+            "executor_render_workers": 0,
+            "executor_decode_workers": 0,
+            "executor_process_workers": 0,
+            "executor_io_workers": 0,
+            "executor_autotune": False,
+            "executor_autotune_sample": "",
+            "executor_tune_path": "./data/executor_tune.json"
         }
 
         # 从配置文件加载
@@ -40,7 +109,76 @@ class ConfigManager:
             "RENAME_WITH_AMOUNT": "rename_with_amount",
             "UI_PORT": "ui_port",
             "LOG_LEVEL": "log_level",
-            "TEMP_DIR": "temp_dir"
+            "LOG_FORMAT": "log_format",
+            "LOG_DEBUG_SAMPLE": "log_debug_sample",
+            "TEMP_DIR": "temp_dir",
+            "METRICS_ENABLED": "metrics_enabled",
+            "PROFILE_ENABLED": "profile_enabled",
+            "PROFILE_THRESHOLD_MS": "profile_threshold_ms",
+            "PROFILES_DIR": "profiles_dir",
+            "PROFILE_MAX_MB": "profile_max_mb",
+            "WORKER_POOL_ENABLED": "worker_pool_enabled",
+            "RENDER_WORKERS": "render_workers",
+            "DECODE_WORKERS": "decode_workers",
+            "MULTI_INVOICE": "multi_invoice",
+            "SPLIT_MULTI_INVOICE": "split_multi_invoice",
+            "PAGE_SCAN_WORKERS": "page_scan_workers",
+            "QR_DOWNSCALE": "qr_downscale",
+            "QR_BINARIZE": "qr_binarize",
+            "QR_LOCATE": "qr_locate",
+            "QR_CACHE_ENABLED": "qr_cache_enabled",
+            "QR_CACHE_SIZE": "qr_cache_size",
+            "QR_CACHE_PATH": "qr_cache_path",
+            "OUTPUT_LAYOUT": "output_layout",
+            "ROLLUPS_ENABLED": "rollups_enabled",
+            "ROLLUPS_PATH": "rollups_path",
+            "WATCH_COALESCE_MS": "watch_coalesce_ms",
+            "WATCH_COALESCE_MAX_MS": "watch_coalesce_max_ms",
+            "WATCH_CATCHUP": "watch_catchup",
+            "SCHEDULER_WORKERS": "scheduler_workers",
+            "SCHEDULER_INTERACTIVE_LIMIT": "scheduler_interactive_limit",
+            "SCHEDULER_WATCH_LIMIT": "scheduler_watch_limit",
+            "SCHEDULER_CATCHUP_LIMIT": "scheduler_catchup_limit",
+            "SCHEDULER_AGING_SECONDS": "scheduler_aging_seconds",
+            "SCHEDULER_INTERACTIVE_RESERVED": "scheduler_interactive_reserved",
+            "CLAIM_ENABLED": "claim_enabled",
+            "NODE_ID": "node_id",
+            "CLAIM_LEASE_SECONDS": "claim_lease_seconds",
+            "WATCH_BACKEND": "watch_backend",
+            "WATCH_POLL_MIN_MS": "watch_poll_min_ms",
+            "WATCH_POLL_MAX_MS": "watch_poll_max_ms",
+            "JOURNAL_ENABLED": "journal_enabled",
+            "JOURNAL_PATH": "journal_path",
+            "JOURNAL_FSYNC": "journal_fsync",
+            "JOURNAL_COMPACT_EVERY": "journal_compact_every",
+            "JOURNAL_MARGIN_SECONDS": "journal_margin_seconds",
+            "RENDER_MEMORY_BUDGET_MB": "render_memory_budget_mb",
+            "RENDER_BUFFER_POOL_SIZE": "render_buffer_pool_size",
+            "FITZ_STORE_LIMIT_MB": "fitz_store_limit_mb",
+            "EXTRACT_CONCURRENCY": "extract_concurrency",
+            "ARCHIVE_MAX_MEMBERS": "archive_max_members",
+            "ARCHIVE_MAX_MEMBER_MB": "archive_max_member_mb",
+            "ARCHIVE_MAX_TOTAL_MB": "archive_max_total_mb",
+            "ARCHIVE_MAX_RATIO": "archive_max_ratio",
+            "ARCHIVE_WORKERS": "archive_workers",
+            "UPLOAD_MAX_FILE_MB": "upload_max_file_mb",
+            "UPLOAD_MAX_FILES": "upload_max_files",
+            "ADMISSION_MAX_JOBS": "admission_max_jobs",
+            "ADMISSION_MAX_QUEUED_MB": "admission_max_queued_mb",
+            "ADMISSION_PER_CLIENT": "admission_per_client",
+            "ADMISSION_RETRY_AFTER": "admission_retry_after",
+            "TRUSTED_PROXIES": "trusted_proxies",
+            "EXECUTOR_RENDER": "executor_render",
+            "EXECUTOR_DECODE": "executor_decode",
+            "EXECUTOR_PROCESS": "executor_process",
+            "EXECUTOR_IO": "executor_io",
+            "EXECUTOR_RENDER_WORKERS": "executor_render_workers",
+            "EXECUTOR_DECODE_WORKERS": "executor_decode_workers",
+            "EXECUTOR_PROCESS_WORKERS": "executor_process_workers",
+            "EXECUTOR_IO_WORKERS": "executor_io_workers",
+            "EXECUTOR_AUTOTUNE": "executor_autotune",
+            "EXECUTOR_AUTOTUNE_SAMPLE": "executor_autotune_sample",
+            "EXECUTOR_TUNE_PATH": "executor_tune_path"
         }
 
         for env_key, config_key in env_mapping.items():
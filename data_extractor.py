@@ -1,24 +1,39 @@
-from PIL import Image
 import re
-import fitz  # PyMuPDF, 用于读取PDF文件
-from pyzbar.pyzbar import decode
 import logging
+import metrics
 
-def scan_qrcode(image_path):
+# 二维码数据和PDF文本层共用的识别规则
+# 发票号码：20位（数电票）或8位；排除日期等以"-数字"相连的数字串
+INVOICE_NUMBER_RE = re.compile(r"(?<!-\d)\b\d{20}\b|(?<!-\d)\b\d{8}\b")
+# 带货币符号的金额，文本层中取最大者作为价税合计
+CURRENCY_AMOUNT_RE = re.compile(r"¥\s*(\d+\.\d+)")
+# 二维码数据中依次尝试的金额格式
+AMOUNT_PATTERNS = (
+    re.compile(r"(\d+\.\d+)(?=,)"),  # 标准格式：数字.数字,
+    re.compile(r"金额[:：]\s*(\d+\.\d+)"),  # 带"金额"标识
+    CURRENCY_AMOUNT_RE,  # 带货币符号
+    re.compile(r"[^\d](\d+\.\d+)[^\d]"),  # 通用数字格式
+)
+
+def decode_qrcode_array(gray):
     """
-    使用 pyzbar 扫描二维码
+    识别灰度数组中的二维码，返回 (二维码数据, 在灰度图中的像素框 (x0, y0, x1, y1))；
+    未识别到时返回 (None, None)
     """
-    try:
-        image = Image.open(image_path)
-        decoded_objects = decode(image)
-        if decoded_objects:
-            qr_data = decoded_objects[0].data.decode('utf-8')
-            logging.debug(f"成功识别二维码: {qr_data}")
-            return qr_data
-        return None
-    except Exception as e:
-        logging.debug(f"扫描二维码失败: {e}")
-        return None
+    from pyzbar.pyzbar import decode
+    from qr_preprocess import decode_candidates_with_origin
+    with metrics.timed("qr_decode"):
+        for candidate, x0, y0, scale in decode_candidates_with_origin(gray):
+            decoded_objects = decode(candidate)
+            if decoded_objects:
+                obj = decoded_objects[0]
+                left, top, width, height = obj.rect
+                box = (x0 + left * scale, y0 + top * scale,
+                       x0 + (left + width) * scale, y0 + (top + height) * scale)
+                metrics.qr_decodes.inc(result="hit")
+                return obj.data.decode('utf-8'), box
+    metrics.qr_decodes.inc(result="miss")
+    return None, None
 
 def extract_information(data_str):
     """
@@ -29,55 +44,88 @@ def extract_information(data_str):
     
     try:
         # 提取发票号码（支持20位和8位格式）
-        invoice_match = re.search(r"\b\d{20}\b|\b\d{8}\b", data_str)
+        invoice_match = INVOICE_NUMBER_RE.search(data_str)
         if invoice_match:
             invoice_number = invoice_match.group(0)
-            logging.debug(f"提取到发票号码: {invoice_number}")
+            logging.debug("提取到发票号码: %s", invoice_number)
         
         # 提取金额（支持多种格式）
-        amount_patterns = [
-            r"(\d+\.\d+)(?=,)",  # 标准格式：数字.数字,
-            r"金额[:：]\s*(\d+\.\d+)",  # 带"金额"标识
-            r"¥\s*(\d+\.\d+)",  # 带货币符号
-            r"[^\d](\d+\.\d+)[^\d]"  # 通用数字格式
-        ]
-        
-        for pattern in amount_patterns:
-            amount_match = re.search(pattern, data_str)
+        for pattern in AMOUNT_PATTERNS:
+            amount_match = pattern.search(data_str)
             if amount_match:
                 amount = round(float(amount_match.group(1)), 2)
                 amount = "{:.2f}".format(amount)
-                logging.debug(f"提取到金额: {amount}")
+                logging.debug("提取到金额: %s", amount)
                 break
     except Exception as e:
-        logging.debug(f"提取信息时出错: {e}")
+        logging.debug("提取信息时出错: %s", e)
     
     return invoice_number, amount
 
-def extract_information_from_pdf(data_str, file_path):
+def extract_date(data_str):
     """
-    从PDF文件中提取发票信息，包括二维码数据和文本内容
+    从二维码数据中提取开票日期（YYYYMMDD），
+    标准格式第6个字段为日期：01,类型,代码,号码,金额,日期,校验码,...
     """
-    # 首先从二维码数据中提取信息
-    invoice_number, amount = extract_information(data_str)
+    fields = [field.strip() for field in data_str.split(",")]
+    if len(fields) > 5 and re.fullmatch(r"\d{8}", fields[5]):
+        return fields[5]
+    match = re.search(r"(?<!\d)(20\d{2}(?:0[1-9]|1[0-2])(?:0[1-9]|[12]\d|3[01]))(?!\d)", data_str)
+    return match.group(1) if match else None
 
-    # 如果发票号码存在但金额未找到，或发票号码是8位格式，则尝试从PDF文本中提取
-    if invoice_number and (not amount or len(invoice_number) == 8):
-        text = ""
-        try:
-            doc = fitz.open(file_path)
-            for page in doc:
-                text += page.get_text()
-            doc.close()
-            
-            # 从文本中提取所有金额
-            amount_matches = re.findall(r"¥\s*(\d+\.\d+)", text)
-            if amount_matches:
-                amounts = [float(x) for x in amount_matches]
-                max_amount = max(amounts)  # 使用最大金额
-                amount = "{:.2f}".format(max_amount)
-                logging.debug(f"从PDF提取到最大金额: {amount}")
-        except Exception as e:
-            logging.debug(f"从PDF提取信息时出错: {e}")
-    
-    return invoice_number, amount
\ No newline at end of file
+# 二维码第2个字段的发票类型代码
+INVOICE_TYPES = {
+    "01": "增值税专用发票",
+    "04": "增值税普通发票",
+    "08": "增值税电子专用发票",
+    "10": "增值税电子普通发票",
+    "31": "电子发票(增值税专用发票)",
+    "32": "电子发票(普通发票)",
+}
+
+def extract_invoice_type(data_str):
+    """从二维码数据中提取发票类型"""
+    fields = [field.strip() for field in data_str.split(",")]
+    if len(fields) > 1 and fields[1]:
+        return INVOICE_TYPES.get(fields[1], fields[1])
+    return None
+
+def extract_invoice_code(data_str):
+    """从二维码数据中提取发票代码（第3个字段，数电票为空）"""
+    fields = [field.strip() for field in data_str.split(",")]
+    if len(fields) > 2 and re.fullmatch(r"\d{10,12}", fields[2]):
+        return fields[2]
+    return None
+
+def extract_invoice_code_from_text(text):
+    """从PDF文本中提取发票代码"""
+    match = re.search(r"发票代码\s*[:：]?\s*(\d{10,12})(?!\d)", text)
+    return match.group(1) if match else None
+
+def extract_date_from_text(text):
+    """从PDF文本中提取开票日期（YYYYMMDD）"""
+    match = re.search(r"(20\d{2})\s*年\s*(\d{1,2})\s*月\s*(\d{1,2})\s*日", text)
+    if match:
+        year, month, day = match.groups()
+        return f"{year}{int(month):02d}{int(day):02d}"
+    return None
+
+def extract_seller_tax_id(text):
+    """从PDF文本中提取销售方纳税人识别号（统一社会信用代码）"""
+    pattern = r"(?<![0-9A-Z])[0-9A-HJ-NPQRTUWXY]{2}\d{6}[0-9A-HJ-NPQRTUWXY]{10}(?![0-9A-Z])"
+    seller_pos = max(text.rfind("销售方"), text.rfind("销方"))
+    if seller_pos >= 0:
+        match = re.search(pattern, text[seller_pos:])
+        if match:
+            return match.group(0)
+    # 没有"销售方"标记时，购买方通常在前，取最后一个
+    matches = re.findall(pattern, text)
+    return matches[-1] if matches else None
+
+def extract_max_amount(text):
+    """从PDF文本中提取最大的带货币符号金额（价税合计），未找到时返回 None"""
+    with metrics.timed("text_regex"):
+        amounts = CURRENCY_AMOUNT_RE.findall(text)
+    if not amounts:
+        return None
+    return "{:.2f}".format(max(map(float, amounts)))
@@ -0,0 +1,170 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from watchdog.events import FileSystemEventHandler
+from config_manager import config
+import metrics
+import output_layout
+import work_claim
+import journal
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.ofd')
+
+
+class EventCoalescer(FileSystemEventHandler):
+    """
+    把 watchdog 的原始事件合并成批次后再分发：
+    - 同时处理新建（on_created）与移入（on_moved），修改事件只刷新等待时间
+    - 按路径去重，分发前再按 inode 去重（硬链接、先建后移等情况）
+    - 忽略已处理的文件、本程序归档时自身重命名产生的事件，以及多节点认领目录中的事件
+    - 目录安静 window 秒后（最长等待 max_delay 秒）把整批路径一次交给 on_batch
+    """
+
+    def __init__(self, on_batch, extensions=SUPPORTED_EXTENSIONS, window=None, max_delay=None, recursive=False):
+        self.on_batch = on_batch
+        self.extensions = tuple(extensions)
+        self.window = window if window is not None else config.get("watch_coalesce_ms", 1000) / 1000.0
+        self.max_delay = max_delay if max_delay is not None else config.get("watch_coalesce_max_ms", 5000) / 1000.0
+        self.recursive = recursive
+        self._pending = OrderedDict()
+        self._first_event = None
+        self._last_event = None
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def is_supported_file(self, path):
+        """与启动补处理使用同一判断：扩展名受支持、非隐藏文件、尚未重命名为 [¥金额]发票号码"""
+        return journal.is_candidate(os.path.basename(path), self.extensions)
+
+    # -- watchdog 回调 -------------------------------------------------
+
+    def on_created(self, event):
+        if event.is_directory:
+            self._add_tree(event.src_path)
+        else:
+            self._add(event.src_path)
+
+    def on_moved(self, event):
+        # 移出的旧路径不再需要处理，移入的新路径视为新文件
+        self._discard(event.src_path)
+        if event.is_directory:
+            self._add_tree(event.dest_path)
+        else:
+            self._add(event.dest_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self._discard(event.src_path)
+
+    def on_modified(self, event):
+        # 文件仍在写入，推迟本批次分发
+        if not event.is_directory:
+            with self._cond:
+                if os.path.abspath(event.src_path) in self._pending:
+                    self._last_event = time.monotonic()
+
+    # -- 批次收集 ------------------------------------------------------
+
+    def _add(self, path):
+        if not self.is_supported_file(path) or output_layout.was_placed(path) or work_claim.is_claim_path(path):
+            return
+        key = os.path.abspath(path)
+        now = time.monotonic()
+        with self._cond:
+            self._pending[key] = now
+            self._pending.move_to_end(key)
+            if self._first_event is None:
+                self._first_event = now
+            self._last_event = now
+            metrics.queue_depth.set(len(self._pending), queue="watch_pending")
+            self._cond.notify()
+
+    def _discard(self, path):
+        with self._cond:
+            self._pending.pop(os.path.abspath(path), None)
+
+    def _add_tree(self, directory):
+        """整个目录被复制或移入时，其中的文件不一定各自产生事件，主动扫描一遍"""
+        if not self.recursive:
+            return
+        stack = [directory]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name != work_claim.CLAIM_DIR:
+                                stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            self._add(entry.path)
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+
+    def _take_batch(self):
+        """阻塞直到有一批事件可以分发，返回路径列表；停止时返回 None"""
+        with self._cond:
+            while not self._stopped:
+                if not self._pending:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                quiet_left = self.window - (now - self._last_event)
+                delay_left = self.max_delay - (now - self._first_event)
+                if quiet_left > 0 and delay_left > 0:
+                    self._cond.wait(min(quiet_left, delay_left))
+                    continue
+                batch = list(self._pending)
+                self._pending.clear()
+                self._first_event = self._last_event = None
+                metrics.queue_depth.set(0, queue="watch_pending")
+                return batch
+        return None
+
+    @staticmethod
+    def _dedupe(paths):
+        """去掉已不存在的文件，并按 (设备, inode) 去重，保留最后出现的路径"""
+        by_inode = OrderedDict()
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            key = (st.st_dev, st.st_ino)
+            by_inode.pop(key, None)
+            by_inode[key] = path
+        return list(by_inode.values())
+
+    # -- 生命周期 ------------------------------------------------------
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            batch = [path for path in self._dedupe(batch) if not output_layout.was_placed(path)]
+            if not batch:
+                continue
+            logging.info(f"合并 {len(batch)} 个文件事件，开始批量处理")
+            # 接收即记入处理日志，排队期间崩溃也能在重启时恢复
+            processing_journal = journal.get_journal()
+            if processing_journal is not None:
+                processing_journal.intent(batch)
+            try:
+                self.on_batch(batch)
+            except Exception as e:
+                logging.error(f"批量处理文件事件失败: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="event-coalescer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
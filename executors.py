@@ -0,0 +1,265 @@
+"""
+各处理阶段的执行后端与线程/进程数
+
+阶段及可选后端（executor_<阶段>，默认 auto）：
+- render:  serial（在调用线程中渲染）| process（预热的渲染进程池，见 worker_pool）
+- decode:  serial | thread（识别线程池，pyzbar 在 C 代码中释放 GIL）| process（识别进程池）
+- process: serial | thread  单个文件的整体处理（调度器、命令行批量、目录监控、压缩包成员）
+- io:      serial | thread  文件读取、移动、删除与打包，避免阻塞事件循环
+MuPDF 不支持多线程渲染，render 没有 thread 后端；render 或 decode 为 process 时启用进程池。
+
+线程/进程数取 executor_<阶段>_workers，为 0 时取自动调优结果，否则按 CPU 核数估算。
+executor_autotune 开启时，启动阶段在样例页（executor_autotune_sample，默认合成页）上测量
+单页渲染耗时和识别线程的扩展性，据此选择后端和数量；结果按 CPU 核数缓存到 executor_tune_path。
+
+with serial(): 期间当前上下文中所有阶段都按 serial 执行（剖析慢文件时使用，见 profiler.call）。
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from config_manager import config
+
+STAGES = ("render", "decode", "process", "io")
+BACKENDS = {
+    "render": ("serial", "process"),
+    "decode": ("serial", "thread", "process"),
+    "process": ("serial", "thread"),
+    "io": ("serial", "thread"),
+}
+
+# 进程池之间传递像素的额外开销，估算进程后端吞吐时打折
+_PROCESS_EFFICIENCY = 0.8
+
+_tuned = {}          # 阶段 -> (后端, 数量)
+_tuned_done = False
+_executors = {}
+_lock = threading.Lock()
+_serial_only = contextvars.ContextVar("serial_only", default=False)
+
+
+class SerialExecutor(Executor):
+    """在调用线程中立即执行的执行器，返回已完成的 Future"""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+def _cpus():
+    return os.cpu_count() or 1
+
+
+@contextmanager
+def serial():
+    """在上下文中强制所有阶段在调用线程中执行"""
+    token = _serial_only.set(True)
+    try:
+        yield
+    finally:
+        _serial_only.reset(token)
+
+
+def forced_serial():
+    return _serial_only.get()
+
+
+def backend(stage):
+    """阶段当前使用的后端"""
+    if _serial_only.get():
+        return "serial"
+    value = str(config.get(f"executor_{stage}", "auto")).lower()
+    if value != "auto":
+        if value not in BACKENDS[stage]:
+            logging.warning(f"阶段 {stage} 不支持后端 {value}，使用自动选择")
+        else:
+            return value
+    if stage in _tuned:
+        return _tuned[stage][0]
+    if stage in ("render", "decode"):
+        return "process" if config.get("worker_pool_enabled", False) else ("serial" if stage == "render" else "thread")
+    return "thread"
+
+
+def workers_for(stage):
+    """阶段的线程/进程数；serial 后端为 1"""
+    stage_backend = backend(stage)
+    if stage_backend == "serial":
+        return 1
+    configured = int(config.get(f"executor_{stage}_workers", 0))
+    if configured > 0:
+        return configured
+    if stage in _tuned and _tuned[stage][0] == stage_backend:
+        return _tuned[stage][1]
+    return _default_workers(stage, stage_backend)
+
+
+def _default_workers(stage, stage_backend):
+    cpus = _cpus()
+    if stage_backend == "process":
+        render = max(1, cpus // 2)
+        return render if stage == "render" else max(1, cpus - render)
+    if stage == "io":
+        return min(32, cpus * 4)
+    return min(4, cpus)
+
+
+def get_executor(stage):
+    """阶段共享的执行器：serial 阶段返回 SerialExecutor，其它返回线程池"""
+    if _serial_only.get():
+        return SerialExecutor()
+    with _lock:
+        executor = _executors.get(stage)
+        if executor is None:
+            if backend(stage) == "serial":
+                executor = SerialExecutor()
+            else:
+                executor = ThreadPoolExecutor(max_workers=workers_for(stage), thread_name_prefix=f"exec-{stage}")
+            _executors[stage] = executor
+        return executor
+
+
+def imap(stage, fn, iterable):
+    """按输入顺序返回结果；serial 阶段逐个在调用线程中执行"""
+    if backend(stage) == "serial":
+        return (fn(item) for item in iterable)
+    # 线程池中的任务沿用调用者的上下文（日志 trace 等）
+    context = contextvars.copy_context()
+    return get_executor(stage).map(lambda item: context.copy().run(fn, item), iterable)
+
+
+def describe():
+    return {stage: {"backend": backend(stage), "workers": workers_for(stage)} for stage in STAGES}
+
+
+@atexit.register
+def _shutdown():
+    with _lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=False)
+        _executors.clear()
+
+
+# -- 自动调优 ----------------------------------------------------------
+
+def _sample_pdf():
+    """调优用的样例文档字节；未配置样例时合成一页带文字和线框的 A4"""
+    sample = config.get("executor_autotune_sample", "")
+    if sample and os.path.exists(sample):
+        with open(sample, "rb") as f:
+            return f.read()
+    import fitz
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)
+    for i in range(40):
+        page.insert_text((40, 40 + i * 19), f"{i:02d} " + "0123456789 ABCDEFGHIJ " * 3, fontsize=9)
+        page.draw_rect(fitz.Rect(30, 28 + i * 19, 565, 44 + i * 19), width=0.3)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def _render(data, dpi=300):
+    import fitz
+    from qr_preprocess import pixmap_to_gray
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        pix = doc.load_page(0).get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+        return pixmap_to_gray(pix).copy()
+
+
+def _rate(fn, workers, tasks):
+    """workers 个线程完成 tasks 个任务的吞吐（个/秒）"""
+    start = time.perf_counter()
+    if workers == 1:
+        for _ in range(tasks):
+            fn()
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda _: fn(), range(tasks)))
+    return tasks / (time.perf_counter() - start)
+
+
+def measure(rounds=4):
+    """测量本机各阶段吞吐并返回 {阶段: (后端, 数量)}"""
+    from data_extractor import decode_qrcode_array
+    cpus = _cpus()
+    data = _sample_pdf()
+    gray = _render(data)
+    # 预热：首次导入和初始化不计入
+    decode_qrcode_array(gray)
+
+    render_rate = _rate(lambda: _render(data), 1, rounds)
+    counts = sorted({1, *(n for n in (2, 4, 8, 16, 32) if n < cpus), cpus})
+    decode_rates = {n: _rate(lambda: decode_qrcode_array(gray), n, rounds * n) for n in counts}
+    peak = max(decode_rates.values())
+    decode_threads = min(n for n, rate in decode_rates.items() if rate >= 0.9 * peak)
+
+    # 线程流水线：渲染在处理线程中串行，识别由线程池并行
+    thread_rate = min(render_rate, peak)
+    # 进程流水线：按单页耗时比例把核数分给渲染和识别
+    render_share = (1 / render_rate) / (1 / render_rate + 1 / decode_rates[1])
+    render_procs = min(cpus - 1, max(1, round(cpus * render_share))) if cpus > 1 else 1
+    decode_procs = max(1, cpus - render_procs)
+    process_rate = _PROCESS_EFFICIENCY * min(render_procs * render_rate, decode_procs * decode_rates[1])
+
+    logging.info(
+        f"执行器调优: {cpus} 核, 渲染 {render_rate:.1f} 页/秒, "
+        f"识别 {', '.join(f'{n}线程 {rate:.1f}' for n, rate in decode_rates.items())} 页/秒, "
+        f"线程流水线 {thread_rate:.1f}, 进程流水线 {process_rate:.1f}")
+    if cpus > 1 and process_rate > thread_rate:
+        tuned = {"render": ("process", render_procs), "decode": ("process", decode_procs),
+                 "process": ("thread", min(2 * cpus, render_procs + decode_procs))}
+    else:
+        tuned = {"render": ("serial", 1), "decode": ("thread", decode_threads),
+                 "process": ("thread", max(1, min(cpus, 4)))}
+    tuned["io"] = ("thread", min(32, cpus * 4))
+    return tuned
+
+
+def autotune(force=False):
+    """executor_autotune 开启时确定各阶段后端和数量；同一进程只调优一次，结果按核数缓存"""
+    global _tuned_done
+    if not config.get("executor_autotune", False) and not force:
+        return None
+    with _lock:
+        if _tuned_done and not force:
+            return dict(_tuned)
+        path = config.get("executor_tune_path", "./data/executor_tune.json")
+        tuned = None
+        if path and not force:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    cached = json.load(f)
+                if cached.get("cpus") == _cpus():
+                    tuned = {stage: tuple(value) for stage, value in cached["stages"].items()}
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logging.warning(f"读取执行器调优结果失败 {path}: {e}")
+        if tuned is None:
+            try:
+                tuned = measure()
+            except Exception as e:
+                logging.error(f"执行器调优失败，使用默认配置: {e}")
+                tuned = {}
+            if tuned and path:
+                try:
+                    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                    with open(path, "w", encoding="utf-8") as f:
+                        json.dump({"cpus": _cpus(), "stages": tuned}, f)
+                except OSError as e:
+                    logging.warning(f"保存执行器调优结果失败 {path}: {e}")
+        _tuned.clear()
+        _tuned.update(tuned)
+        _tuned_done = True
+    logging.info(f"执行器配置: {describe()}")
+    return dict(_tuned)
@@ -1,26 +1,11 @@
 import os
-import logging
 
-def ensure_dir(directory):
-    try:
-        logging.debug(f"Ensuring directory exists: {directory}")
-        os.makedirs(directory, exist_ok=True)
-    except Exception as e:
-        logging.debug(f"Error in ensuring directory exists: {e}")
-
-def rename_file(old_path, new_name):
-    try:
-        new_path = os.path.join(os.path.dirname(old_path), new_name)
-        logging.debug(f"Renaming file from {old_path} to {new_path}")
-        os.rename(old_path, new_path)
-        return new_path
-    except Exception as e:
-        logging.debug(f"Error in renaming file: {e}")
-
-def clean_up(*paths):
-    for path in paths:
-        try:
-            logging.debug(f"Removing file: {path}")
-            os.remove(path)
-        except Exception as e:
-            logging.debug(f"Error in removing file: {e}")
\ No newline at end of file
+def unique_path(directory, file_name):
+    """返回目录中不冲突的文件路径，重名时追加 _1、_2 …"""
+    new_path = os.path.join(directory, file_name)
+    base_name, ext = os.path.splitext(file_name)
+    counter = 1
+    while os.path.exists(new_path):
+        new_path = os.path.join(directory, f"{base_name}_{counter}{ext}")
+        counter += 1
+    return new_path
@@ -0,0 +1,84 @@
+"""
+入口模块导入耗时检查
+
+使用 `python -X importtime` 统计各入口模块的导入耗时，并确认重量级依赖
+（fitz、cv2、numpy、PIL、pyzbar）没有在导入阶段被加载。
+
+用法: python import_benchmark.py [--budget-ms 800] [--top 10] [模块 ...]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+DEFAULT_MODULES = ["main", "monitor", "sum", "web_app", "web_app_vercel"]
+
+# 这些依赖必须在首次使用时才加载
+HEAVY_MODULES = {"fitz", "pymupdf", "cv2", "numpy", "PIL", "pyzbar"}
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(module):
+    """返回 (总耗时微秒, [(累计微秒, 自身微秒, 模块名)], 错误信息)"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    entries = []
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = int(match.group(1)), int(match.group(2)), match.group(3), match.group(4)
+        if len(indent) == 1:
+            # 顶层导入：解释器启动时的 site 等模块与目标模块无关，丢弃之前的记录
+            if name == module:
+                total_us = cumulative_us
+                entries.append((cumulative_us, self_us, name))
+                break
+            entries = []
+            continue
+        entries.append((cumulative_us, self_us, name))
+    error = None
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed"
+    return total_us, entries, error
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查入口模块的导入耗时")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--budget-ms", type=float, default=800.0, help="单个模块允许的最大导入耗时")
+    parser.add_argument("--top", type=int, default=10, help="显示累计耗时最高的前N个依赖")
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        total_us, entries, error = measure(module)
+        print(f"== {module}: {total_us / 1000:.1f} ms")
+        if error:
+            print(f"   导入失败: {error}")
+            failed = True
+            continue
+
+        for cumulative_us, self_us, name in sorted(entries, reverse=True)[:args.top]:
+            print(f"   {cumulative_us / 1000:8.1f} ms  (self {self_us / 1000:6.1f} ms)  {name}")
+
+        heavy = sorted({name for _, _, name in entries if name.split(".")[0] in HEAVY_MODULES})
+        if heavy:
+            print(f"   错误: 导入阶段加载了重量级依赖: {', '.join(heavy)}")
+            failed = True
+        if total_us / 1000 > args.budget_ms:
+            print(f"   错误: 超出导入耗时预算 {args.budget_ms:.0f} ms")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+"""
+统一的发票处理引擎
+
+命令行、目录监控、Web 上传和 Vercel 入口都通过 InvoiceProcessor 处理发票：
+识别策略、重命名、归档、汇总和指标只在这里实现一次。
+
+    processor = InvoiceProcessor(layout="flat", track=False)
+    result = processor.process("invoice.pdf")              # 文件：识别后归档
+    result = processor.process("invoice.pdf", data=b"...")  # 内存中的字节：只识别和命名
+    result = processor.process("a.pdf", data=b"...", output_dir="out")  # 内存中的字节：识别后写入 out
+    for result in processor.process_many(paths): ...
+
+识别策略：
+- qr:   渲染页面并识别二维码（PDF 只看第一页，OFD 逐页直到找到），
+        发票号码为8位或二维码中没有金额时再从文本中取最大金额
+- text: 从文本层中提取发票号码和最大金额
+"""
+import contextvars
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from config_manager import config
+from data_extractor import (INVOICE_NUMBER_RE, extract_information, extract_date, extract_invoice_type,
+                            extract_invoice_code, extract_invoice_code_from_text, extract_date_from_text,
+                            extract_max_amount, extract_seller_tax_id)
+from pdf_processor import create_new_filename
+from page_pipeline import iter_page_qrcodes, process_multi_invoice
+import metrics
+import log_setup
+import memory_governor
+import output_layout
+import rollups
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.ofd')
+
+
+class InvoiceResult:
+    """单个文件的处理结果"""
+    __slots__ = ("source", "invoice_code", "invoice_number", "amount", "date", "seller", "invoice_type",
+                 "strategy", "new_name", "path", "timings", "error", "parts")
+
+    def __init__(self, source):
+        self.source = source
+        self.invoice_code = None     # 发票代码（数电票没有）
+        self.invoice_number = None
+        self.amount = None
+        self.date = None
+        self.seller = None
+        self.invoice_type = None
+        self.strategy = None     # qr / qr+text / text / multi
+        self.new_name = None     # 新文件名
+        self.path = None         # 归档后的路径（内存中处理时为 None）
+        self.timings = {}        # 阶段 -> 秒
+        self.error = None
+        self.parts = None        # 多发票模式下每张发票的结果
+
+    @property
+    def success(self):
+        return self.new_name is not None
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in self.__slots__ if name != "parts"}
+        data["success"] = self.success
+        if self.parts is not None:
+            data["parts"] = [part.to_dict() for part in self.parts]
+        return data
+
+    def __repr__(self):
+        return (f"InvoiceResult({self.source!r}, number={self.invoice_number!r}, amount={self.amount!r}, "
+                f"strategy={self.strategy!r}, path={self.path or self.new_name!r})")
+
+
+class _Document:
+    """待处理的文档：按需打开一次，文本层只提取一次"""
+    __slots__ = ("path", "data", "ext", "output_dir", "_doc", "_text")
+
+    def __init__(self, path, data, ext, output_dir=None):
+        self.path = path
+        self.data = data
+        self.ext = ext
+        self.output_dir = output_dir
+        self._doc = None
+        self._text = None
+
+    def open(self):
+        if self._doc is None:
+            import fitz
+            with metrics.timed("fitz_open"):
+                if self.data is not None:
+                    self._doc = fitz.open(stream=self.data, filetype=self.ext[1:])
+                else:
+                    self._doc = fitz.open(self.path)
+        return self._doc
+
+    def text(self):
+        if self._text is None:
+            doc = self.open()
+            with metrics.timed("text_extract"):
+                self._text = "".join(page.get_text() for page in doc)
+        return self._text
+
+    def close(self):
+        if self._doc is not None:
+            self._doc.close()
+            self._doc = None
+
+
+class InvoiceProcessor:
+    """
+    layout:             输出布局，None 时取配置
+    track:              是否计入发票汇总
+    rename_with_amount: 新文件名是否带金额，None 时取配置
+    pdf_strategies:     PDF 依次尝试的识别策略；OFD 没有文本层，总是识别二维码
+    multi_invoice:      PDF 是否按合并的多张发票处理，None 时取配置
+    decoder:            自定义二维码识别函数 (灰度数组) -> 数据，默认使用 pyzbar 流水线
+    """
+
+    def __init__(self, layout=None, track=True, rename_with_amount=None, pdf_strategies=("qr", "text"),
+                 multi_invoice=None, decoder=None, dpi=300):
+        self.layout = layout
+        self.track = track
+        self.rename_with_amount = rename_with_amount
+        self.pdf_strategies = tuple(pdf_strategies)
+        self.multi_invoice = config.get("multi_invoice", False) if multi_invoice is None else multi_invoice
+        self.decoder = decoder
+        self.dpi = dpi
+
+    # -- 对外接口 ------------------------------------------------------
+
+    def process(self, source, data=None, output_dir=None):
+        """
+        处理单个文件；data 为文件内容时 source 只用作文件名，
+        给出 output_dir 时把识别后的内容按布局写入该目录，否则不落盘也不归档
+        """
+        ext = os.path.splitext(source)[1].lower()
+        result = InvoiceResult(source)
+        doc = _Document(None if data is not None else source, data, ext, output_dir if data is not None else None)
+        with log_setup.trace(os.path.basename(source)):
+            start = time.perf_counter()
+            try:
+                with memory_governor.job(source):
+                    if ext not in SUPPORTED_EXTENSIONS:
+                        result.error = f"不支持的文件格式: {ext}"
+                    else:
+                        self._process(doc, result)
+            except Exception as e:
+                logging.error("处理文件时出错 %s: %s", source, e)
+                result.error = str(e)
+            finally:
+                doc.close()
+                result.timings["total"] = time.perf_counter() - start
+            if ext in SUPPORTED_EXTENSIONS:
+                metrics.files_processed.inc(format=ext[1:], result="success" if result.success else "failed")
+            if logging.getLogger().isEnabledFor(logging.INFO):
+                log_setup.event(logging.INFO, "发票处理完成", strategy=result.strategy, success=result.success,
+                                stage_ms={stage: round(seconds * 1000, 1) for stage, seconds in result.timings.items()})
+        return result
+
+    def process_many(self, sources, workers=1, output_dir=None):
+        """
+        批量处理，按输入顺序逐个生成结果；sources 中的元素为路径或 (文件名, 字节) 元组。
+        同一引擎复用缓存、线程池与进程池，workers > 1 时多个文件并行处理；
+        sources 按需读取，同时最多有 workers * 2 个文件在处理中，内存中的文件不会被一次读完。
+        sources 迭代中途出错时，先生成已提交文件的结果再抛出该异常；
+        output_dir 作用于内存中的文件，含义同 process
+        """
+        def run(item):
+            if isinstance(item, tuple):
+                return self.process(item[0], data=item[1], output_dir=output_dir)
+            return self.process(item)
+
+        if workers <= 1:
+            for item in sources:
+                yield run(item)
+            return
+        # 线程池中的任务沿用调用者的日志 trace
+        context = contextvars.copy_context()
+        window = deque()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="invoice") as executor:
+            try:
+                for item in sources:
+                    window.append(executor.submit(context.copy().run, run, item))
+                    if len(window) >= workers * 2:
+                        yield window.popleft().result()
+            except Exception:
+                # 已提交的文件仍会处理完（可能已经落盘），结果不能丢
+                while window:
+                    yield window.popleft().result()
+                raise
+            while window:
+                yield window.popleft().result()
+
+    # -- 识别策略 ------------------------------------------------------
+
+    def _process(self, doc, result):
+        strategies = self.pdf_strategies if doc.ext == ".pdf" else ("qr",)
+        if self.multi_invoice and doc.ext == ".pdf" and doc.path is not None:
+            stage_start = time.perf_counter()
+            found = self._by_multi(doc, result)
+            result.timings["multi"] = time.perf_counter() - stage_start
+            if found:
+                self._finish(doc, result)
+                return
+            # 合并文件中没有识别到二维码，退回文本提取
+            strategies = tuple(s for s in strategies if s != "qr")
+        for strategy in strategies:
+            stage_start = time.perf_counter()
+            found = getattr(self, f"_by_{strategy}")(doc, result)
+            result.timings[strategy] = time.perf_counter() - stage_start
+            if found:
+                self._finish(doc, result)
+                return
+        logging.warning("未能识别发票信息: %s", result.source)
+
+    def _scan_qr(self, doc):
+        """返回第一个识别到的二维码数据"""
+        pages = [0] if doc.ext == ".pdf" else None
+        if doc.data is None and self.decoder is None:
+            # 位置缓存、整页回退以及进程池都由页流水线统一处理
+            scan = iter_page_qrcodes(doc.path, pages=pages, dpi=self.dpi)
+            try:
+                for _, qrcode_data in scan:
+                    if qrcode_data:
+                        return qrcode_data
+            finally:
+                scan.close()
+            return None
+
+        # 内存中的文档或自定义识别函数：逐页渲染后识别
+        import fitz
+        from qr_preprocess import pixmap_to_gray
+        from data_extractor import decode_qrcode_array
+        decoder = self.decoder or (lambda gray: decode_qrcode_array(gray)[0])
+        pdf = doc.open()
+        for page_num in (pages if pages is not None else range(len(pdf))):
+            page = pdf.load_page(page_num)
+            with memory_governor.reserve(memory_governor.page_bytes(page.rect, self.dpi)):
+                with metrics.timed("render"):
+                    pix = page.get_pixmap(dpi=self.dpi, colorspace=fitz.csGRAY)
+                qrcode_data = decoder(pixmap_to_gray(pix))
+                del pix
+            if qrcode_data:
+                return qrcode_data
+        return None
+
+    def _by_qr(self, doc, result):
+        try:
+            qrcode_data = self._scan_qr(doc)
+        except Exception as e:
+            logging.error(f"识别二维码时出错 {result.source}: {e}")
+            return False
+        if not qrcode_data:
+            return False
+        logging.debug("找到二维码数据: %s", qrcode_data)
+        with metrics.timed("qr_parse"):
+            invoice_number, amount = extract_information(qrcode_data)
+        if not invoice_number:
+            return False
+        result.strategy = "qr"
+        # 8位发票号码的二维码金额可能不是价税合计，和缺少金额时一样以文本中的最大金额为准
+        if doc.ext == ".pdf" and (not amount or len(invoice_number) == 8):
+            metrics.text_fallbacks.inc()
+            try:
+                amount = extract_max_amount(doc.text()) or amount
+                result.strategy = "qr+text"
+            except Exception as e:
+                logging.debug("从PDF提取金额时出错: %s", e)
+        result.invoice_code = extract_invoice_code(qrcode_data)
+        result.invoice_number = invoice_number
+        result.amount = amount
+        result.date = extract_date(qrcode_data)
+        result.invoice_type = extract_invoice_type(qrcode_data)
+        return True
+
+    def _by_text(self, doc, result):
+        text = doc.text()
+        with metrics.timed("text_regex"):
+            numbers = INVOICE_NUMBER_RE.findall(text)
+        if not numbers:
+            logging.debug("未找到发票号码")
+            return False
+        metrics.text_fallbacks.inc()
+        result.strategy = "text"
+        result.invoice_code = extract_invoice_code_from_text(text)
+        result.invoice_number = numbers[0]
+        result.amount = extract_max_amount(text)
+        result.date = extract_date_from_text(text)
+        result.seller = extract_seller_tax_id(text)
+        return True
+
+    def _by_multi(self, doc, result):
+        records = process_multi_invoice(doc.path, rename_with_amount=self.rename_with_amount,
+                                        layout=self.layout or output_layout.current_layout())
+        if not records:
+            return False
+        result.strategy = "multi"
+        if len(records) == 1 and records[0]["path"] is None:
+            # 只有一张发票且未拆分：和普通文件一样重命名归档
+            record = records[0]
+            result.invoice_code = record["invoice_code"]
+            result.invoice_number = record["invoice_number"]
+            result.amount = record["amount"]
+            result.date = record["date"]
+            result.invoice_type = record["invoice_type"]
+            result.seller = record["seller"]
+            return True
+        result.parts = []
+        for record in records:
+            part = InvoiceResult(doc.path)
+            part.strategy = "multi"
+            part.invoice_code = record["invoice_code"]
+            part.invoice_number = record["invoice_number"]
+            part.amount = record["amount"]
+            part.date = record["date"]
+            part.invoice_type = record["invoice_type"]
+            part.seller = record["seller"]
+            part.path = record["path"]
+            part.new_name = os.path.basename(record["path"]) if record["path"] else None
+            result.parts.append(part)
+        first = result.parts[0]
+        result.invoice_code = first.invoice_code
+        result.invoice_number = first.invoice_number
+        result.amount = first.amount
+        result.date = first.date
+        # 未拆分时原文件保持不变；认领模式下处理结束后文件会移回输出目录，记录移回后的路径
+        result.path = first.path or os.path.join(output_layout.default_base_dir(doc.path),
+                                                 os.path.basename(doc.path))
+        result.new_name = os.path.basename(result.path)
+        return True
+
+    # -- 命名与归档 ----------------------------------------------------
+
+    def _finish(self, doc, result):
+        if result.parts is not None:
+            # 多发票文件已在扫描时拆分归档（或保持原样），只需计入汇总
+            if self.track:
+                for part in result.parts:
+                    self._record(part, part.path or result.path)
+            return
+        result.new_name = create_new_filename(result.invoice_number, result.amount, result.source,
+                                              self.rename_with_amount)
+        if doc.path is None and doc.output_dir is None:
+            return
+        stage_start = time.perf_counter()
+        layout = self.layout or output_layout.current_layout()
+        need_seller = layout == "seller" or (self.track and rollups.get_store() is not None)
+        if result.seller is None and doc.ext == ".pdf" and need_seller:
+            try:
+                result.seller = extract_seller_tax_id(doc.text())
+            except Exception as e:
+                logging.debug("提取销售方失败: %s", e)
+        if result.date is None and doc.ext == ".pdf":
+            try:
+                result.date = extract_date_from_text(doc.text())
+            except Exception as e:
+                logging.debug("提取开票日期失败: %s", e)
+        # 归档前关闭文档，Windows 下打开中的文件无法重命名
+        doc.close()
+        if doc.path is not None:
+            result.path = output_layout.place(
+                doc.path, result.new_name,
+                date=result.date, seller=result.seller, amount=result.amount, layout=layout)
+        else:
+            result.path = output_layout.place_bytes(
+                doc.data, result.new_name, doc.output_dir,
+                date=result.date, seller=result.seller, amount=result.amount, layout=layout)
+        logging.info("文件重命名为: %s", result.path)
+        if self.track:
+            self._record(result, result.path)
+        result.timings["place"] = time.perf_counter() - stage_start
+
+    @staticmethod
+    def _record(result, path):
+        rollups.record(result.invoice_number, result.amount, date=result.date, seller=result.seller,
+                       invoice_type=result.invoice_type, path=path, invoice_code=result.invoice_code)
@@ -0,0 +1,242 @@
+"""
+监控目录的崩溃安全处理日志
+
+追加写入的 JSON Lines 文件，每行一条记录：
+    {"op": "intent", "path": ...}      文件已被接收、等待或正在处理
+    {"op": "done", "path": ...}        文件处理结束（成功或失败）
+    {"op": "snapshot", "time": ..., "dirs": {目录: mtime_ns}}
+每完成 compact_every 个文件后压缩一次：只保留未完成的 intent 和一份新的目录快照。
+
+重启时只需：
+1. 重放未完成的 intent（文件仍在原处的重新处理）；
+2. 与上次快照对比目录 mtime，只列出有变化的目录，找出停机期间新到的文件。
+工作量取决于变化量，与归档规模无关。进程崩溃导致的末尾半行记录在加载时忽略。
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from config_manager import config
+import output_layout
+
+_SPLIT_PREFIX = ".split_"
+
+
+class ProcessingJournal:
+    def __init__(self, path, root, recursive=False, fsync=False, compact_every=1000, margin_seconds=120):
+        self.path = path
+        self.root = os.path.abspath(root)
+        self.recursive = recursive
+        self.fsync = fsync
+        self.compact_every = compact_every
+        # 快照前不久才变化的目录重启时仍然重新列出：覆盖快照时尚未被观察到的事件
+        self.margin_seconds = margin_seconds
+        self._pending = OrderedDict()
+        self._snapshot = None
+        self._done_since_compact = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._load()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 崩溃时写了一半的记录
+                        continue
+                    op = record.get("op")
+                    if op == "intent":
+                        self._pending[record["path"]] = record.get("ts")
+                    elif op == "done":
+                        self._pending.pop(record["path"], None)
+                    elif op == "snapshot":
+                        self._snapshot = record
+        except FileNotFoundError:
+            pass
+
+    def _append(self, records):
+        """追加记录（需持有锁）"""
+        self._file.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    # -- 记录 ----------------------------------------------------------
+
+    def intent(self, paths):
+        """记录已接收的文件；已在日志中等待处理的路径不重复记录"""
+        now = time.time()
+        with self._lock:
+            records = []
+            for path in paths:
+                path = os.path.abspath(path)
+                if path not in self._pending:
+                    self._pending[path] = now
+                    records.append({"op": "intent", "path": path, "ts": now})
+            if records:
+                self._append(records)
+
+    def done(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            if self._pending.pop(path, None) is None:
+                return
+            self._append([{"op": "done", "path": path}])
+            self._done_since_compact += 1
+            should_compact = self._done_since_compact >= self.compact_every
+        if should_compact:
+            self.compact()
+
+    def pending(self):
+        with self._lock:
+            return list(self._pending)
+
+    # -- 快照与压缩 ----------------------------------------------------
+
+    def _dir_mtimes(self):
+        """返回监控范围内各目录的 mtime（跳过隐藏目录与认领目录）"""
+        dirs = {}
+        stack = [self.root]
+        while stack:
+            path = stack.pop()
+            try:
+                dirs[path] = os.stat(path).st_mtime_ns
+                if not self.recursive:
+                    continue
+                with os.scandir(path) as entries:
+                    stack.extend(entry.path for entry in entries
+                                 if entry.is_dir(follow_symlinks=False) and not entry.name.startswith("."))
+            except (FileNotFoundError, PermissionError):
+                continue
+        return dirs
+
+    def compact(self, dirs=None, snapshot_time=None):
+        """重写日志：一份目录快照加上所有未完成的 intent"""
+        snapshot_time = snapshot_time or time.time()
+        dirs = dirs if dirs is not None else self._dir_mtimes()
+        snapshot = {"op": "snapshot", "time": snapshot_time, "dirs": dirs}
+        with self._lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps(snapshot, ensure_ascii=False) + "\n")
+                for path, ts in self._pending.items():
+                    f.write(json.dumps({"op": "intent", "path": path, "ts": ts}, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp_path, self.path)
+            self._file = open(self.path, "a", encoding="utf-8")
+            self._snapshot = snapshot
+            self._done_since_compact = 0
+        logging.debug("处理日志已压缩: %d 个目录, %d 个未完成文件", len(dirs), len(self._pending))
+
+    def _changed_dirs(self, current):
+        """与上次快照相比 mtime 变化、新增或在快照前不久变化的目录"""
+        if self._snapshot is None:
+            return list(current)
+        recorded = self._snapshot.get("dirs", {})
+        recent_ns = int((self._snapshot.get("time", 0) - self.margin_seconds) * 1e9)
+        return [path for path, mtime_ns in current.items()
+                if recorded.get(path) != mtime_ns or mtime_ns >= recent_ns]
+
+    def recover(self, is_candidate):
+        """
+        启动时计算需要补处理的文件：未完成的 intent 加上变化目录中的新文件，
+        并把它们记为 intent、写入新的目录快照。is_candidate(文件名) 判断文件是否需要处理
+        """
+        snapshot_time = time.time()
+        current = self._dir_mtimes()
+        changed = self._changed_dirs(current)
+
+        paths = []
+        for path in self.pending():
+            if os.path.exists(path):
+                paths.append(path)
+                _remove_split_parts(os.path.dirname(path))
+            else:
+                # 重命名已完成但没来得及记录 done
+                self.done(path)
+        seen = set(paths)
+        for directory in changed:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if (entry.path not in seen and is_candidate(entry.name)
+                                and entry.is_file(follow_symlinks=False)):
+                            paths.append(entry.path)
+            except (FileNotFoundError, PermissionError):
+                continue
+
+        logging.info(f"处理日志恢复: 未完成 {len(seen)} 个, 检查变化目录 {len(changed)}/{len(current)} 个, "
+                     f"待处理 {len(paths)} 个")
+        self.intent(paths)
+        self.compact(current, snapshot_time)
+        return paths
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _remove_split_parts(directory):
+    """删除拆分多发票PDF时崩溃遗留的临时分片"""
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(_SPLIT_PREFIX) and entry.is_file(follow_symlinks=False):
+                    os.remove(entry.path)
+                    logging.info(f"已删除遗留的拆分分片: {entry.path}")
+    except OSError:
+        pass
+
+
+def is_candidate(file_name, extensions=('.pdf', '.ofd')):
+    """文件名是否是需要处理的发票文件（未重命名、非隐藏、扩展名受支持）"""
+    return (file_name.lower().endswith(extensions) and not file_name.startswith(".")
+            and not output_layout.looks_processed(file_name))
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def open_journal(root, recursive=False):
+    """为监控目录打开全局处理日志；未启用时返回 None"""
+    global _journal
+    if not config.get("journal_enabled", True):
+        return None
+    with _journal_lock:
+        if _journal is None:
+            path = config.get("journal_path", "./data/journal.log")
+            _journal = ProcessingJournal(
+                path, root, recursive=recursive,
+                fsync=config.get("journal_fsync", False),
+                compact_every=int(config.get("journal_compact_every", 1000)),
+                margin_seconds=float(config.get("journal_margin_seconds", 120)),
+            )
+        return _journal
+
+
+def get_journal():
+    return _journal
+
+
+@contextmanager
+def track(path):
+    """处理单个文件期间的日志记录：开始前记 intent，结束（包括失败）后记 done"""
+    journal = _journal
+    if journal is None:
+        yield
+        return
+    journal.intent([path])
+    try:
+        yield
+    finally:
+        journal.done(path)
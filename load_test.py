@@ -0,0 +1,348 @@
+"""
+Web 服务压测
+
+用本地生成的发票驱动 web_app.py，按配置的批量大小、文件类型和并发级别反复调用 /upload
+并下载返回的 ZIP，统计吞吐、延迟分位数、错误率和服务进程 RSS 的变化。
+压测期间另有探针线程持续请求 /health：它不做任何处理，延迟升高说明事件循环被阻塞
+（例如 upload_files、download_file、cleanup_old_files 中出现了同步 I/O）。
+
+默认在本进程内启动服务（uvicorn 线程），也可以用 --url 压测已启动的服务（--pid 指定其进程号以采集 RSS）。
+每个压测线程使用不同的 X-Forwarded-For，模拟经代理转发的多个客户端，避免被单客户端并发限制拒绝；
+服务只在直连地址属于 trusted_proxies 时采用该头，--url 模式下需把压测机地址加入服务的 trusted_proxies。
+
+用法: python load_test.py [--concurrency 1,4,8] [--batch-sizes 1,5,20] [--types pdf=3,scan=1,zip=1]
+                          [--requests 50] [--url http://127.0.0.1:8080] [--pid PID] [--json report.json]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import zipfile
+from collections import Counter
+
+FILE_TYPES = ("pdf", "scan", "zip")
+ZIP_MEMBERS = 5
+
+# 语料只生成一次，重复运行时复用
+DEFAULT_CORPUS_DIR = "./data/loadtest_corpus"
+
+
+# -- 测试发票 ----------------------------------------------------------
+
+def _invoice_fields(rng):
+    number = "".join(rng.choice("0123456789") for _ in range(20))
+    amount = f"{rng.randint(1, 99999)}.{rng.randint(0, 99):02d}"
+    date = f"2024{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}"
+    return number, amount, date
+
+
+def _qr_png(data):
+    """用 OpenCV 生成二维码 PNG（与识别端使用的 pyzbar 兼容）"""
+    import cv2
+    encoder = cv2.QRCodeEncoder.create()
+    image = encoder.encode(data)
+    image = cv2.resize(image, (image.shape[1] * 8, image.shape[0] * 8), interpolation=cv2.INTER_NEAREST)
+    ok, png = cv2.imencode(".png", image)
+    return png.tobytes()
+
+
+def make_invoice_pdf(number, amount, date, scanned=False):
+    """生成一页发票：左上角二维码 + 文本层；scanned=True 时整页只有一张图片（模拟扫描件）"""
+    import fitz
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)
+    page.insert_image(fitz.Rect(12, 12, 92, 92), stream=_qr_png(f"01,10,,{number},{amount},{date},,0000,"))
+    page.insert_text((120, 50), f"发票号码: {number}", fontname="china-s", fontsize=12)
+    page.insert_text((120, 80), f"开票日期: {date[:4]}年{date[4:6]}月{date[6:]}日", fontname="china-s", fontsize=12)
+    page.insert_text((120, 400), f"价税合计(小写) ¥{amount}", fontname="china-s", fontsize=12)
+    if scanned:
+        pix = page.get_pixmap(dpi=150)
+        image_doc = fitz.open()
+        image_page = image_doc.new_page(width=page.rect.width, height=page.rect.height)
+        image_page.insert_image(image_page.rect, stream=pix.tobytes("png"))
+        doc.close()
+        doc = image_doc
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data
+
+
+def build_corpus(directory, per_type=20, seed=0):
+    """生成（或复用）压测语料，返回 {类型: [(文件名, 字节)]}"""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    corpus = {file_type: [] for file_type in FILE_TYPES}
+    for file_type in FILE_TYPES:
+        for i in range(per_type):
+            name = f"{file_type}_{i:03d}.{'zip' if file_type == 'zip' else 'pdf'}"
+            path = os.path.join(directory, name)
+            if not os.path.exists(path):
+                if file_type == "zip":
+                    buffer = io.BytesIO()
+                    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+                        for j in range(ZIP_MEMBERS):
+                            archive.writestr(f"member_{j}.pdf", make_invoice_pdf(*_invoice_fields(rng)))
+                    data = buffer.getvalue()
+                else:
+                    data = make_invoice_pdf(*_invoice_fields(rng), scanned=file_type == "scan")
+                with open(path, "wb") as f:
+                    f.write(data)
+            with open(path, "rb") as f:
+                corpus[file_type].append((name, f.read()))
+    return corpus
+
+
+# -- 服务与采样 --------------------------------------------------------
+
+def start_in_process_server():
+    """在后台线程中启动 web_app，返回 (基础 URL, 停止函数)"""
+    import uvicorn
+    import admission
+    import web_app
+    # 本进程内的服务把本机视为可信代理，按 X-Forwarded-For 区分各压测线程
+    admission.get_controller().trusted_proxies = admission.parse_networks("127.0.0.1")
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(web_app.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="loadtest-server", daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 30
+    while not server.started:
+        if time.monotonic() > deadline or not thread.is_alive():
+            raise RuntimeError("服务启动失败")
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+        thread.join(timeout=10)
+
+    return f"http://127.0.0.1:{port}", stop
+
+
+def rss_reader(pid=None):
+    """返回读取 RSS（字节）的函数；无法读取时返回 None"""
+    if pid is None:
+        from memory_governor import rss_bytes
+        return rss_bytes
+    statm = f"/proc/{pid}/statm"
+    if not os.path.exists(statm):
+        return None
+
+    def read():
+        try:
+            with open(statm) as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return 0
+
+    return read
+
+
+class Sampler(threading.Thread):
+    """后台定时采样：服务 RSS 和 /health 探针延迟"""
+
+    def __init__(self, base_url, read_rss, interval=0.2):
+        super().__init__(name="loadtest-sampler", daemon=True)
+        self.base_url = base_url
+        self.read_rss = read_rss
+        self.interval = interval
+        self.rss = []      # [(秒, 字节)]
+        self.probe = []    # 探针延迟（秒）
+        self._stop_event = threading.Event()
+        self._start = time.monotonic()
+
+    def run(self):
+        import requests
+        session = requests.Session()
+        while not self._stop_event.wait(self.interval):
+            if self.read_rss is not None:
+                self.rss.append((round(time.monotonic() - self._start, 2), self.read_rss()))
+            start = time.perf_counter()
+            try:
+                session.get(f"{self.base_url}/health", timeout=30)
+                self.probe.append(time.perf_counter() - start)
+            except Exception:
+                pass
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+# -- 压测 --------------------------------------------------------------
+
+def parse_mix(text, cast=str):
+    """解析 "a=3,b=1" 或 "a,b" 形式的加权列表"""
+    items, weights = [], []
+    for entry in text.split(","):
+        name, _, weight = entry.partition("=")
+        items.append(cast(name.strip()))
+        weights.append(float(weight) if weight else 1.0)
+    return items, weights
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))]
+
+
+def run_level(base_url, corpus, concurrency, total_requests, batch_mix, type_mix, seed):
+    """以给定并发发出 total_requests 个上传请求，返回原始记录"""
+    import requests
+    records = []
+    lock = threading.Lock()
+    remaining = [total_requests]
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        session = requests.Session()
+        headers = {"X-Forwarded-For": f"10.0.{index // 250}.{index % 250 + 1}"}
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            batch = rng.choices(*batch_mix)[0]
+            files = []
+            for _ in range(batch):
+                name, data = rng.choice(corpus[rng.choices(*type_mix)[0]])
+                files.append(("files", (name, data, "application/octet-stream")))
+            record = {"batch": batch, "status": None, "latency": None, "download": None,
+                      "results": 0, "recognized": 0, "error": None}
+            start = time.perf_counter()
+            try:
+                response = session.post(f"{base_url}/upload", files=files, headers=headers, timeout=600)
+                record["latency"] = time.perf_counter() - start
+                record["status"] = response.status_code
+                if response.status_code == 200:
+                    body = response.json()
+                    results = body.get("results", [])
+                    record["results"] = len(results)
+                    record["recognized"] = sum(1 for r in results if r.get("success"))
+                    if body.get("download_url"):
+                        start = time.perf_counter()
+                        download = session.get(f"{base_url}{body['download_url']}", timeout=600)
+                        record["download"] = time.perf_counter() - start
+                        if download.status_code != 200:
+                            record["error"] = f"download {download.status_code}"
+            except Exception as e:
+                record["error"] = str(e)
+            with lock:
+                records.append(record)
+
+    threads = [threading.Thread(target=worker, args=(i,), name=f"loadtest-{i}") for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records, time.perf_counter() - start
+
+
+def summarize(concurrency, records, elapsed, sampler, rss_from, probe_from):
+    latencies = [r["latency"] for r in records if r["status"] == 200]
+    downloads = [r["download"] for r in records if r["download"] is not None]
+    errors = [r for r in records if r["status"] != 200 or r["error"]]
+    files = sum(r["results"] for r in records)
+    rss = [value for _, value in sampler.rss[rss_from:]]
+    probe = sampler.probe[probe_from:]
+    return {
+        "concurrency": concurrency,
+        "requests": len(records),
+        "elapsed_s": elapsed,
+        "requests_per_s": len(records) / elapsed if elapsed else 0,
+        "files_per_s": files / elapsed if elapsed else 0,
+        "files": files,
+        "recognized": sum(r["recognized"] for r in records),
+        "error_rate": len(errors) / len(records) if records else 0,
+        "status": dict(Counter(str(r["status"]) for r in records)),
+        "latency": {f"p{q}": percentile(latencies, q) for q in (50, 90, 99)} | {"max": max(latencies, default=None)},
+        "download_p50": percentile(downloads, 50),
+        "probe": {"p50": percentile(probe, 50), "p99": percentile(probe, 99), "max": max(probe, default=None)},
+        "rss_mb": {"start": rss[0] / 2**20 if rss else None, "peak": max(rss) / 2**20 if rss else None,
+                   "end": rss[-1] / 2**20 if rss else None},
+    }
+
+
+def _ms(value):
+    return "-" if value is None else f"{value * 1000:.0f}"
+
+
+def print_summary(summary):
+    latency, probe, rss = summary["latency"], summary["probe"], summary["rss_mb"]
+    print(f"== 并发 {summary['concurrency']}: {summary['requests']} 请求 / {summary['files']} 文件, "
+          f"{summary['elapsed_s']:.1f} s")
+    print(f"   吞吐      {summary['requests_per_s']:.2f} req/s, {summary['files_per_s']:.2f} 文件/s, "
+          f"识别成功 {summary['recognized']}/{summary['files']}")
+    print(f"   延迟 ms   p50 {_ms(latency['p50'])}  p90 {_ms(latency['p90'])}  p99 {_ms(latency['p99'])}  "
+          f"max {_ms(latency['max'])}  下载 p50 {_ms(summary['download_p50'])}")
+    print(f"   错误率    {summary['error_rate']:.1%}  状态码 {summary['status']}")
+    print(f"   /health   p50 {_ms(probe['p50'])}  p99 {_ms(probe['p99'])}  max {_ms(probe['max'])} ms")
+    if rss["peak"] is not None:
+        print(f"   RSS MB    起始 {rss['start']:.0f}  峰值 {rss['peak']:.0f}  结束 {rss['end']:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="压测发票处理 Web 服务")
+    parser.add_argument("--url", help="已启动服务的地址；不指定时在本进程内启动")
+    parser.add_argument("--pid", type=int, help="--url 模式下服务的进程号，用于采集 RSS")
+    parser.add_argument("--concurrency", default="1,4,8", help="依次运行的并发级别")
+    parser.add_argument("--batch-sizes", default="1,5,20", help="每个请求的文件数，可加权：1=5,20=1")
+    parser.add_argument("--types", default="pdf=3,scan=1,zip=1", help="文件类型及权重：pdf, scan, zip")
+    parser.add_argument("--requests", type=int, default=50, help="每个并发级别的请求数")
+    parser.add_argument("--corpus-dir", default=DEFAULT_CORPUS_DIR)
+    parser.add_argument("--per-type", type=int, default=20, help="每种类型生成的文件数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="把完整结果（含 RSS 时间序列）写入该文件")
+    args = parser.parse_args()
+
+    batch_mix = parse_mix(args.batch_sizes, int)
+    type_mix = parse_mix(args.types)
+    unknown = set(type_mix[0]) - set(FILE_TYPES)
+    if unknown:
+        parser.error(f"未知的文件类型: {', '.join(sorted(unknown))}")
+
+    print(f"准备语料: {args.corpus_dir}")
+    corpus = build_corpus(args.corpus_dir, args.per_type, args.seed)
+
+    stop = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+        read_rss = rss_reader(args.pid) if args.pid else None
+    else:
+        base_url, stop = start_in_process_server()
+        read_rss = rss_reader()
+    sampler = Sampler(base_url, read_rss)
+    sampler.start()
+
+    summaries = []
+    try:
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            rss_from, probe_from = len(sampler.rss), len(sampler.probe)
+            records, elapsed = run_level(base_url, corpus, concurrency, args.requests,
+                                         batch_mix, type_mix, args.seed)
+            summary = summarize(concurrency, records, elapsed, sampler, rss_from, probe_from)
+            print_summary(summary)
+            summaries.append(summary)
+    finally:
+        sampler.stop()
+        if stop is not None:
+            stop()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"levels": summaries, "rss": sampler.rss}, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json}")
+    sys.exit(1 if any(s["error_rate"] > 0 for s in summaries) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+日志配置
+
+- 级别取自 log_level（LOG_LEVEL）；只在程序入口调用 configure()，导入模块时不改动全局日志
+- log_format=json 时每条日志输出一行 JSON，text 为原来的可读格式
+- 每个文件带 trace_id，属于某次上传/批次时另带 job_id；通过 contextvars 跨调度器线程传递
+- 结构化字段（如各阶段耗时）用 event() 输出，级别未开启时不构造任何字段
+- log_debug_sample 按比例采样 DEBUG 日志，生产环境临时开启调试时不拖慢热路径
+
+    with log_setup.trace("upload", job=True):
+        ...
+        log_setup.event(logging.INFO, "发票处理完成", stage_ms={...})
+"""
+import contextvars
+import json
+import logging
+import random
+import sys
+import uuid
+from contextlib import contextmanager
+from config_manager import config
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# (trace_id, job_id, 名称)
+_trace = contextvars.ContextVar("log_trace", default=None)
+_handler = None
+
+
+class TraceFilter(logging.Filter):
+    """把当前 trace 写入日志记录"""
+
+    def filter(self, record):
+        trace_id, job_id, name = _trace.get() or (None, None, None)
+        record.trace_id = trace_id
+        record.job_id = job_id
+        record.trace_name = name
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """只保留 rate 比例的 DEBUG 日志，其它级别不受影响"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, field in (("trace_id", "trace_id"), ("job_id", "job_id"), ("file", "trace_name")):
+            value = getattr(record, field, None)
+            if value:
+                data[key] = value
+        fields = getattr(record, "fields", None)
+        if fields:
+            data.update(fields)
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """可读格式，trace_id 和结构化字段追加在消息后"""
+
+    def format(self, record):
+        message = super().format(record)
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            message += f" [{trace_id}]"
+        fields = getattr(record, "fields", None)
+        if fields:
+            message += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return message
+
+
+def configure(level=None, fmt=None, debug_sample=None, stream=None):
+    """按配置安装根日志处理器；重复调用时替换上一次安装的处理器"""
+    global _handler
+    level = str(level or config.get("log_level", "INFO")).upper()
+    fmt = fmt or config.get("log_format", "text")
+    debug_sample = float(debug_sample if debug_sample is not None else config.get("log_debug_sample", 1.0))
+
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.addFilter(TraceFilter())
+    if debug_sample < 1.0:
+        handler.addFilter(DebugSampler(debug_sample))
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    if _handler is not None:
+        root.removeHandler(_handler)
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, level, logging.INFO))
+    _handler = handler
+    return handler
+
+
+@contextmanager
+def trace(name=None, job=False):
+    """
+    为一个文件（或 job=True 时为一次上传/批次）生成 trace_id；
+    文件嵌套在任务中时记录所属任务的 job_id
+    """
+    parent = _trace.get()
+    trace_id = uuid.uuid4().hex[:16]
+    if job:
+        job_id = trace_id
+    else:
+        job_id = parent[1] if parent else None
+    token = _trace.set((trace_id, job_id, name))
+    try:
+        yield trace_id
+    finally:
+        _trace.reset(token)
+
+
+def current_trace_id():
+    trace = _trace.get()
+    return trace[0] if trace else None
+
+
+def event(level, msg, **fields):
+    """输出带结构化字段的日志；级别未开启时直接返回"""
+    logger = logging.getLogger()
+    if logger.isEnabledFor(level):
+        logger.log(level, msg, extra={"fields": fields})
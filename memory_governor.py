@@ -0,0 +1,203 @@
+"""
+渲染内存控制
+
+- 全局像素预算：每次渲染前按 宽×高×通道 预留字节数，预算用尽时等待其它页识别完成后再渲染；
+  单个超出预算的请求在没有其它占用时直接放行，避免死锁
+- MuPDF 缓存上限：每个任务结束后若 fitz 的 store 超过上限则收缩
+- 缓冲区复用：整页灰度图复制到按容量复用的 numpy 缓冲区，而不是每页重新分配
+- 按任务统计渲染内存峰值，写入日志和指标
+"""
+import contextvars
+import logging
+import math
+import os
+import threading
+from contextlib import contextmanager
+from config_manager import config
+import metrics
+
+_MB = 1024 * 1024
+
+
+class PixelBudget:
+    """以字节计的渲染内存预算"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.in_use = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes):
+        if self.max_bytes <= 0:
+            return
+        with self._cond:
+            while self.in_use and self.in_use + nbytes > self.max_bytes:
+                self._cond.wait()
+            self.in_use += nbytes
+            metrics.render_bytes_reserved.set(self.in_use)
+
+    def release(self, nbytes):
+        if self.max_bytes <= 0:
+            return
+        with self._cond:
+            self.in_use = max(0, self.in_use - nbytes)
+            metrics.render_bytes_reserved.set(self.in_use)
+            self._cond.notify_all()
+
+
+class _JobStats:
+    __slots__ = ("name", "current", "peak", "lock")
+
+    def __init__(self, name):
+        self.name = name
+        self.current = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def add(self, nbytes):
+        with self.lock:
+            self.current += nbytes
+            self.peak = max(self.peak, self.current)
+
+
+class Reservation:
+    """一次渲染的内存预留；release 可在其它线程（如识别线程）中调用，重复调用无副作用"""
+    __slots__ = ("nbytes", "_stats", "_released", "_lock")
+
+    def __init__(self, nbytes, stats):
+        self.nbytes = nbytes
+        self._stats = stats
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        get_budget().release(self.nbytes)
+        if self._stats is not None:
+            self._stats.add(-self.nbytes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class BufferPool:
+    """按容量复用的一维 uint8 缓冲区池"""
+
+    def __init__(self, max_buffers=8):
+        self.max_buffers = max_buffers
+        self._free = []
+        self._lock = threading.Lock()
+
+    def take(self, shape):
+        """返回形状为 shape 的 uint8 数组，底层缓冲区可能来自池中"""
+        import numpy as np
+        needed = int(math.prod(shape))
+        with self._lock:
+            for i, buf in enumerate(self._free):
+                # 只复用大小相近的缓冲区，避免小图长期占用大块内存
+                if needed <= buf.size <= needed * 2:
+                    del self._free[i]
+                    return buf[:needed].reshape(shape)
+        return np.empty(needed, dtype=np.uint8).reshape(shape)
+
+    def give(self, array):
+        """归还 take 得到的数组；调用方之后不得再使用它"""
+        base = array.base if array.base is not None else array
+        with self._lock:
+            if len(self._free) < self.max_buffers:
+                self._free.append(base.reshape(-1))
+
+    def copy(self, gray):
+        """把二维灰度视图复制到池中的缓冲区"""
+        out = self.take(gray.shape)
+        out[...] = gray
+        return out
+
+
+_budget = None
+_pool = None
+_init_lock = threading.Lock()
+_current_job = contextvars.ContextVar("memory_job", default=None)
+
+
+def get_budget():
+    global _budget
+    with _init_lock:
+        if _budget is None:
+            _budget = PixelBudget(int(config.get("render_memory_budget_mb", 256)) * _MB)
+        return _budget
+
+
+def get_buffer_pool():
+    global _pool
+    with _init_lock:
+        if _pool is None:
+            _pool = BufferPool(int(config.get("render_buffer_pool_size", 8)))
+        return _pool
+
+
+def page_bytes(rect, dpi, n=1):
+    """估算以 dpi 渲染 rect（单位 pt）所需的字节数"""
+    scale = dpi / 72.0
+    return int(math.ceil(rect.width * scale) * math.ceil(rect.height * scale) * n)
+
+
+def reserve(nbytes):
+    """预留渲染内存，预算不足时阻塞等待；返回需在像素不再使用后 release 的 Reservation"""
+    budget = get_budget()
+    if 0 < budget.max_bytes < nbytes:
+        logging.warning(f"单页渲染需要 {nbytes / _MB:.1f}MB，超过预算 {budget.max_bytes / _MB:.0f}MB，将独占预算")
+    with metrics.timed("memory_wait"):
+        budget.acquire(nbytes)
+    stats = _current_job.get()
+    if stats is not None:
+        stats.add(nbytes)
+    return Reservation(nbytes, stats)
+
+
+def limit_store():
+    """MuPDF 缓存超过上限时收缩"""
+    limit = int(config.get("fitz_store_limit_mb", 64)) * _MB
+    if limit <= 0:
+        return
+    import fitz
+    # PyMuPDF 中 store_size 是属性而不是方法
+    size = fitz.TOOLS.store_size
+    if size > limit:
+        fitz.TOOLS.store_shrink(min(100, math.ceil((size - limit) * 100 / size)))
+        logging.debug("MuPDF 缓存已从 %.1fMB 收缩", size / _MB)
+
+
+def rss_bytes():
+    """当前进程常驻内存（仅 Linux，其它平台返回 0）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+@contextmanager
+def job(name):
+    """统计一个处理任务的渲染内存峰值，结束时收缩 MuPDF 缓存"""
+    stats = _JobStats(name)
+    token = _current_job.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_job.reset(token)
+        try:
+            limit_store()
+        except Exception as e:
+            logging.warning("收缩 MuPDF 缓存失败: %s", e)
+        metrics.job_peak_bytes.observe(stats.peak)
+        # 读取 RSS 需要一次文件读取，只在开启 DEBUG 时进行
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("任务内存 %s: 渲染峰值 %.1fMB, 进程 RSS %.1fMB", name, stats.peak / _MB, rss_bytes() / _MB)
@@ -0,0 +1,230 @@
+import threading
+import time
+from contextlib import nullcontext
+from config_manager import config
+
+# 默认直方图分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 内存直方图分桶（字节）
+BYTES_BUCKETS = tuple(mb * 1024 * 1024 for mb in (1, 4, 16, 32, 64, 128, 256, 512, 1024))
+
+_NULL_TIMER = nullcontext()
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if not enabled():
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def total(self):
+        with self._lock:
+            return sum(self._values.values())
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    """可增可减的仪表盘（如队列深度）"""
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        if not enabled():
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        if not enabled():
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    """耗时直方图，每组标签记录分桶计数、总和与次数"""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not enabled():
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def summary(self):
+        """返回 {标签: (次数, 总耗时)}"""
+        with self._lock:
+            return {key: (state[2], state[1]) for key, state in self._values.items()}
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labelnames, key, ("le", repr(bound)))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key, ("le", "+Inf"))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class _StageTimer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        stage_duration.observe(time.perf_counter() - self.start, stage=self.stage)
+        return False
+
+
+_registry = []
+_enabled = bool(config.get("metrics_enabled", True))
+
+
+def enabled():
+    return _enabled
+
+
+def set_enabled(value):
+    """运行时开启或关闭指标采集"""
+    global _enabled
+    _enabled = bool(value)
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def timed(stage):
+    """记录某个处理阶段耗时的上下文管理器；关闭采集时返回空操作"""
+    if not _enabled:
+        return _NULL_TIMER
+    return _StageTimer(stage)
+
+
+stage_duration = _register(Histogram(
+    "invoice_stage_duration_seconds", "各处理阶段耗时", ("stage",)))
+files_processed = _register(Counter(
+    "invoice_files_processed_total", "已处理的发票文件数", ("format", "result")))
+qr_decodes = _register(Counter(
+    "invoice_qr_decode_total", "二维码识别次数", ("result",)))
+text_fallbacks = _register(Counter(
+    "invoice_text_fallback_total", "回退到PDF文本提取的次数"))
+qr_cache_lookups = _register(Counter(
+    "invoice_qr_cache_total", "二维码位置模板缓存查询结果", ("result",)))
+queue_depth = _register(Gauge(
+    "invoice_queue_depth", "待处理/处理中的任务数", ("queue",)))
+admission_rejected = _register(Counter(
+    "invoice_admission_rejected_total", "被准入控制拒绝的上传请求数", ("reason",)))
+admission_queued_bytes = _register(Gauge(
+    "invoice_admission_queued_bytes", "已准入但尚未处理完的上传字节数"))
+render_bytes_reserved = _register(Gauge(
+    "invoice_render_bytes_reserved", "当前已预留的渲染内存（字节）"))
+job_peak_bytes = _register(Histogram(
+    "invoice_job_peak_bytes", "每个任务的渲染内存峰值（字节）", buckets=BYTES_BUCKETS))
+
+
+def render_prometheus():
+    """以 Prometheus 文本格式导出所有指标"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def format_stats():
+    """生成适合命令行输出的统计摘要"""
+    lines = ["阶段耗时:"]
+    for (stage,), (count, total) in sorted(stage_duration.summary().items()):
+        avg_ms = total / count * 1000 if count else 0.0
+        lines.append(f"  {stage:<16} 次数={count:<6} 总计={total:.3f}s 平均={avg_ms:.1f}ms")
+
+    processed = files_processed.total()
+    hits = qr_decodes.value(result="hit")
+    misses = qr_decodes.value(result="miss")
+    fallbacks = text_fallbacks.total()
+    lines.append(f"已处理文件: {processed}")
+    lines.append(f"二维码命中/未命中: {hits}/{misses}")
+    rate = fallbacks / processed * 100 if processed else 0.0
+    lines.append(f"文本回退: {fallbacks} ({rate:.1f}%)")
+    return "\n".join(lines)
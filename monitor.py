@@ -1,38 +1,70 @@
 import os
 import sys
 import time
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from snapshot_observer import create_observer
 import logging
-from main import process_file, sum_invoices
+from main import get_processor, process_file, sum_invoices
+from invoice_processor import SUPPORTED_EXTENSIONS
+import archive_ingest
+import metrics
+import output_layout
+import work_claim
+import journal
+import log_setup
+import executors
+from event_coalescer import EventCoalescer
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+# 压缩包中的发票导入后归档到压缩包所在目录
+WATCH_EXTENSIONS = SUPPORTED_EXTENSIONS + archive_ingest.ARCHIVE_EXTENSIONS
 
-class InvoiceHandler(FileSystemEventHandler):
-    def __init__(self):
-        self.supported_extensions = {'.pdf', '.ofd'}
+def is_watch_candidate(file_name):
+    return journal.is_candidate(file_name, WATCH_EXTENSIONS)
 
-    def is_supported_file(self, path):
-        return os.path.splitext(path)[1].lower() in self.supported_extensions
+class InvoiceHandler(EventCoalescer):
+    """收集新建/移入的发票文件，合并成批次后统一处理"""
 
-    def on_created(self, event):
-        if not event.is_directory and self.is_supported_file(event.src_path):
-            logging.info(f"发现新发票文件: {event.src_path}")
-            try:
-                # 等待文件完全写入
-                time.sleep(1)
-                # 处理发票文件
-                process_file(event.src_path, False)
-                # 更新发票总额
-                invoice_folder = os.path.dirname(event.src_path)
-                sum_invoices(invoice_folder)
-            except Exception as e:
-                logging.error(f"处理文件时出错: {str(e)}")
+    def __init__(self, watch_path='.'):
+        super().__init__(self.process_batch, extensions=WATCH_EXTENSIONS)
+        # 多节点共享监控目录时先认领再处理
+        self.claimer = work_claim.get_claimer(watch_path)
+
+    def process_batch(self, paths):
+        with log_setup.trace("watch", job=True):
+            self._process_batch(paths)
+
+    def _process_batch(self, paths):
+        # 批次内的文件按 process 阶段的执行后端并行处理
+        folders = {folder for folder in executors.imap("process", self._process_path, paths) if folder}
+        # 每批次每个目录只重新统计一次总额（分片布局下各分片合计已在归档时增量更新）
+        if output_layout.current_layout() == "flat":
+            for invoice_folder in folders:
+                try:
+                    sum_invoices(invoice_folder)
+                except Exception as e:
+                    logging.error("更新发票总额时出错: %s", e)
+
+    def _process_path(self, path):
+        """处理单个文件，返回其所在目录；失败时返回 None"""
+        logging.info(f"发现新发票文件: {path}")
+        metrics.queue_depth.inc(queue="watch")
+        try:
+            # 处理发票文件（合并窗口已等待文件写入完成）
+            with journal.track(path):
+                if archive_ingest.is_archive(path):
+                    self._run(path, archive_ingest.ingest_file, get_processor())
+                else:
+                    self._run(path, process_file)
+            return os.path.dirname(path)
+        except Exception as e:
+            logging.error("处理文件时出错: %s", e)
+            return None
+        finally:
+            metrics.queue_depth.dec(queue="watch")
+
+    def _run(self, path, fn, *args):
+        if self.claimer is not None:
+            return self.claimer.process(path, fn, *args)
+        return fn(path, *args)
 
 def start_monitoring():
     # 从环境变量获取监控目录，如果未设置则使用当前目录
@@ -44,23 +76,40 @@ def start_monitoring():
         sys.exit(1)
     
     logging.info(f"开始监控发票目录: {watch_path}")
-    logging.info("支持的文件类型: PDF, OFD")
+    logging.info("支持的文件类型: PDF, OFD, ZIP")
+    
+    # 确定各处理阶段的执行后端（executor_autotune 开启时在样例页上测量）
+    executors.autotune()
     
     # 创建事件处理器和观察者
-    event_handler = InvoiceHandler()
-    observer = Observer()
+    processing_journal = journal.open_journal(watch_path)
+    event_handler = InvoiceHandler(watch_path)
+    observer = create_observer()
     observer.schedule(event_handler, watch_path, recursive=False)
     
-    # 启动观察者
+    # 启动事件合并线程与观察者
+    event_handler.start()
     observer.start()
     try:
+        # 补处理上次退出时未完成以及停机期间新到的文件
+        if processing_journal is not None:
+            recovered = processing_journal.recover(is_watch_candidate)
+            if recovered:
+                event_handler.process_batch(recovered)
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
         observer.stop()
         logging.info("监控已停止")
+        if metrics.enabled():
+            logging.info("处理统计:\n" + metrics.format_stats())
     
     observer.join()
+    event_handler.stop()
+    if event_handler.claimer is not None:
+        event_handler.claimer.stop()
 
 if __name__ == "__main__":
+    # 配置日志（级别和格式取自 log_level / log_format）
+    log_setup.configure()
     start_monitoring() 
\ No newline at end of file
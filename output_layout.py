@@ -0,0 +1,279 @@
+import contextvars
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal, InvalidOperation
+from config_manager import config
+from file_processor import unique_path
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# 处理后的发票按布局归档到子目录，避免监控目录无限增长：
+#   flat   - 原地重命名（默认）
+#   date   - 按开票日期归档到 YYYY/MM/
+#   seller - 按销售方纳税人识别号归档
+LAYOUTS = ("flat", "date", "seller")
+
+# 每个分片目录中记录各文件金额的状态文件，避免每次都重新扫描目录；
+# 多个节点可能同时写同一分片，读改写在锁文件上加锁进行
+TOTAL_STATE_FILE = ".invoice_total.json"
+TOTAL_LOCK_FILE = ".invoice_total.lock"
+# 没有 fcntl 时以 O_EXCL 创建锁文件，持有者异常退出遗留的锁文件超过该时间后接管
+_LOCK_STALE_SECONDS = 30.0
+_NAME_AMOUNT_RE = re.compile(r"\[¥([0-9.]+)\]")
+
+_UNKNOWN = "unknown"
+_totals_lock = threading.Lock()
+
+# 最近由本程序归档产生的路径 -> 时间，供目录监控忽略自身重命名触发的事件
+_SELF_PLACED_TTL = 60.0
+_self_placed = {}
+_self_placed_lock = threading.Lock()
+
+# 当前线程/任务的默认输出根目录；文件被移到其它位置处理（如多节点认领）时，仍归档到原目录
+_output_base = contextvars.ContextVar("output_base", default=None)
+
+
+@contextmanager
+def output_base(directory):
+    """在上下文中把 place 的默认 base_dir 设为 directory"""
+    token = _output_base.set(directory)
+    try:
+        yield
+    finally:
+        _output_base.reset(token)
+
+
+def default_base_dir(file_path):
+    """place 未指定 base_dir 时使用的输出根目录"""
+    return _output_base.get() or os.path.dirname(file_path)
+
+
+def current_layout():
+    layout = config.get("output_layout", "flat")
+    if layout not in LAYOUTS:
+        logging.warning(f"未知的输出布局 {layout}，使用 flat")
+        return "flat"
+    return layout
+
+
+def shard_subdir(layout, date=None, seller=None):
+    """返回分片相对路径；flat 布局返回空字符串"""
+    if layout == "date":
+        if date and len(date) >= 6 and date[:6].isdigit():
+            return os.path.join(date[:4], date[4:6])
+        return _UNKNOWN
+    if layout == "seller":
+        return seller or _UNKNOWN
+    return ""
+
+
+def place(file_path, new_file_name, base_dir=None, date=None, seller=None, amount=None, layout=None):
+    """
+    把处理完成的发票移动到输出位置并处理重名；
+    分片布局下同时增量更新该分片的合计，返回新路径
+    """
+    layout = layout or current_layout()
+    base_dir = base_dir or default_base_dir(file_path)
+    target_dir = os.path.join(base_dir, shard_subdir(layout, date, seller))
+    with metrics.timed("rename"):
+        if target_dir != base_dir:
+            os.makedirs(target_dir, exist_ok=True)
+        new_file_path = os.path.join(target_dir, new_file_name)
+        if os.path.abspath(new_file_path) != os.path.abspath(file_path):
+            new_file_path = unique_path(target_dir, new_file_name)
+            _remember_placed(new_file_path)
+            try:
+                os.rename(file_path, new_file_path)
+            except OSError:
+                # 跨文件系统时退化为复制后删除
+                shutil.move(file_path, new_file_path)
+        # 否则文件已经是目标名（例如重新处理未带金额的 发票号码.pdf），保持原样
+    if layout != "flat":
+        add_to_shard_total(target_dir, os.path.basename(new_file_path), amount)
+    return new_file_path
+
+
+def place_bytes(data, new_file_name, base_dir, date=None, seller=None, amount=None, layout=None):
+    """与 place 相同，但输出内容来自内存（如压缩包成员），先写临时文件再原子重命名"""
+    layout = layout or current_layout()
+    target_dir = os.path.join(base_dir, shard_subdir(layout, date, seller))
+    with metrics.timed("rename"):
+        os.makedirs(target_dir, exist_ok=True)
+        new_file_path = unique_path(target_dir, new_file_name)
+        _remember_placed(new_file_path)
+        tmp_path = os.path.join(target_dir, f".{os.path.basename(new_file_path)}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, new_file_path)
+    if layout != "flat":
+        add_to_shard_total(target_dir, os.path.basename(new_file_path), amount)
+    return new_file_path
+
+
+def _remember_placed(path):
+    now = time.monotonic()
+    with _self_placed_lock:
+        if len(_self_placed) > 1024:
+            for path, placed_at in list(_self_placed.items()):
+                if now - placed_at > _SELF_PLACED_TTL:
+                    del _self_placed[path]
+        _self_placed[os.path.abspath(path)] = now
+
+
+def was_placed(path):
+    """判断路径是否是最近由 place 生成的（即自身重命名产生的事件）"""
+    with _self_placed_lock:
+        placed_at = _self_placed.get(os.path.abspath(path))
+    return placed_at is not None and time.monotonic() - placed_at <= _SELF_PLACED_TTL
+
+
+def _format_total(total):
+    return f"{total.quantize(Decimal('0.01'))}"
+
+
+@contextmanager
+def _shard_lock(shard_dir):
+    """分片合计的跨进程锁：有 fcntl 时对锁文件加 flock，否则以 O_EXCL 创建锁文件"""
+    lock_path = os.path.join(shard_dir, TOTAL_LOCK_FILE)
+    with _totals_lock:
+        if fcntl is not None:
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+            return
+        while True:
+            try:
+                os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) > _LOCK_STALE_SECONDS:
+                        logging.warning(f"接管过期的分片锁: {lock_path}")
+                        os.remove(lock_path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            os.remove(lock_path)
+
+
+def _parse_amount(amount):
+    try:
+        return Decimal(str(amount)) if amount else Decimal("0")
+    except InvalidOperation:
+        return Decimal("0")
+
+
+def _scan_amounts(shard_dir):
+    """按文件名中的金额重建分片的文件金额表（旧版状态文件只记录了合计）"""
+    amounts = {}
+    for entry in iter_processed_files(shard_dir, prefix="", recursive=False):
+        if looks_processed(entry.name):
+            match = _NAME_AMOUNT_RE.search(entry.name)
+            amounts[entry.name] = match.group(1) if match else "0"
+    return amounts
+
+
+def _update_shard_total(shard_dir, added=None, prune=False):
+    """
+    在分片锁内更新合计并与 sum_invoices 一样维护 `<合计>.txt` 文件：
+    added 为 (文件名, 金额) 时登记新文件；prune 为真时去掉目录中已不存在的文件。返回新的合计
+    """
+    state_path = os.path.join(shard_dir, TOTAL_STATE_FILE)
+    with _shard_lock(shard_dir):
+        state = {"files": None, "txt": None}
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                state.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"读取分片合计失败 {state_path}: {e}")
+
+        files = state["files"]
+        if files is None:
+            files = _scan_amounts(shard_dir)
+        if added is not None:
+            file_name, amount = added
+            files[file_name] = str(_parse_amount(amount))
+        if prune:
+            files = {name: amount for name, amount in files.items()
+                     if os.path.exists(os.path.join(shard_dir, name))}
+
+        total = sum((Decimal(amount) for amount in files.values()), Decimal("0"))
+        formatted_total = _format_total(total)
+        new_txt = f"{formatted_total}.txt"
+        old_txt = state.get("txt")
+        new_txt_path = os.path.join(shard_dir, new_txt)
+        if old_txt and old_txt != new_txt and os.path.exists(os.path.join(shard_dir, old_txt)):
+            os.replace(os.path.join(shard_dir, old_txt), new_txt_path)
+        with open(new_txt_path, "w") as f:
+            f.write(f"Total amount: ¥{formatted_total}\n")
+
+        state = {"total": str(total), "count": len(files), "txt": new_txt, "files": files}
+        tmp_path = f"{state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, state_path)
+    logging.debug("分片合计已更新 %s: ¥%s", shard_dir, formatted_total)
+    return total
+
+
+def add_to_shard_total(shard_dir, file_name, amount):
+    """把新归档的文件计入分片合计"""
+    return _update_shard_total(shard_dir, added=(file_name, amount))
+
+
+def refresh_shard_totals(directories):
+    """清理删除文件后，从各分片合计中去掉已不存在的文件；没有合计状态的目录跳过"""
+    for directory in set(directories):
+        if os.path.exists(os.path.join(directory, TOTAL_STATE_FILE)):
+            try:
+                _update_shard_total(directory, prune=True)
+            except Exception as e:
+                logging.error(f"更新分片合计失败 {directory}: {e}")
+
+
+def looks_processed(file_name):
+    """
+    根据文件名判断是否已由 create_new_filename 重命名为 [¥金额]发票号码。
+    不带金额的 发票号码.pdf 与用户自己的数字文件名无法区分，按未处理对待；
+    重新处理时 place 会发现文件已是目标名而保持原样
+    """
+    return os.path.splitext(file_name)[0].startswith("[¥")
+
+
+def iter_processed_files(base_dir, prefix="[¥", recursive=None):
+    """遍历以 prefix 开头的已处理文件，生成 DirEntry；分片布局下默认递归进入分片子目录"""
+    if recursive is None:
+        recursive = current_layout() != "flat"
+    stack = [base_dir]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive and not entry.name.startswith("."):
+                            stack.append(entry.path)
+                    elif entry.name.startswith(prefix) and entry.is_file(follow_symlinks=False):
+                        yield entry
+        except FileNotFoundError:
+            continue
@@ -0,0 +1,289 @@
+import os
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from config_manager import config
+from pdf_processor import create_new_filename
+from data_extractor import (decode_qrcode_array, extract_information, extract_date, extract_invoice_type,
+                            extract_invoice_code, extract_max_amount, extract_seller_tax_id)
+from file_processor import unique_path
+import metrics
+import output_layout
+import qr_location_cache
+import worker_pool
+import memory_governor
+import executors
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _scan_workers():
+    return int(config.get("page_scan_workers", 0)) or executors.workers_for("decode")
+
+
+def _get_executor():
+    """识别执行器（pyzbar 在 C 代码中释放 GIL，可与渲染并行）；page_scan_workers 指定时使用独立线程池"""
+    global _executor
+    if not int(config.get("page_scan_workers", 0)) or executors.forced_serial():
+        return executors.get_executor("decode")
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_scan_workers(), thread_name_prefix="qr-decode")
+        return _executor
+
+
+def _iter_in_order(submissions, window):
+    """保持最多 window 个页在途，按页码顺序产出结果"""
+    pending = deque()
+    try:
+        for page_num, future in submissions:
+            pending.append((page_num, future))
+            if len(pending) >= window:
+                page_num, future = pending.popleft()
+                yield page_num, future.result()
+        while pending:
+            page_num, future = pending.popleft()
+            yield page_num, future.result()
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+def _done(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def _decode_and_learn(gray, cache, key, page_rect, dpi):
+    """整页识别；识别成功时记住该版式二维码的位置"""
+    try:
+        data, box = decode_qrcode_array(gray)
+    except Exception as e:
+        logging.debug("扫描二维码失败: %s", e)
+        metrics.qr_decodes.inc(result="error")
+        return None
+    if data and cache is not None and key is not None:
+        cache.put(key, qr_location_cache.box_to_region(page_rect, box, dpi))
+    return data
+
+
+def _releaser(buffers, gray, reservation):
+    """识别结束（或被取消）后归还缓冲区并释放内存预留"""
+    def release(_future):
+        buffers.give(gray)
+        reservation.release()
+    return release
+
+
+def _iter_page_jobs(file_path, pages, dpi, executor):
+    """
+    逐页生成 (页码, Future)。先按版式指纹只渲染缓存中（或默认）的二维码区域并就地识别，
+    未命中时再整页渲染并交给识别线程池
+    """
+    import fitz
+    from qr_preprocess import pixmap_to_gray
+    cache = qr_location_cache.get_cache()
+    buffers = memory_governor.get_buffer_pool()
+    with metrics.timed("fitz_open"):
+        doc = fitz.open(file_path)
+    try:
+        pages_to_process = pages if pages is not None else range(len(doc))
+        for page_num in pages_to_process:
+            page = doc.load_page(page_num)
+            key = None
+            if cache is not None:
+                with metrics.timed("fingerprint"):
+                    key = qr_location_cache.fingerprint(page)
+                region = cache.get(key)
+                known = region is not None
+                try:
+                    data, box, clip = qr_location_cache.scan_region(
+                        page, region if known else qr_location_cache.DEFAULT_REGION, dpi)
+                except Exception as e:
+                    logging.debug("按缓存区域识别二维码失败: %s", e)
+                    data = None
+                if data:
+                    metrics.qr_cache_lookups.inc(result="hit" if known else "default")
+                    if not known:
+                        cache.put(key, qr_location_cache.box_to_region(page.rect, box, dpi, clip))
+                    yield page_num, _done(data)
+                    continue
+                metrics.qr_cache_lookups.inc(result="miss")
+
+            # 预算不足时在此等待在途页识别完成；像素复制到复用缓冲区后立即释放 pixmap
+            reservation = memory_governor.reserve(memory_governor.page_bytes(page.rect, dpi))
+            try:
+                with metrics.timed("render"):
+                    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+                    gray = buffers.copy(pixmap_to_gray(pix))
+                    del pix
+                future = executor.submit(_decode_and_learn, gray, cache, key, fitz.Rect(page.rect), dpi)
+            except BaseException:
+                reservation.release()
+                raise
+            future.add_done_callback(_releaser(buffers, gray, reservation))
+            yield page_num, future
+    finally:
+        doc.close()
+
+
+def _pool_page_job(pool, file_path, page_num, page_rect, clip, cache, key, known):
+    """
+    进程池中的单页任务：先只渲染 clip 区域，未识别到时再整页渲染；
+    识别成功时和线程模式一样更新位置缓存。返回二维码数据的 Future
+    """
+    result = Future()
+
+    def finish(future, region_clip):
+        if result.cancelled():
+            return
+        try:
+            data, box = future.result()
+            if data and cache is not None and not (known and region_clip is not None):
+                cache.put(key, qr_location_cache.box_to_region(page_rect, box, pool.dpi, region_clip))
+            result.set_result(data)
+        except InvalidStateError:
+            pass  # 调用方已取消
+        except Exception as e:
+            result.set_exception(e)
+
+    def on_region(future):
+        try:
+            data, _ = future.result()
+        except Exception as e:
+            logging.debug("按缓存区域识别二维码失败: %s", e)
+            data = None
+        if data:
+            metrics.qr_cache_lookups.inc(result="hit" if known else "default")
+            finish(future, clip)
+        elif not result.cancelled():
+            metrics.qr_cache_lookups.inc(result="miss")
+            try:
+                pool.submit(file_path, page_num).add_done_callback(lambda f: finish(f, None))
+            except Exception as e:
+                result.set_exception(e)
+
+    if clip is None:
+        pool.submit(file_path, page_num).add_done_callback(lambda f: finish(f, None))
+    else:
+        pool.submit(file_path, page_num, tuple(clip)).add_done_callback(on_region)
+    return result
+
+
+def _iter_pool_jobs(file_path, pages, pool):
+    """进程池模式下逐页生成 (页码, Future)；版式指纹在本进程计算，渲染和识别在子进程中进行"""
+    import fitz
+    cache = qr_location_cache.get_cache()
+    with fitz.open(file_path) as doc:
+        pages_to_process = pages if pages is not None else range(len(doc))
+        for page_num in pages_to_process:
+            key = clip = page_rect = None
+            known = False
+            if cache is not None:
+                page = doc.load_page(page_num)
+                page_rect = fitz.Rect(page.rect)
+                with metrics.timed("fingerprint"):
+                    key = qr_location_cache.fingerprint(page)
+                region = cache.get(key)
+                known = region is not None
+                clip = qr_location_cache.region_to_clip(page, region if known else qr_location_cache.DEFAULT_REGION)
+                if clip.is_empty:
+                    clip = None
+            yield page_num, _pool_page_job(pool, file_path, page_num, page_rect, clip, cache, key, known)
+
+
+def iter_page_qrcodes(file_path, pages=None, dpi=300):
+    """
+    按页顺序生成 (页码, 二维码数据)。渲染与识别并行进行，
+    调用方提前停止迭代（或调用 close()）时不会再渲染后续页。
+    启用进程池时同样先识别缓存（或默认）的二维码区域，未命中再整页识别
+    """
+    window = _scan_workers()
+    pool = worker_pool.get_pool()
+    if pool is not None:
+        jobs = _iter_pool_jobs(file_path, pages, pool)
+    else:
+        jobs = _iter_page_jobs(file_path, pages, dpi, _get_executor())
+    try:
+        yield from _iter_in_order(jobs, window)
+    finally:
+        jobs.close()
+
+
+def _page_ranges(records, page_count):
+    """每张发票占用的页码范围 (起始页, 结束页)；发票页之后的附页归入前一张发票"""
+    for i, record in enumerate(records):
+        from_page = 0 if i == 0 else record["page"]
+        to_page = records[i + 1]["page"] - 1 if i + 1 < len(records) else page_count - 1
+        yield record, from_page, to_page
+
+
+def _fill_from_text(file_path, records):
+    """
+    从每张发票自己页面的文本层补充销售方；与单张发票的 qr+text 策略一样，
+    8位发票号码或二维码缺少金额时以这些页面中的最大金额为准
+    """
+    import fitz
+    with fitz.open(file_path) as src:
+        for record, from_page, to_page in _page_ranges(records, len(src)):
+            with metrics.timed("text_extract"):
+                text = "".join(src.load_page(page_num).get_text() for page_num in range(from_page, to_page + 1))
+            record["seller"] = extract_seller_tax_id(text)
+            if file_path.lower().endswith(".pdf") and (not record["amount"] or len(record["invoice_number"]) == 8):
+                metrics.text_fallbacks.inc()
+                record["amount"] = extract_max_amount(text) or record["amount"]
+
+
+def _split_invoices(file_path, records, rename_with_amount=None, layout=None):
+    """
+    把合并的PDF按发票拆分为单独文件；发票页之后的附页归入前一张发票。
+    rename_with_amount、layout 含义同 InvoiceProcessor，None 时取配置
+    """
+    import fitz
+    directory = os.path.dirname(file_path)
+    with fitz.open(file_path) as src:
+        for record, from_page, to_page in _page_ranges(records, len(src)):
+            new_file_name = create_new_filename(record["invoice_number"], record["amount"], file_path,
+                                                rename_with_amount)
+            part_path = unique_path(directory, f".split_{record['invoice_number']}.pdf")
+            with fitz.open() as out:
+                out.insert_pdf(src, from_page=from_page, to_page=to_page)
+                out.save(part_path, garbage=3, deflate=True)
+            new_file_path = output_layout.place(
+                part_path, new_file_name,
+                date=record["date"], seller=record["seller"], amount=record["amount"], layout=layout)
+            record["path"] = new_file_path
+            logging.info(f"拆分发票 {record['invoice_number']} (第{from_page + 1}-{to_page + 1}页): {new_file_path}")
+    os.remove(file_path)
+
+
+def process_multi_invoice(file_path, split=None, rename_with_amount=None, layout=None):
+    """
+    多发票模式：扫描所有页，每个带二维码的发票页输出一条记录；
+    split 为真时把每张发票按 rename_with_amount、layout 拆分归档并删除原合并文件
+    """
+    if split is None:
+        split = config.get("split_multi_invoice", False)
+    records = []
+    with metrics.timed("multi_invoice_scan"):
+        for page_num, qrcode_data in iter_page_qrcodes(file_path):
+            if not qrcode_data:
+                continue
+            invoice_number, amount = extract_information(qrcode_data)
+            # 同一张发票跨页时每页都可能带二维码，只保留第一页
+            if invoice_number and not (records and records[-1]["invoice_number"] == invoice_number):
+                records.append({"page": page_num, "invoice_code": extract_invoice_code(qrcode_data),
+                                "invoice_number": invoice_number, "amount": amount,
+                                "date": extract_date(qrcode_data),
+                                "invoice_type": extract_invoice_type(qrcode_data), "seller": None,
+                                "path": None})
+    logging.info(f"在 {file_path} 中找到 {len(records)} 张发票")
+    if records:
+        _fill_from_text(file_path, records)
+    if split and records:
+        with metrics.timed("split"):
+            _split_invoices(file_path, records, rename_with_amount, layout)
+    return records
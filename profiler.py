@@ -0,0 +1,124 @@
+import cProfile
+import functools
+import hashlib
+import logging
+import os
+import threading
+import time
+from config_manager import config
+import executors
+
+# 同一时间只允许一个剖析器运行（cProfile 在 3.12+ 不支持多个并发实例）
+_profile_lock = threading.Lock()
+
+_settings = {
+    "enabled": bool(config.get("profile_enabled", False)),
+    "threshold_ms": int(config.get("profile_threshold_ms", 2000)),
+    "profiles_dir": config.get("profiles_dir", "./profiles"),
+    "max_mb": int(config.get("profile_max_mb", 100)),
+}
+
+
+def enabled():
+    return _settings["enabled"]
+
+
+def configure(enabled=None, threshold_ms=None):
+    """运行时开启/关闭剖析模式或调整慢文件阈值"""
+    if enabled is not None:
+        _settings["enabled"] = bool(enabled)
+    if threshold_ms is not None:
+        _settings["threshold_ms"] = int(threshold_ms)
+    logging.info(f"剖析模式: enabled={_settings['enabled']}, threshold={_settings['threshold_ms']}ms")
+
+
+def status():
+    """返回当前剖析配置及已保存的剖析文件"""
+    profiles = []
+    profiles_dir = _settings["profiles_dir"]
+    if os.path.isdir(profiles_dir):
+        with os.scandir(profiles_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".prof"):
+                    profiles.append({"name": entry.name, "size": entry.stat().st_size})
+    profiles.sort(key=lambda p: p["name"])
+    return {**_settings, "profiles": profiles}
+
+
+def _file_hash(file_path):
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _enforce_size_cap(profiles_dir):
+    """删除最旧的剖析文件，直到目录总大小低于上限"""
+    max_bytes = _settings["max_mb"] * 1024 * 1024
+    entries = []
+    with os.scandir(profiles_dir) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith(".prof"):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            logging.debug("剖析目录超出上限，已删除: %s", path)
+        except OSError as e:
+            logging.error(f"删除剖析文件失败 {path}: {e}")
+
+
+def _save_profile(profile, file_hash, elapsed_ms):
+    profiles_dir = _settings["profiles_dir"]
+    os.makedirs(profiles_dir, exist_ok=True)
+    output = os.path.join(profiles_dir, f"{file_hash[:16]}_{int(elapsed_ms)}ms.prof")
+    profile.dump_stats(output)
+    logging.warning(f"慢文件处理耗时 {elapsed_ms:.0f}ms，已保存剖析结果: {output}")
+    _enforce_size_cap(profiles_dir)
+
+
+def call(file_path, func, *args, **kwargs):
+    """
+    调用处理函数；剖析模式下若耗时超过阈值则以文件哈希保存 cProfile 结果。
+    cProfile 只记录调用线程，因此被剖析的文件在 executors.serial() 中处理：渲染和识别
+    不交给线程池或进程池，剖析结果包含这些阶段。代价是该文件处理变慢，阈值按串行耗时计算
+    """
+    if not _settings["enabled"] or not _profile_lock.acquire(blocking=False):
+        return func(*args, **kwargs)
+    try:
+        # 处理过程中文件会被重命名，因此需要提前计算哈希
+        try:
+            file_hash = _file_hash(file_path)
+        except OSError:
+            return func(*args, **kwargs)
+
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            with executors.serial():
+                return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if elapsed_ms >= _settings["threshold_ms"]:
+                try:
+                    _save_profile(profile, file_hash, elapsed_ms)
+                except Exception as e:
+                    logging.error(f"保存剖析结果失败: {e}")
+    finally:
+        _profile_lock.release()
+
+
+def profile_slow(func):
+    """装饰器：以第一个参数作为文件路径，按需剖析慢文件"""
+    @functools.wraps(func)
+    def wrapper(file_path, *args, **kwargs):
+        return call(file_path, func, file_path, *args, **kwargs)
+    return wrapper
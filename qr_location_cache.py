@@ -0,0 +1,155 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from config_manager import config
+import metrics
+
+# 页面版式指纹 -> 二维码在页面中的相对位置 (x0, y0, x1, y1)，取值为页面宽高的比例。
+# 同一开票方/模板的发票二维码位置固定，命中后只需渲染并识别这一小块区域。
+
+# 文本锚点只取前若干个非数字词，坐标按 10pt 取整，避免金额、号码等可变内容影响指纹
+_ANCHOR_COUNT = 12
+_GRID = 10
+_DIGITS_RE = re.compile(r"[\d.,:：¥￥\-/]+")
+
+# 识别到的二维码框四周预留的余量（占页面宽高的比例）
+_PADDING = 0.02
+
+# 没有模板记录时先尝试的默认区域：左上角 430x350 像素（300 DPI）
+DEFAULT_REGION = (0.0, 0.0, 430 * 72 / 300 / 595.0, 350 * 72 / 300 / 842.0)
+
+
+def fingerprint(page):
+    """根据页面尺寸和文本层锚点生成版式指纹"""
+    rect = page.rect
+    parts = [f"{round(rect.width)}x{round(rect.height)}r{page.rotation}"]
+    anchors = 0
+    for x0, y0, _, _, word, *_ in page.get_text("words", sort=True):
+        if _DIGITS_RE.fullmatch(word):
+            continue
+        parts.append(f"{word}@{int(x0) // _GRID},{int(y0) // _GRID}")
+        anchors += 1
+        if anchors >= _ANCHOR_COUNT:
+            break
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:20]
+
+
+class QRLocationCache:
+    """有容量上限的 LRU 缓存，定期持久化到 JSON 文件"""
+
+    def __init__(self, path, max_entries=512, save_every=20):
+        self.path = path
+        self.max_entries = max_entries
+        self.save_every = save_every
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = 0
+        self._load()
+
+    def _load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    for key, region in json.load(f).items():
+                        self._entries[key] = tuple(region)
+        except Exception as e:
+            logging.warning(f"加载二维码位置缓存失败: {e}")
+
+    def get(self, key):
+        with self._lock:
+            region = self._entries.get(key)
+            if region is not None:
+                self._entries.move_to_end(key)
+            return region
+
+    def put(self, key, region):
+        with self._lock:
+            self._entries[key] = tuple(round(float(v), 4) for v in region)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty += 1
+            should_save = self._dirty >= self.save_every
+        if should_save:
+            self.save()
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = dict(self._entries)
+            self._dirty = 0
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.error(f"保存二维码位置缓存失败: {e}")
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """返回全局缓存；未启用时返回 None"""
+    global _cache
+    if not config.get("qr_cache_enabled", True):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            # 与汇总库、日志一样放在 ./data，tmp 会被命令行处理和 /clear-cache 清空
+            path = config.get("qr_cache_path") or "./data/qr_location_cache.json"
+            _cache = QRLocationCache(path, max_entries=int(config.get("qr_cache_size", 512)))
+            atexit.register(_cache.save)
+        return _cache
+
+
+def region_to_clip(page, region):
+    """把相对位置转换为页面坐标矩形"""
+    import fitz
+    rect = page.rect
+    x0, y0, x1, y1 = region
+    return fitz.Rect(rect.x0 + x0 * rect.width, rect.y0 + y0 * rect.height,
+                     rect.x0 + x1 * rect.width, rect.y0 + y1 * rect.height) & rect
+
+
+def box_to_region(rect, box, dpi, clip=None):
+    """把渲染图中的像素框换算为带余量的相对位置；rect 为页面矩形，clip 为渲染时的裁剪矩形"""
+    origin_x = clip.x0 if clip is not None else rect.x0
+    origin_y = clip.y0 if clip is not None else rect.y0
+    x0, y0, x1, y1 = (v * 72.0 / dpi for v in box)
+    return (
+        max((origin_x + x0 - rect.x0) / rect.width - _PADDING, 0.0),
+        max((origin_y + y0 - rect.y0) / rect.height - _PADDING, 0.0),
+        min((origin_x + x1 - rect.x0) / rect.width + _PADDING, 1.0),
+        min((origin_y + y1 - rect.y0) / rect.height + _PADDING, 1.0),
+    )
+
+
+def scan_region(page, region, dpi):
+    """只渲染并识别页面的某个区域，返回 (二维码数据, 像素框, 裁剪矩形)"""
+    import fitz
+    from qr_preprocess import pixmap_to_gray
+    from data_extractor import decode_qrcode_array
+    import memory_governor
+    clip = region_to_clip(page, region)
+    if clip.is_empty:
+        return None, None, clip
+    with memory_governor.reserve(memory_governor.page_bytes(clip, dpi)):
+        with metrics.timed("render_region"):
+            pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, clip=clip)
+            gray = pixmap_to_gray(pix)
+        data, box = decode_qrcode_array(gray)
+        del gray, pix
+    return data, box, clip
@@ -0,0 +1,148 @@
+"""
+二维码识别前的预处理：灰度、降采样、自适应二值化与定位图形（finder pattern）粗定位
+
+全部基于 numpy 向量化实现，输入为二维 uint8 灰度数组。
+"""
+import logging
+from config_manager import config
+
+
+def pixmap_to_gray(pix):
+    """把 fitz 灰度 Pixmap（csGRAY）转换为二维数组视图"""
+    import numpy as np
+    rows = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.stride)
+    return rows[:, :pix.width * pix.n:pix.n]
+
+
+def downscale(gray, factor):
+    """按整数倍块平均降采样"""
+    if factor <= 1:
+        return gray
+    import numpy as np
+    h = gray.shape[0] // factor * factor
+    w = gray.shape[1] // factor * factor
+    blocks = gray[:h, :w].reshape(h // factor, factor, w // factor, factor)
+    return blocks.mean(axis=(1, 3), dtype=np.float32).astype(np.uint8)
+
+
+def _box_sum(values, radius, axis):
+    """沿某一轴求滑动窗口和（边缘处窗口截断）"""
+    import numpy as np
+    n = values.shape[axis]
+    padded = np.concatenate(
+        [np.zeros_like(values.take([0], axis=axis)), values.cumsum(axis=axis, dtype=np.int32)], axis=axis)
+    hi = np.minimum(np.arange(n) + radius + 1, n)
+    lo = np.maximum(np.arange(n) - radius, 0)
+    return padded.take(hi, axis=axis) - padded.take(lo, axis=axis)
+
+
+def adaptive_threshold(gray, block=31, offset=10):
+    """基于可分离盒式滤波的局部均值二值化，深色为 0、浅色为 255"""
+    import numpy as np
+    h, w = gray.shape
+    r = block // 2
+    sums = _box_sum(_box_sum(gray.astype(np.int32), r, 1), r, 0)
+    rows = np.minimum(np.arange(h) + r + 1, h) - np.maximum(np.arange(h) - r, 0)
+    cols = np.minimum(np.arange(w) + r + 1, w) - np.maximum(np.arange(w) - r, 0)
+    # gray < mean - offset  <=>  gray * area < sums - offset * area
+    area = rows[:, None] * cols[None, :]
+    return np.where(gray * area < sums - offset * area, 0, 255).astype(np.uint8)
+
+
+def _row_finder_candidates(row_dark, y):
+    """在一行中查找 1:1:3:1:1 的黑白游程，返回 [(x中心, y, 模块宽度)]"""
+    import numpy as np
+    changes = np.flatnonzero(np.diff(row_dark.view(np.int8))) + 1
+    if len(changes) < 6:
+        return []
+    bounds = np.concatenate(([0], changes, [len(row_dark)]))
+    runs = np.diff(bounds)
+    starts_dark = row_dark[bounds[:-1]]
+    n = len(runs) - 4
+    if n <= 0:
+        return []
+    window = np.stack([runs[i:i + n] for i in range(5)], axis=1)
+    total = window.sum(axis=1)
+    unit = total / 7.0
+    expected = np.array([1, 1, 3, 1, 1], dtype=np.float64)
+    ok = starts_dark[:n] & (unit >= 1.0)
+    ok &= (np.abs(window - expected[None, :] * unit[:, None]) <= unit[:, None] * 0.75).all(axis=1)
+    idx = np.flatnonzero(ok)
+    return [(bounds[i] + total[i] / 2.0, y, unit[i]) for i in idx]
+
+
+def locate_qr(binary, row_step=2, margin_modules=6):
+    """
+    在二值图中粗定位二维码区域，返回 (x0, y0, x1, y1) 或 None。
+    取定位图形候选点最密集的一簇作为二维码所在区域
+    """
+    import numpy as np
+    dark = binary == 0
+    candidates = []
+    for y in range(0, dark.shape[0], row_step):
+        candidates.extend(_row_finder_candidates(dark[y], y))
+        if len(candidates) > 4000:
+            break
+    if len(candidates) < 3:
+        return None
+
+    points = np.array(candidates, dtype=np.float64)
+    unit = float(np.median(points[:, 2]))
+    # 二维码边长约 21-45 个模块，三个定位图形都在该半径内
+    radius = unit * 40
+    diff = points[:, None, :2] - points[None, :, :2]
+    near = (np.abs(diff) <= radius).all(axis=2)
+    best = int(near.sum(axis=1).argmax())
+    cluster = points[near[best]]
+    if len(cluster) < 3:
+        return None
+
+    margin = unit * margin_modules
+    h, w = binary.shape
+    x0 = int(max(cluster[:, 0].min() - 4 * unit - margin, 0))
+    x1 = int(min(cluster[:, 0].max() + 4 * unit + margin, w))
+    y0 = int(max(cluster[:, 1].min() - 4 * unit - margin, 0))
+    y1 = int(min(cluster[:, 1].max() + 4 * unit + margin, h))
+    if x1 - x0 < 8 or y1 - y0 < 8:
+        return None
+    return x0, y0, x1, y1
+
+
+# 定位在长边约 1000 像素的缩略图上进行，开销与原图尺寸基本无关
+_LOCATE_MAX_SIDE = 1000
+
+
+def decode_candidates_with_origin(gray):
+    """
+    生成依次尝试识别的候选图像及其在原图中的位置 (图像, x0, y0, 缩放倍数)：
+    定位区域的二值图、定位区域灰度图、整页灰度图、整页二值图。
+    候选按开销从小到大排列并惰性生成，调用方识别成功即可停止迭代
+    """
+    scale = int(config.get("qr_downscale", 1))
+    small = downscale(gray, scale)
+    binarize = config.get("qr_binarize", True)
+
+    if config.get("qr_locate", True):
+        box = None
+        try:
+            factor = max(1, max(small.shape) // _LOCATE_MAX_SIDE)
+            box = locate_qr(adaptive_threshold(downscale(small, factor), block=15))
+        except Exception as e:
+            logging.debug("二维码定位失败: %s", e)
+        if box is not None:
+            x0, y0, x1, y1 = (v * factor for v in box)
+            crop = small[y0:y1, x0:x1]
+            if binarize:
+                yield adaptive_threshold(crop), x0 * scale, y0 * scale, max(scale, 1)
+            yield crop, x0 * scale, y0 * scale, max(scale, 1)
+
+    yield small, 0, 0, max(scale, 1)
+    if binarize:
+        # 整页二值化开销最大，仅在褪色扫描件等情况下作为最后手段
+        yield adaptive_threshold(small), 0, 0, max(scale, 1)
+
+
+def decode_candidates(gray):
+    """只生成候选图像，见 decode_candidates_with_origin"""
+    for candidate, _, _, _ in decode_candidates_with_origin(gray):
+        yield candidate
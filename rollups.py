@@ -0,0 +1,176 @@
+"""
+发票金额的物化汇总：总计、按月、按销售方、按发票类型
+
+每处理完一张发票即增量更新汇总表，查询时直接读取汇总行，无需重新扫描归档目录。
+金额以"分"为单位的整数存储，保证精确。
+
+用法: python rollups.py [total|month|seller|type]
+"""
+import logging
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from config_manager import config
+
+DIMENSIONS = ("total", "month", "seller", "type")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    invoice_code TEXT NOT NULL DEFAULT '',
+    invoice_number TEXT NOT NULL,
+    amount_cents INTEGER NOT NULL,
+    month TEXT,
+    seller TEXT,
+    invoice_type TEXT,
+    path TEXT,
+    recorded_at TEXT NOT NULL,
+    PRIMARY KEY (invoice_code, invoice_number)
+);
+CREATE TABLE IF NOT EXISTS rollups (
+    dimension TEXT NOT NULL,
+    key TEXT NOT NULL,
+    amount_cents INTEGER NOT NULL DEFAULT 0,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (dimension, key)
+);
+"""
+
+_UPSERT = """
+INSERT INTO rollups (dimension, key, amount_cents, count) VALUES (?, ?, ?, 1)
+ON CONFLICT (dimension, key) DO UPDATE SET
+    amount_cents = amount_cents + excluded.amount_cents,
+    count = count + 1
+"""
+
+
+def to_cents(amount):
+    """把金额字符串精确转换为分"""
+    if not amount:
+        return 0
+    try:
+        return int((Decimal(str(amount)) * 100).quantize(Decimal("1")))
+    except InvalidOperation:
+        return 0
+
+
+def from_cents(cents):
+    return (Decimal(cents) / 100).quantize(Decimal("0.01"))
+
+
+class RollupStore:
+    """基于 SQLite 的汇总存储"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._migrate()
+        self._conn.executescript(_SCHEMA)
+
+    def _migrate(self):
+        """旧版 invoices 表只以发票号码为主键：改为 (发票代码, 发票号码)，已有记录的代码为空"""
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(invoices)")]
+        if not columns or "invoice_code" in columns:
+            return
+        with self._conn:
+            self._conn.execute("ALTER TABLE invoices RENAME TO invoices_v1")
+            self._conn.executescript(_SCHEMA)
+            self._conn.execute(
+                "INSERT INTO invoices (invoice_number, amount_cents, month, seller, invoice_type, path, recorded_at) "
+                "SELECT invoice_number, amount_cents, month, seller, invoice_type, path, recorded_at FROM invoices_v1")
+            self._conn.execute("DROP TABLE invoices_v1")
+        logging.info("汇总库已升级：发票按代码和号码去重")
+
+    def record(self, invoice_number, amount, date=None, seller=None, invoice_type=None, path=None,
+               invoice_code=None):
+        """
+        记录一张发票并增量更新各维度汇总；同一发票（代码+号码）重复处理时不重复计入，返回是否新增。
+        8位号码的老式发票在不同发票代码下可能重复，数电票没有发票代码
+        """
+        if not invoice_number:
+            return False
+        cents = to_cents(amount)
+        month = f"{date[:4]}-{date[4:6]}" if date and len(date) >= 6 else "unknown"
+        seller = seller or "unknown"
+        invoice_type = invoice_type or "unknown"
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO invoices VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (invoice_code or "", invoice_number, cents, month, seller, invoice_type, path,
+                 datetime.now().isoformat()))
+            if cursor.rowcount == 0:
+                return False
+            self._conn.executemany(_UPSERT, [
+                ("total", "", cents),
+                ("month", month, cents),
+                ("seller", seller, cents),
+                ("type", invoice_type, cents),
+            ])
+        return True
+
+    def query(self, dimension="total"):
+        """返回某一维度的汇总 [{key, amount, count}]"""
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"未知的汇总维度: {dimension}")
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, amount_cents, count FROM rollups WHERE dimension = ? ORDER BY key",
+                (dimension,)).fetchall()
+        return [{"key": key, "amount": str(from_cents(cents)), "count": count} for key, cents, count in rows]
+
+    def total(self):
+        rows = self.query("total")
+        return rows[0] if rows else {"key": "", "amount": "0.00", "count": 0}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """返回全局汇总存储；未启用时返回 None"""
+    global _store
+    if not config.get("rollups_enabled", True):
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = RollupStore(config.get("rollups_path", "./data/rollups.db"))
+        return _store
+
+
+def record(invoice_number, amount, date=None, seller=None, invoice_type=None, path=None, invoice_code=None):
+    """记录一张已处理的发票；汇总失败不影响发票处理本身"""
+    try:
+        store = get_store()
+        if store is not None:
+            store.record(invoice_number, amount, date, seller, invoice_type, path, invoice_code)
+    except Exception as e:
+        logging.error(f"更新发票汇总失败 {invoice_number}: {e}")
+
+
+def main(dimension="total"):
+    store = get_store()
+    if store is None:
+        print("汇总未启用（rollups_enabled=false）")
+        return
+    for row in store.query(dimension):
+        label = row["key"] or "总计"
+        print(f"{label}\t¥{row['amount']}\t{row['count']} 张")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 or (len(sys.argv) == 2 and sys.argv[1] not in DIMENSIONS):
+        print(f"Usage: python rollups.py [{'|'.join(DIMENSIONS)}]")
+    else:
+        main(sys.argv[1] if len(sys.argv) == 2 else "total")
@@ -0,0 +1,150 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from config_manager import config
+import metrics
+import executors
+
+# 优先级从高到低：网页上传（用户在浏览器中等待）> 监控目录新文件 > 启动时补扫的积压文件
+PRIORITY_CLASSES = ("interactive", "watch", "catchup")
+
+
+class _Task:
+    __slots__ = ("future", "fn", "args", "kwargs", "enqueued", "context")
+
+    def __init__(self, fn, args, kwargs):
+        self.future = Future()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.enqueued = time.monotonic()
+        # 在提交者的上下文中运行（日志 trace 等）
+        self.context = contextvars.copy_context()
+
+
+class PriorityScheduler:
+    """
+    带优先级类别的固定大小线程池：
+    - 空闲线程总是取当前得分最高的队首任务，得分 = 类别等级 - 等待秒数 / aging_seconds，
+      低优先级任务等得足够久后也能被调度，积压不会饿死
+    - 每个类别有并发上限；非交互类别合计最多占用 workers - reserved 个线程，
+      留出的线程保证上传请求到来时无需排队
+    """
+
+    def __init__(self, workers, limits=None, aging_seconds=30.0, reserved=1):
+        self.workers = max(1, workers)
+        self.reserved = min(max(0, reserved), self.workers - 1)
+        default_limits = {
+            "interactive": self.workers,
+            "watch": max(1, self.workers - 1),
+            "catchup": max(1, self.workers // 2),
+        }
+        self.limits = {**default_limits, **(limits or {})}
+        self.aging_seconds = aging_seconds
+        self._queues = {cls: deque() for cls in PRIORITY_CLASSES}
+        self._running = dict.fromkeys(PRIORITY_CLASSES, 0)
+        self._cond = threading.Condition()
+        self._shutdown = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"scheduler-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, priority_class, fn, *args, **kwargs):
+        """按类别提交任务，返回 concurrent.futures.Future"""
+        if priority_class not in self._queues:
+            raise ValueError(f"未知的优先级类别: {priority_class}")
+        task = _Task(fn, args, kwargs)
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("调度器已关闭")
+            self._queues[priority_class].append(task)
+            metrics.queue_depth.set(len(self._queues[priority_class]), queue=priority_class)
+            self._cond.notify()
+        return task.future
+
+    def _pick(self):
+        """选出下一个要运行的类别；没有可运行任务时返回 None（需持有锁）"""
+        now = time.monotonic()
+        background = sum(self._running[cls] for cls in PRIORITY_CLASSES[1:])
+        best, best_score = None, None
+        for rank, cls in enumerate(PRIORITY_CLASSES):
+            queue = self._queues[cls]
+            if not queue or self._running[cls] >= self.limits[cls]:
+                continue
+            if rank and background >= self.workers - self.reserved:
+                continue
+            score = rank - (now - queue[0].enqueued) / self.aging_seconds
+            if best_score is None or score < best_score:
+                best, best_score = cls, score
+        return best
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while True:
+                    cls = self._pick()
+                    if cls is not None or self._shutdown:
+                        break
+                    self._cond.wait()
+                if cls is None:
+                    return
+                task = self._queues[cls].popleft()
+                self._running[cls] += 1
+                metrics.queue_depth.set(len(self._queues[cls]), queue=cls)
+            try:
+                if task.future.set_running_or_notify_cancel():
+                    metrics.stage_duration.observe(time.monotonic() - task.enqueued, stage=f"queue_wait_{cls}")
+                    try:
+                        task.future.set_result(task.context.run(task.fn, *task.args, **task.kwargs))
+                    except BaseException as e:
+                        task.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running[cls] -= 1
+                    # 并发上限释放后，其它等待中的线程可能可以运行被限制的类别
+                    self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {cls: {"queued": len(self._queues[cls]), "running": self._running[cls],
+                          "limit": self.limits[cls]} for cls in PRIORITY_CLASSES}
+
+    def shutdown(self, wait=True):
+        """停止接收新任务；队列中尚未开始的任务被取消"""
+        with self._cond:
+            self._shutdown = True
+            for queue in self._queues.values():
+                while queue:
+                    queue.popleft().future.cancel()
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """返回全局调度器，线程数与各类别并发上限取自配置（0 表示自动）"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            # 默认比 process 阶段多一个线程，留给交互类别
+            workers = int(config.get("scheduler_workers", 0)) or executors.workers_for("process") + 1
+            limits = {}
+            for cls in PRIORITY_CLASSES:
+                limit = int(config.get(f"scheduler_{cls}_limit", 0))
+                if limit > 0:
+                    limits[cls] = limit
+            _scheduler = PriorityScheduler(workers, limits, float(config.get("scheduler_aging_seconds", 30)),
+                                           reserved=int(config.get("scheduler_interactive_reserved", 1)))
+            logging.info(f"任务调度器已启动: {_scheduler.workers} 个线程, 并发上限 {_scheduler.limits}")
+        return _scheduler
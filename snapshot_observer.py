@@ -0,0 +1,219 @@
+"""
+基于快照对比的轮询观察者，用于 NFS/SMB 等 inotify 收不到其它主机变更的网络文件系统
+
+与 watchdog 自带的 PollingObserver 每次都 stat 全部文件不同，这里为每个目录保存
+(目录 mtime, {文件名: (inode, 大小, mtime)}) 的紧凑快照：
+- 目录 mtime 未变时其直接子项未增删，跳过 scandir，只 stat 一次目录本身
+- 只对最近仍在变化的“热”文件逐个 stat，用于发出修改事件（文件仍在写入）
+- 新增与删除按 inode 配对还原为移动事件
+- 有变化时按最短间隔轮询，空闲时逐步退避到最长间隔
+
+接口与 watchdog 的 Observer 一致（schedule/start/stop/join），事件交给 handler.dispatch。
+"""
+import logging
+import os
+import threading
+import time
+from watchdog.events import (FileCreatedEvent, FileDeletedEvent, FileModifiedEvent, FileMovedEvent,
+                             DirCreatedEvent, DirDeletedEvent)
+from config_manager import config
+
+# mtime 距今不足该值的目录即使 mtime 未变也重新扫描（粗粒度时间戳下同一刻内的多次修改）
+_RACY_NS = 2_000_000_000
+# mtime 距今不足该秒数的文件视为仍在写入，每轮都单独 stat
+_HOT_SECONDS = 10.0
+
+
+class _DirState:
+    __slots__ = ("mtime_ns", "files", "subdirs", "hot")
+
+    def __init__(self, mtime_ns):
+        self.mtime_ns = mtime_ns
+        self.files = {}      # 文件名 -> (inode, 大小, mtime_ns)
+        self.subdirs = {}    # 子目录名 -> inode
+        self.hot = set()     # 仍在变化的文件名
+
+
+class _Watch:
+    __slots__ = ("handler", "root", "recursive", "dirs")
+
+    def __init__(self, handler, root, recursive):
+        self.handler = handler
+        self.root = os.path.abspath(root)
+        self.recursive = recursive
+        self.dirs = {}
+
+
+def _file_key(st):
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class SnapshotObserver:
+    def __init__(self, min_interval=None, max_interval=None):
+        self.min_interval = min_interval if min_interval is not None else config.get("watch_poll_min_ms", 500) / 1000.0
+        self.max_interval = max_interval if max_interval is not None else config.get("watch_poll_max_ms", 10000) / 1000.0
+        self.interval = self.min_interval
+        self._watches = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def schedule(self, handler, path, recursive=False):
+        watch = _Watch(handler, path, recursive)
+        # 建立初始快照，不发出事件
+        self._poll(watch, emit=False)
+        with self._lock:
+            self._watches.append(watch)
+        return watch
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="snapshot-observer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            changed = 0
+            with self._lock:
+                watches = list(self._watches)
+            for watch in watches:
+                try:
+                    changed += self._poll(watch)
+                except Exception as e:
+                    logging.error(f"轮询目录失败 {watch.root}: {e}")
+            # 有变化时保持最短间隔，空闲时逐步退避
+            if changed:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * 1.5, self.max_interval)
+
+    # -- 快照对比 ------------------------------------------------------
+
+    def _scan_dir(self, path, old, mtime_ns, now):
+        """重新列出目录，只 stat 新出现或仍在变化的文件，返回 (新状态, 新增, 删除, 修改)"""
+        state = _DirState(mtime_ns)
+        created, deleted, modified = [], [], []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        state.subdirs[entry.name] = entry.inode()
+                        continue
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    previous = old.files.get(entry.name) if old else None
+                    if previous is not None and previous[0] == entry.inode() and entry.name not in old.hot:
+                        state.files[entry.name] = previous
+                        continue
+                    key = _file_key(entry.stat(follow_symlinks=False))
+                except FileNotFoundError:
+                    continue
+                state.files[entry.name] = key
+                if now - key[2] / 1e9 < _HOT_SECONDS:
+                    state.hot.add(entry.name)
+                if previous is None or previous[0] != key[0]:
+                    created.append((entry.name, key[0]))
+                elif previous != key:
+                    modified.append(entry.name)
+        if old is not None:
+            for name, key in old.files.items():
+                if name not in state.files or state.files[name][0] != key[0]:
+                    deleted.append((name, key[0]))
+        return state, created, deleted, modified
+
+    def _check_hot(self, path, state, now):
+        """目录未变化时只检查仍在写入的文件"""
+        modified = []
+        for name in list(state.hot):
+            try:
+                key = _file_key(os.stat(os.path.join(path, name), follow_symlinks=False))
+            except FileNotFoundError:
+                state.hot.discard(name)
+                continue
+            if key != state.files.get(name):
+                state.files[name] = key
+                modified.append(name)
+            if now - key[2] / 1e9 >= _HOT_SECONDS:
+                state.hot.discard(name)
+        return modified
+
+    def _poll(self, watch, emit=True):
+        """轮询一个监控根目录并分发事件，返回事件数"""
+        now = time.time()
+        created, deleted, modified = {}, {}, []
+        dirs_created, dirs_deleted = [], []
+        seen = set()
+        stack = [watch.root]
+        while stack:
+            path = stack.pop()
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            seen.add(path)
+            old = watch.dirs.get(path)
+            racy = time.time_ns() - st.st_mtime_ns < _RACY_NS
+            if old is None or old.mtime_ns != st.st_mtime_ns or racy:
+                try:
+                    state, new_files, gone_files, changed = self._scan_dir(path, old, st.st_mtime_ns, now)
+                except (FileNotFoundError, NotADirectoryError, PermissionError):
+                    continue
+                watch.dirs[path] = state
+                for name, ino in new_files:
+                    created[os.path.join(path, name)] = ino
+                for name, ino in gone_files:
+                    deleted[os.path.join(path, name)] = ino
+                modified.extend(os.path.join(path, name) for name in changed)
+                if old is not None:
+                    dirs_created.extend(os.path.join(path, name) for name in state.subdirs if name not in old.subdirs)
+                    dirs_deleted.extend(os.path.join(path, name) for name in old.subdirs if name not in state.subdirs)
+            else:
+                state = old
+                modified.extend(os.path.join(path, name) for name in self._check_hot(path, state, now))
+            if watch.recursive:
+                stack.extend(os.path.join(path, name) for name in state.subdirs)
+
+        # 已消失目录的快照整体丢弃
+        for path in [p for p in watch.dirs if p not in seen]:
+            del watch.dirs[path]
+
+        if not emit:
+            return 0
+
+        events = []
+        moved_from = {ino: path for path, ino in deleted.items()}
+        for path, ino in created.items():
+            src = moved_from.pop(ino, None)
+            if src is not None:
+                events.append(FileMovedEvent(src, path))
+            else:
+                events.append(FileCreatedEvent(path))
+        deleted_paths = set(moved_from.values())
+        events.extend(FileDeletedEvent(path) for path in deleted if path in deleted_paths)
+        events.extend(FileModifiedEvent(path) for path in modified)
+        events.extend(DirCreatedEvent(path) for path in dirs_created)
+        events.extend(DirDeletedEvent(path) for path in dirs_deleted)
+        for event in events:
+            try:
+                watch.handler.dispatch(event)
+            except Exception as e:
+                logging.error(f"分发文件事件失败 {event.src_path}: {e}")
+        return len(events)
+
+
+def create_observer():
+    """按配置创建观察者：watch_backend 为 polling 时使用快照轮询，否则使用 watchdog 原生观察者"""
+    if config.get("watch_backend", "native") == "polling":
+        logging.info("使用快照轮询观察者监控目录")
+        return SnapshotObserver()
+    from watchdog.observers import Observer
+    return Observer()
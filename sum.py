@@ -1,54 +1,112 @@
 import os
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from decimal import Decimal, InvalidOperation
+
+AMOUNT_RE = re.compile(r'\[¥([0-9.]+)\]')
 
 def extract_amount(filename):
-    # 使用正则表达式提取金额
-    match = re.search(r'\[¥([0-9.]+)\]', filename)
+    # 使用正则表达式提取金额，Decimal 保证累加精确
+    match = AMOUNT_RE.search(filename)
     if match:
-        return float(match.group(1))
-    return 0.0
+        try:
+            return Decimal(match.group(1))
+        except InvalidOperation:
+            pass
+    return Decimal("0")
 
-def main(invoice_folder):
-    total_sum = 0.0
+def scan_folder(folder):
+    """
+    用 os.scandir 扫描单个文件夹，返回 (小计, 发票数, 子文件夹列表)；
+    DirEntry 自带的类型信息在大多数文件系统上无需额外 stat
+    """
+    subtotal = Decimal("0")
+    count = 0
+    subdirs = []
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.startswith("[¥") and entry.is_file(follow_symlinks=False):
+                    subtotal += extract_amount(entry.name)
+                    count += 1
+    except (PermissionError, FileNotFoundError):
+        pass
+    return subtotal, count, subdirs
+
+def iter_folder_totals(root, workers=8):
+    """
+    并行遍历目录树，每扫描完一个文件夹就生成 (文件夹, 小计, 发票数)。
+    小计只包含该文件夹下的直接文件；输出顺序取决于完成顺序。
+    在途任务数有上限，目录再多内存占用也保持平稳
+    """
+    pending_dirs = [root]
+    max_in_flight = max(1, workers) * 4
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        in_flight = {}
+        while pending_dirs or in_flight:
+            while pending_dirs and len(in_flight) < max_in_flight:
+                folder = pending_dirs.pop()
+                in_flight[executor.submit(scan_folder, folder)] = folder
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                folder = in_flight.pop(future)
+                subtotal, count, subdirs = future.result()
+                pending_dirs.extend(subdirs)
+                yield folder, subtotal, count
 
+def main(invoice_folder):
     # 检查发票文件夹是否存在
     if not os.path.isdir(invoice_folder):
         print("Invoice folder does not exist.")
         return
 
-    # 遍历发票文件夹中的所有文件
-    for filename in os.listdir(invoice_folder):
-        filepath = os.path.join(invoice_folder, filename)
-        if os.path.isfile(filepath):
-            # 提取文件名中的金额部分并累加
-            amount = extract_amount(filename)
-            total_sum += amount
+    # 单次 scandir 遍历同时累加金额并找到已有的 .txt 文件
+    total_sum = Decimal("0")
+    txt_file = None
+    with os.scandir(invoice_folder) as entries:
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            if txt_file is None and entry.name.endswith(".txt"):
+                txt_file = entry.path
+            total_sum += extract_amount(entry.name)
 
     # 格式化总金额，确保只有两位小数
-    formatted_total = f"{total_sum:.2f}"
-
-    # 查找文件夹中的 .txt 文件
-    txt_file_found = False
-    for filename in os.listdir(invoice_folder):
-        if filename.endswith(".txt"):
-            old_filepath = os.path.join(invoice_folder, filename)
-            new_filepath = os.path.join(invoice_folder, f"{formatted_total}.txt")
-            os.rename(old_filepath, new_filepath)
-            txt_file_found = True
-            break  # Assuming there is only one .txt file to rename
-
-    # 如果没有找到 .txt 文件，则创建一个新的
-    if not txt_file_found:
-        new_filepath = os.path.join(invoice_folder, f"{formatted_total}.txt")
+    formatted_total = f"{total_sum.quantize(Decimal('0.01'))}"
+    new_filepath = os.path.join(invoice_folder, f"{formatted_total}.txt")
+
+    if txt_file is not None:
+        os.rename(txt_file, new_filepath)
+    else:
+        # 如果没有找到 .txt 文件，则创建一个新的
         with open(new_filepath, 'w') as f:
             f.write(f"Total amount: ¥{formatted_total}\n")
 
     print(f"Total amount: ¥{formatted_total}")
 
+def main_recursive(root, workers=8):
+    """递归统计目录树，流式输出每个文件夹的小计，最后输出总计；只读，不生成 .txt 文件"""
+    if not os.path.isdir(root):
+        print("Invoice folder does not exist.")
+        return
+    total_sum = Decimal("0")
+    total_count = 0
+    for folder, subtotal, count in iter_folder_totals(root, workers):
+        if count:
+            print(f"¥{subtotal.quantize(Decimal('0.01'))}\t{count}\t{folder}", flush=True)
+        total_sum += subtotal
+        total_count += count
+    print(f"Total amount: ¥{total_sum.quantize(Decimal('0.01'))} ({total_count} invoices)")
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python sum_invoices.py <path_to_invoice_folder>")
+    args = sys.argv[1:]
+    if len(args) == 1:
+        main(args[0])
+    elif len(args) in (2, 3) and args[0] in ("-r", "--recursive"):
+        main_recursive(args[1], int(args[2]) if len(args) == 3 else 8)
     else:
-        invoice_folder = sys.argv[1]
-        main(invoice_folder)
+        print("Usage: python sum.py <path_to_invoice_folder>")
+        print("       python sum.py --recursive <path_to_invoice_tree> [workers]")
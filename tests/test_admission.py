@@ -0,0 +1,98 @@
+import pytest
+
+from admission import AdmissionController, Rejected, client_address, parse_networks
+
+MB = 1024 * 1024
+
+
+def rejected_status(controller, client, declared_bytes=0):
+    with pytest.raises(Rejected) as info:
+        controller.acquire(client, declared_bytes)
+    return info.value.status_code
+
+
+def test_per_client_limit_returns_429_and_releases():
+    controller = AdmissionController(per_client=2, retry_after=7)
+    first = controller.acquire("a")
+    controller.acquire("a")
+    with pytest.raises(Rejected) as info:
+        controller.acquire("a")
+    assert info.value.status_code == 429
+    assert info.value.retry_after == 7
+    # 其它客户端不受影响
+    controller.acquire("b")
+    controller.release(first)
+    controller.acquire("a")
+
+
+def test_max_jobs_returns_503():
+    controller = AdmissionController(max_jobs=1)
+    ticket = controller.acquire("a")
+    assert controller.saturated()
+    assert rejected_status(controller, "b") == 503
+    controller.release(ticket)
+    assert not controller.saturated()
+
+
+def test_queued_bytes():
+    controller = AdmissionController(max_queued_bytes=10 * MB)
+    # 单个请求本身超过上限时无法等待，返回 413
+    assert rejected_status(controller, "a", 11 * MB) == 413
+    ticket = controller.acquire("a", 8 * MB)
+    assert rejected_status(controller, "b", 4 * MB) == 503
+    controller.release(ticket)
+    controller.acquire("b", 4 * MB)
+    assert controller.status()["queued_bytes"] == 4 * MB
+
+
+def test_undeclared_bytes_are_added_while_receiving():
+    controller = AdmissionController(max_queued_bytes=10 * MB)
+    ticket = controller.acquire("a")
+    ticket.add_bytes(6 * MB)
+    with pytest.raises(Rejected):
+        ticket.add_bytes(6 * MB)
+    assert ticket.nbytes == 6 * MB
+    controller.release(ticket)
+    assert controller.status()["queued_bytes"] == 0
+
+
+def test_status_counts_rejections():
+    controller = AdmissionController(max_jobs=1)
+    with controller.admit("a"):
+        rejected_status(controller, "b")
+        status = controller.status()
+        assert status["in_flight"] == 1 and status["clients"] == 1
+    status = controller.status()
+    assert status["in_flight"] == 0 and status["clients"] == 0 and status["rejected"] == 1
+
+
+def test_zero_limits_mean_unlimited():
+    controller = AdmissionController()
+    for _ in range(100):
+        controller.acquire("a", 100 * MB)
+
+
+def test_forwarded_header_ignored_from_untrusted_peer():
+    trusted = parse_networks("")
+    assert client_address("203.0.113.5", "198.51.100.1", trusted) == "203.0.113.5"
+    assert client_address(None, "198.51.100.1", trusted) == "unknown"
+
+
+def test_forwarded_header_from_trusted_proxy():
+    trusted = parse_networks("127.0.0.1, 10.1.0.0/16")
+    assert client_address("127.0.0.1", "198.51.100.1", trusted) == "198.51.100.1"
+    # 从右向左跳过可信代理，客户端在最左侧伪造的地址不被采用
+    assert client_address("127.0.0.1", "1.1.1.1, 198.51.100.1, 10.1.2.3", trusted) == "198.51.100.1"
+    assert client_address("127.0.0.1", "", trusted) == "127.0.0.1"
+
+
+def test_per_client_limit_not_bypassed_by_spoofed_header():
+    controller = AdmissionController(per_client=1)
+    controller.acquire(controller.client_id("203.0.113.5", "10.0.0.1"))
+    with pytest.raises(Rejected):
+        controller.acquire(controller.client_id("203.0.113.5", "10.0.0.2"))
+
+
+def test_parse_networks_skips_invalid_entries():
+    networks = parse_networks(["10.0.0.1", "bogus", "", "::1"])
+    assert [str(network) for network in networks] == ["10.0.0.1/32", "::1/128"]
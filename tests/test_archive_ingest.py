@@ -0,0 +1,128 @@
+import io
+import zipfile
+
+import pytest
+
+import archive_ingest
+from archive_ingest import ArchiveLimitError, ArchiveReader, member_name, process_archive
+from invoice_processor import InvoiceProcessor, InvoiceResult
+
+KB = 1024
+
+
+class StubProcessor(InvoiceProcessor):
+    """不做识别，只记录收到的成员"""
+
+    def __init__(self):
+        super().__init__(track=False, multi_invoice=False)
+        self.seen = []
+
+    def process(self, source, data=None, output_dir=None):
+        self.seen.append((source, len(data)))
+        result = InvoiceResult(source)
+        result.new_name = source.rsplit("/", 1)[-1]
+        return result
+
+
+def make_zip(members, compression=zipfile.ZIP_STORED):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def limited(monkeypatch, **limits):
+    """让 process_archive 内部创建的 ArchiveReader 使用给定限制"""
+    original = ArchiveReader.__init__
+
+    def init(self, source, **kwargs):
+        kwargs.update(limits)
+        original(self, source, **kwargs)
+
+    monkeypatch.setattr(ArchiveReader, "__init__", init)
+
+
+def test_reads_only_invoice_members():
+    source = make_zip([("a.pdf", b"1"), ("dir/b.OFD", b"22"), ("notes.txt", b"x"), ("c.png", b"y")])
+    assert [(name, data) for name, data in ArchiveReader(source)] == [("a.pdf", b"1"), ("dir/b.OFD", b"22")]
+
+
+def test_too_many_members_rejects_archive():
+    source = make_zip([(f"{i}.pdf", b"x") for i in range(3)])
+    with pytest.raises(ArchiveLimitError):
+        list(ArchiveReader(source, max_members=2))
+
+
+def test_oversized_member_is_skipped():
+    source = make_zip([("big.pdf", b"x" * (2 * KB)), ("small.pdf", b"x")])
+    reader = ArchiveReader(source, max_member_mb=1 / 1024)
+    assert [name for name, _ in reader] == ["small.pdf"]
+    assert [name for name, _ in reader.errors] == ["big.pdf"]
+
+
+def test_compression_ratio_limit():
+    source = make_zip([("bomb.pdf", b"\0" * (256 * KB)), ("ok.pdf", b"x")], zipfile.ZIP_DEFLATED)
+    reader = ArchiveReader(source, max_ratio=10)
+    assert [name for name, _ in reader] == ["ok.pdf"]
+    assert reader.errors[0][0] == "bomb.pdf"
+    assert "压缩比" in reader.errors[0][1]
+
+
+def test_gbk_member_names_are_decoded():
+    info = zipfile.ZipInfo("发票.pdf".encode("gbk").decode("cp437"))
+    assert member_name(info) == "发票.pdf"
+    utf8 = zipfile.ZipInfo("发票.pdf")
+    utf8.flag_bits |= 0x800
+    assert member_name(utf8) == "发票.pdf"
+
+
+def test_process_archive_reports_each_member(monkeypatch):
+    limited(monkeypatch, max_member_mb=1 / 1024)
+    source = make_zip([("a.pdf", b"1"), ("big.pdf", b"x" * (2 * KB)), ("b.pdf", b"2")])
+    results = process_archive(source, StubProcessor(), label="in.zip", workers=2)
+    assert [(r.source, r.success) for r in results] == [
+        ("in.zip/a.pdf", True), ("in.zip/b.pdf", True), ("in.zip/big.pdf", False)]
+
+
+def test_total_limit_keeps_results_of_processed_members(monkeypatch):
+    limited(monkeypatch, max_total_mb=1)
+    members = [(f"{i}.pdf", b"x" * (400 * KB)) for i in range(6)]
+    processor = StubProcessor()
+    results = process_archive(make_zip(members), processor, label="in.zip", workers=2)
+    # 超限前已提交的成员照常返回结果，最后一条为整个压缩包的错误
+    assert [r.source for r in results[:-1]] == ["in.zip/0.pdf", "in.zip/1.pdf"]
+    assert all(r.success for r in results[:-1])
+    assert results[-1].source == "in.zip" and "总大小" in results[-1].error
+    assert len(processor.seen) == 2
+
+
+def test_bad_zip_is_reported_as_failure():
+    results = process_archive(io.BytesIO(b"not a zip"), StubProcessor(), label="bad.zip", workers=1)
+    assert len(results) == 1 and not results[0].success and results[0].error
+
+
+def test_process_many_reads_sources_lazily():
+    pulled = []
+
+    def sources():
+        for i in range(50):
+            pulled.append(i)
+            yield (f"{i}.pdf", b"x")
+
+    results = StubProcessor().process_many(sources(), workers=2)
+    first = next(results)
+    assert first.source == "0.pdf"
+    # 同时在处理中的文件不超过 workers * 2
+    assert len(pulled) <= 4
+    assert [r.source for r in results] == [f"{i}.pdf" for i in range(1, 50)]
+
+
+def test_ingest_file_moves_archive_aside(tmp_path):
+    path = tmp_path / "batch.zip"
+    path.write_bytes(make_zip([("a.pdf", b"1")]).getvalue())
+    results = archive_ingest.ingest_file(str(path), StubProcessor(), workers=1)
+    assert [r.success for r in results] == [True]
+    assert not path.exists()
+    assert (tmp_path / archive_ingest.IMPORTED_DIR / "batch.zip").exists()
@@ -0,0 +1,98 @@
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("watchdog")
+
+import journal  # noqa: E402
+import output_layout  # noqa: E402
+import work_claim  # noqa: E402
+from event_coalescer import EventCoalescer  # noqa: E402
+
+
+def event(src, dest=None, is_directory=False):
+    return SimpleNamespace(src_path=str(src), dest_path=str(dest) if dest else None, is_directory=is_directory)
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write("x")
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def no_journal(monkeypatch):
+    monkeypatch.setattr(journal, "get_journal", lambda: None)
+
+
+class Collector:
+    def __init__(self):
+        self.batches = []
+        self.ready = threading.Event()
+
+    def __call__(self, batch):
+        self.batches.append(sorted(batch))
+        self.ready.set()
+
+
+def test_bulk_events_are_dispatched_as_one_batch(tmp_path):
+    collector = Collector()
+    handler = EventCoalescer(collector, window=0.05, max_delay=2).start()
+    try:
+        a = touch(tmp_path / "a.pdf")
+        b = touch(tmp_path / "b.ofd")
+        handler.on_created(event(a))
+        handler.on_modified(event(a))
+        handler.on_created(event(tmp_path / "tmp.pdf"))
+        handler.on_moved(event(tmp_path / "tmp.pdf", b))
+        assert collector.ready.wait(2)
+    finally:
+        handler.stop(timeout=2)
+    assert collector.batches == [sorted([a, b])]
+
+
+def test_filters_unsupported_processed_hidden_and_claimed_files(tmp_path):
+    handler = EventCoalescer(lambda batch: None, window=1, max_delay=1)
+    for name in ("notes.txt", "[¥1.00]00000001.pdf", ".a.pdf.tmp", ".split_00000001.pdf"):
+        handler._add(str(tmp_path / name))
+    handler._add(str(tmp_path / work_claim.CLAIM_DIR / "node" / "a.pdf"))
+    placed = str(tmp_path / "placed.pdf")
+    output_layout._remember_placed(placed)
+    handler._add(placed)
+    assert not handler._pending
+
+    handler._add(str(tmp_path / "20240101.pdf"))
+    assert list(handler._pending) == [os.path.abspath(tmp_path / "20240101.pdf")]
+
+
+def test_deleted_and_moved_away_files_are_dropped(tmp_path):
+    handler = EventCoalescer(lambda batch: None, window=1, max_delay=1)
+    handler.on_created(event(tmp_path / "a.pdf"))
+    handler.on_created(event(tmp_path / "b.pdf"))
+    handler.on_deleted(event(tmp_path / "a.pdf"))
+    handler.on_moved(event(tmp_path / "b.pdf", tmp_path / "sub" / "notes.txt"))
+    assert not handler._pending
+
+
+def test_dedupe_by_inode_keeps_last_path(tmp_path):
+    first = touch(tmp_path / "a.pdf")
+    second = str(tmp_path / "b.pdf")
+    os.link(first, second)
+    other = touch(tmp_path / "c.pdf")
+    missing = str(tmp_path / "gone.pdf")
+    assert EventCoalescer._dedupe([first, other, second, missing]) == [other, second]
+
+
+def test_moved_in_directory_is_scanned_when_recursive(tmp_path):
+    a = touch(tmp_path / "drop" / "a.pdf")
+    touch(tmp_path / "drop" / work_claim.CLAIM_DIR / "node" / "b.pdf")
+    flat = EventCoalescer(lambda batch: None, window=1, max_delay=1)
+    flat.on_moved(event(tmp_path / "elsewhere", tmp_path / "drop", is_directory=True))
+    assert not flat._pending
+
+    recursive = EventCoalescer(lambda batch: None, window=1, max_delay=1, recursive=True)
+    recursive.on_moved(event(tmp_path / "elsewhere", tmp_path / "drop", is_directory=True))
+    assert list(recursive._pending) == [os.path.abspath(a)]
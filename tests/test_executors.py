@@ -0,0 +1,152 @@
+import json
+import threading
+import time
+
+import pytest
+
+import executors
+import log_setup
+from config_manager import config
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    """每个用例使用空的调优结果和执行器缓存"""
+    monkeypatch.setattr(executors, "_tuned", {})
+    monkeypatch.setattr(executors, "_tuned_done", False)
+    monkeypatch.setattr(executors, "_executors", {})
+    monkeypatch.setattr(executors, "_cpus", lambda: 8)
+    for stage in executors.STAGES:
+        monkeypatch.setitem(config._config, f"executor_{stage}", "auto")
+        monkeypatch.setitem(config._config, f"executor_{stage}_workers", 0)
+    monkeypatch.setitem(config._config, "worker_pool_enabled", False)
+    yield
+    for executor in executors._executors.values():
+        executor.shutdown(wait=True)
+
+
+def test_auto_backends_follow_worker_pool_setting(monkeypatch):
+    assert [executors.backend(stage) for stage in executors.STAGES] == ["serial", "thread", "thread", "thread"]
+    monkeypatch.setitem(config._config, "worker_pool_enabled", True)
+    assert executors.backend("render") == executors.backend("decode") == "process"
+
+
+def test_configured_backend_is_validated(monkeypatch):
+    monkeypatch.setitem(config._config, "executor_process", "serial")
+    assert executors.backend("process") == "serial"
+    # MuPDF 不能多线程渲染，render 没有 thread 后端
+    monkeypatch.setitem(config._config, "executor_render", "thread")
+    assert executors.backend("render") == "serial"
+    monkeypatch.setitem(config._config, "executor_io", "THREAD")
+    assert executors.backend("io") == "thread"
+
+
+def test_workers_for(monkeypatch):
+    assert executors.workers_for("render") == 1
+    assert executors.workers_for("decode") == 4
+    assert executors.workers_for("io") == 32
+    monkeypatch.setitem(config._config, "executor_decode_workers", 3)
+    assert executors.workers_for("decode") == 3
+
+    monkeypatch.setitem(config._config, "worker_pool_enabled", True)
+    assert executors.workers_for("render") == 4
+    assert executors.workers_for("decode") == 3
+    monkeypatch.setitem(config._config, "executor_decode_workers", 0)
+    assert executors.workers_for("decode") == 4
+
+    # 调优结果只在后端一致时使用
+    executors._tuned.update({"decode": ("thread", 6), "process": ("thread", 5)})
+    monkeypatch.setitem(config._config, "worker_pool_enabled", False)
+    assert executors.workers_for("process") == 5
+    monkeypatch.setitem(config._config, "executor_decode", "process")
+    assert executors.workers_for("decode") == 4
+
+
+def test_serial_executor_runs_in_caller_thread():
+    executor = executors.SerialExecutor()
+    assert executor.submit(threading.get_ident).result() == threading.get_ident()
+    failed = executor.submit(int, "x")
+    assert failed.done() and isinstance(failed.exception(), ValueError)
+
+
+def test_get_executor_is_shared_per_stage(monkeypatch):
+    monkeypatch.setitem(config._config, "executor_decode_workers", 2)
+    pool = executors.get_executor("decode")
+    assert executors.get_executor("decode") is pool and pool._max_workers == 2
+    assert isinstance(executors.get_executor("render"), executors.SerialExecutor)
+
+
+def test_imap_keeps_order_and_context(monkeypatch):
+    def work(item):
+        time.sleep(0.01 * (5 - item))
+        return item, log_setup.current_trace_id(), threading.current_thread().name
+
+    with log_setup.trace("a.pdf") as trace_id:
+        results = list(executors.imap("decode", work, range(5)))
+    assert [item for item, _, _ in results] == list(range(5))
+    assert {trace for _, trace, _ in results} == {trace_id}
+    assert all(name.startswith("exec-decode") for _, _, name in results)
+
+    monkeypatch.setitem(config._config, "executor_decode", "serial")
+    results = list(executors.imap("decode", work, range(3)))
+    assert {name for _, _, name in results} == {threading.current_thread().name}
+
+
+def test_serial_context_overrides_everything(monkeypatch):
+    monkeypatch.setitem(config._config, "worker_pool_enabled", True)
+    with executors.serial():
+        assert executors.forced_serial()
+        assert all(executors.backend(stage) == "serial" for stage in executors.STAGES)
+        assert executors.workers_for("decode") == 1
+        assert isinstance(executors.get_executor("io"), executors.SerialExecutor)
+        # 其它线程不受影响
+        other = []
+        thread = threading.Thread(target=lambda: other.append(executors.backend("decode")))
+        thread.start()
+        thread.join()
+        assert other == ["process"]
+    assert not executors.forced_serial()
+    assert executors._executors == {}
+
+
+TUNED = {"render": ("process", 3), "decode": ("process", 5), "process": ("thread", 8), "io": ("thread", 32)}
+
+
+def test_autotune_measures_once_and_caches_per_cpu_count(tmp_path, monkeypatch):
+    path = tmp_path / "tune" / "executor_tune.json"
+    monkeypatch.setitem(config._config, "executor_tune_path", str(path))
+    monkeypatch.setitem(config._config, "executor_autotune", False)
+    calls = []
+    monkeypatch.setattr(executors, "measure", lambda: calls.append(1) or dict(TUNED))
+
+    assert executors.autotune() is None and calls == []
+
+    monkeypatch.setitem(config._config, "executor_autotune", True)
+    assert executors.autotune() == TUNED
+    assert executors.autotune() == TUNED
+    assert len(calls) == 1
+    assert executors.backend("render") == "process" and executors.workers_for("decode") == 5
+    assert json.loads(path.read_text()) == {"cpus": 8, "stages": {k: list(v) for k, v in TUNED.items()}}
+
+    # 新进程读取缓存，不再测量
+    monkeypatch.setattr(executors, "_tuned_done", False)
+    executors._tuned.clear()
+    assert executors.autotune() == TUNED and len(calls) == 1
+
+    # 核数变化后重新测量
+    monkeypatch.setattr(executors, "_tuned_done", False)
+    monkeypatch.setattr(executors, "_cpus", lambda: 2)
+    executors.autotune()
+    assert len(calls) == 2 and json.loads(path.read_text())["cpus"] == 2
+
+
+def test_autotune_failure_falls_back_to_defaults(tmp_path, monkeypatch):
+    monkeypatch.setitem(config._config, "executor_tune_path", str(tmp_path / "executor_tune.json"))
+
+    def broken():
+        raise RuntimeError("no zbar")
+
+    monkeypatch.setattr(executors, "measure", broken)
+    assert executors.autotune(force=True) == {}
+    assert executors.backend("decode") == "thread"
+    assert not (tmp_path / "executor_tune.json").exists()
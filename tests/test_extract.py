@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+pytest.importorskip("watchdog")
+pytest.importorskip("multipart")
+pytest.importorskip("aiofiles")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import admission  # noqa: E402
+import web_app  # noqa: E402
+from config_manager import config  # noqa: E402
+from invoice_processor import InvoiceProcessor  # noqa: E402
+
+
+class ContentEngine(InvoiceProcessor):
+    """把文件内容当作发票号码的引擎，不打开文档"""
+
+    def _process(self, doc, result):
+        if doc.data == b"broken":
+            raise RuntimeError("damaged file")
+        result.invoice_number = doc.data.decode()
+        result.amount = "1.00"
+        result.strategy = "qr"
+        result.new_name = f"{result.invoice_number}.pdf"
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    watch_dir = tmp_path / "watch"
+    watch_dir.mkdir()
+    (watch_dir / "a.pdf").write_bytes(b"00000009")
+    monkeypatch.setitem(config._config, "watch_dir", str(watch_dir))
+    monkeypatch.setattr(web_app, "web_processor", lambda *args, **kwargs: ContentEngine(track=False))
+    monkeypatch.setattr(admission, "_controller", admission.AdmissionController(max_jobs=4))
+    # 临时目录放到 tmp_path 下，便于检查是否清理
+    scratch = tmp_path / "scratch"
+    scratch.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(scratch))
+    return TestClient(web_app.app)
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.text.splitlines() if line]
+
+
+def test_extract_streams_one_line_per_file(client, tmp_path):
+    response = client.post(
+        "/extract",
+        files=[("files", ("x.pdf", b"00000001", "application/pdf")),
+               ("files", ("y.pdf", b"broken", "application/pdf")),
+               ("files", ("notes.txt", b"hello", "text/plain"))],
+        data={"paths": ["a.pdf", "../outside.pdf"]},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    records = {record["filename"]: record for record in ndjson(response)}
+    assert set(records) == {"x.pdf", "y.pdf", "notes.txt", "a.pdf", "../outside.pdf"}
+
+    assert records["x.pdf"]["success"] and records["x.pdf"]["invoice_number"] == "00000001"
+    assert records["x.pdf"]["amount"] == "1.00" and records["x.pdf"]["strategy"] == "qr"
+    assert records["a.pdf"]["invoice_number"] == "00000009"
+    assert records["y.pdf"]["error"] == "damaged file"
+    assert records["notes.txt"]["error"].startswith("不支持的文件格式")
+    assert "不在监控目录内" in records["../outside.pdf"]["error"]
+    assert sorted(record["index"] for record in records.values()) == [0, 1, 2, 3, 4]
+
+    # 监控目录中的文件不被移动或删除，上传的文件和临时目录在响应结束后清理
+    assert (tmp_path / "watch" / "a.pdf").exists()
+    assert os.listdir(tmp_path / "scratch") == []
+    assert admission.get_controller().in_flight == 0
+
+
+def test_extract_without_files_is_rejected(client):
+    response = client.post("/extract", data={"other": "x"}, files=[("unused", ("", b"", "text/plain"))])
+    assert response.status_code == 400
+
+
+def test_extract_respects_admission(client, monkeypatch):
+    monkeypatch.setattr(admission, "_controller", admission.AdmissionController(max_jobs=1))
+    ticket = admission.get_controller().acquire("other")
+    try:
+        response = client.post("/extract", files=[("files", ("x.pdf", b"00000001", "application/pdf"))])
+    finally:
+        admission.get_controller().release(ticket)
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+
+
+def test_extract_record_fields():
+    record = web_app._extract_record(3, "a.pdf", error="boom")
+    assert record["index"] == 3 and record["success"] is False and record["error"] == "boom"
+    assert set(web_app.EXTRACT_FIELDS) <= set(record)
@@ -0,0 +1,97 @@
+import os
+import time
+
+import pytest
+
+import invoice_processor
+import output_layout
+from invoice_processor import InvoiceProcessor
+
+
+def record(page, number, amount, path=None):
+    return {"page": page, "invoice_code": None, "invoice_number": number, "amount": amount,
+            "date": "20240101", "invoice_type": None, "seller": "S", "path": path}
+
+
+def test_unsplit_multi_invoice_records_the_restored_path(tmp_path, monkeypatch):
+    claimed = tmp_path / ".processing" / "node"
+    claimed.mkdir(parents=True)
+    source = claimed / "merged.pdf"
+    source.write_bytes(b"%PDF")
+    monkeypatch.setattr(invoice_processor, "process_multi_invoice",
+                        lambda *args, **kwargs: [record(0, "00000001", "1.00"), record(2, "00000002", "2.00")])
+    recorded = []
+    monkeypatch.setattr(InvoiceProcessor, "_record", staticmethod(lambda result, path: recorded.append(path)))
+
+    with output_layout.output_base(str(tmp_path)):
+        result = InvoiceProcessor(multi_invoice=True).process(str(source))
+
+    assert result.success and len(result.parts) == 2
+    assert result.path == str(tmp_path / "merged.pdf")
+    assert recorded == [result.path, result.path]
+    # 文件本身留给认领方移回
+    assert os.path.exists(source)
+
+
+class FakeEngine(InvoiceProcessor):
+    """不打开文档的引擎：发票号码取自文件名或内存内容，名称以 slow 开头的文件处理得更慢"""
+
+    def _process(self, doc, result):
+        if "broken" in result.source:
+            raise RuntimeError("damaged file")
+        if os.path.basename(result.source).startswith("slow"):
+            time.sleep(0.05)
+        result.invoice_number = doc.data.decode() if doc.data is not None else os.path.basename(result.source)[:8]
+        result.new_name = f"{result.invoice_number}.pdf"
+        result.path = doc.output_dir
+
+
+def test_process_reports_unsupported_and_failed_files():
+    engine = FakeEngine(track=False)
+    assert engine.process("notes.txt").error == "不支持的文件格式: .txt"
+    failed = engine.process("broken.pdf")
+    assert failed.error == "damaged file" and not failed.success
+    assert "total" in failed.timings
+
+
+def test_process_many_keeps_input_order_and_handles_bytes(tmp_path):
+    engine = FakeEngine(track=False)
+    sources = ["slow0001.pdf", ("mem.pdf", b"00000002"), "00000003.pdf", "broken.pdf"]
+    results = list(engine.process_many(sources, workers=3, output_dir=str(tmp_path)))
+    assert [r.source for r in results] == ["slow0001.pdf", "mem.pdf", "00000003.pdf", "broken.pdf"]
+    assert [r.invoice_number for r in results] == ["slow0001", "00000002", "00000003", None]
+    # output_dir 只作用于内存中的文件
+    assert [r.path for r in results] == [None, str(tmp_path), None, None]
+
+
+def test_process_many_reads_sources_lazily():
+    pulled = []
+
+    def sources():
+        for i in range(20):
+            pulled.append(i)
+            yield f"{i:08d}.pdf"
+
+    results = FakeEngine(track=False).process_many(sources(), workers=2)
+    next(results)
+    # 同时在处理中的文件不超过 workers * 2 个
+    assert len(pulled) <= 4
+    assert len(list(results)) == 19
+
+
+def test_process_many_yields_submitted_results_before_source_error():
+    def sources():
+        yield "00000001.pdf"
+        yield "slow0002.pdf"
+        raise OSError("archive truncated")
+
+    seen = []
+    with pytest.raises(OSError):
+        for result in FakeEngine(track=False).process_many(sources(), workers=4):
+            seen.append(result.invoice_number)
+    assert seen == ["00000001", "slow0002"]
+
+
+def test_serial_process_many():
+    assert [r.invoice_number for r in FakeEngine(track=False).process_many(["00000001.pdf", "00000002.pdf"])] == \
+        ["00000001", "00000002"]
@@ -0,0 +1,100 @@
+import json
+import os
+import time
+
+from journal import ProcessingJournal, is_candidate
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write("x")
+    return path
+
+
+def age(path, seconds=600):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def open_journal(tmp_path, **kwargs):
+    kwargs.setdefault("margin_seconds", 0)
+    return ProcessingJournal(str(tmp_path / "data" / "journal.log"), str(tmp_path / "watch"), **kwargs)
+
+
+def test_pending_intents_survive_restart(tmp_path):
+    journal = open_journal(tmp_path)
+    a, b = str(tmp_path / "watch" / "a.pdf"), str(tmp_path / "watch" / "b.pdf")
+    journal.intent([a, b])
+    journal.intent([a])
+    journal.done(b)
+    journal.close()
+    assert open_journal(tmp_path).pending() == [a]
+
+
+def test_torn_last_record_is_ignored(tmp_path):
+    journal = open_journal(tmp_path)
+    a = str(tmp_path / "watch" / "a.pdf")
+    journal.intent([a])
+    journal.close()
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('{"op": "done", "pa')
+    assert open_journal(tmp_path).pending() == [a]
+
+
+def test_compaction_keeps_pending_intents(tmp_path):
+    journal = open_journal(tmp_path, compact_every=2)
+    paths = [str(tmp_path / "watch" / f"{i}.pdf") for i in range(3)]
+    journal.intent(paths)
+    journal.done(paths[0])
+    journal.done(paths[1])
+    journal.close()
+    with open(journal.path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert records[0]["op"] == "snapshot"
+    assert [r["path"] for r in records[1:]] == [paths[2]]
+    assert open_journal(tmp_path).pending() == [paths[2]]
+
+
+def test_recover_replays_pending_and_lists_new_files(tmp_path):
+    watch = tmp_path / "watch"
+    interrupted = touch(str(watch / "interrupted.pdf"))
+    renamed = str(watch / "renamed.pdf")
+    journal = open_journal(tmp_path)
+    journal.intent([interrupted, renamed])
+    journal.close()
+    # 停机期间新到的文件；已重命名的文件和拆分遗留的分片不再处理
+    new = touch(str(watch / "new.ofd"))
+    touch(str(watch / "[¥1.00]12345678.pdf"))
+    split_part = touch(str(watch / ".split_12345678.pdf"))
+
+    journal = open_journal(tmp_path)
+    paths = journal.recover(is_candidate)
+    assert sorted(paths) == sorted([interrupted, new])
+    assert not os.path.exists(split_part)
+    # 已不存在的 intent 视为完成，恢复出的文件重新记为 intent
+    assert sorted(journal.pending()) == sorted([interrupted, new])
+
+
+def test_recover_skips_unchanged_directories(tmp_path):
+    watch = tmp_path / "watch"
+    old_dir = watch / "old"
+    touch(str(old_dir / "missed.pdf"))
+    age(str(old_dir))
+    journal = open_journal(tmp_path, recursive=True)
+    journal.compact()
+    journal.close()
+
+    fresh = touch(str(watch / "fresh" / "a.pdf"))
+    journal = open_journal(tmp_path, recursive=True)
+    # 快照之后 mtime 未变化的目录不重新列出
+    assert journal.recover(is_candidate) == [fresh]
+
+
+def test_is_candidate():
+    assert is_candidate("a.pdf") and is_candidate("B.OFD")
+    assert not is_candidate(".hidden.pdf")
+    assert not is_candidate("[¥1.00]12345678.pdf")
+    # 纯数字文件名不一定是处理结果
+    assert is_candidate("20240101.pdf") and is_candidate("12345678901234567890.pdf")
+    assert not is_candidate("notes.txt")
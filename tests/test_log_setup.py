@@ -0,0 +1,105 @@
+import contextvars
+import io
+import json
+import logging
+import threading
+
+import pytest
+
+import log_setup
+
+
+@pytest.fixture
+def output():
+    """安装写入内存的处理器，结束后恢复根日志的处理器与级别"""
+    root = logging.getLogger()
+    level = root.level
+    stream = io.StringIO()
+    yield stream
+    if log_setup._handler is not None:
+        root.removeHandler(log_setup._handler)
+        log_setup._handler = None
+    root.setLevel(level)
+
+
+def lines(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_json_lines_carry_trace_and_job_ids(output):
+    log_setup.configure(level="info", fmt="json", debug_sample=1.0, stream=output)
+
+    logging.info("outside")
+    with log_setup.trace("upload", job=True) as job_id:
+        with log_setup.trace("a.pdf") as trace_id:
+            assert log_setup.current_trace_id() == trace_id
+            log_setup.event(logging.INFO, "发票处理完成", stage_ms={"qr": 1.5}, amount="10.00")
+        logging.getLogger("monitor").warning("job level")
+    assert log_setup.current_trace_id() is None
+
+    outside, done, job = lines(output)
+    assert outside["msg"] == "outside" and "trace_id" not in outside and "job_id" not in outside
+    assert done["msg"] == "发票处理完成" and done["level"] == "INFO"
+    assert done["trace_id"] == trace_id and done["job_id"] == job_id and done["file"] == "a.pdf"
+    assert done["stage_ms"] == {"qr": 1.5} and done["amount"] == "10.00"
+    assert job["trace_id"] == job["job_id"] == job_id and job["logger"] == "monitor"
+    assert trace_id != job_id
+
+
+def test_file_trace_without_job_has_no_job_id(output):
+    log_setup.configure(level="INFO", fmt="json", debug_sample=1.0, stream=output)
+    with log_setup.trace("a.pdf"):
+        logging.info("alone")
+    (record,) = lines(output)
+    assert record["trace_id"] and "job_id" not in record
+
+
+def test_trace_follows_copied_context_into_threads(output):
+    log_setup.configure(level="INFO", fmt="json", debug_sample=1.0, stream=output)
+    with log_setup.trace("batch", job=True) as job_id:
+        context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(logging.info, "in worker"))
+    thread.start()
+    thread.join()
+    (record,) = lines(output)
+    assert record["job_id"] == job_id
+
+
+def test_exceptions_are_included(output):
+    log_setup.configure(level="INFO", fmt="json", debug_sample=1.0, stream=output)
+    try:
+        raise ValueError("bad pdf")
+    except ValueError:
+        logging.exception("failed")
+    (record,) = lines(output)
+    assert "ValueError: bad pdf" in record["exc"]
+
+
+def test_text_format_appends_trace_and_fields(output):
+    log_setup.configure(level="INFO", fmt="text", debug_sample=1.0, stream=output)
+    with log_setup.trace("a.pdf") as trace_id:
+        log_setup.event(logging.INFO, "done", pages=2)
+    assert output.getvalue().rstrip().endswith(f"done [{trace_id}] pages=2")
+
+
+def test_event_skips_disabled_levels_and_debug_is_sampled(output, monkeypatch):
+    log_setup.configure(level="INFO", fmt="json", debug_sample=1.0, stream=output)
+    log_setup.event(logging.DEBUG, "hidden", x=1)
+    assert output.getvalue() == ""
+
+    log_setup.configure(level="DEBUG", fmt="json", debug_sample=0.5, stream=output)
+    monkeypatch.setattr(log_setup.random, "random", lambda: 0.9)
+    logging.debug("dropped")
+    logging.info("kept")
+    monkeypatch.setattr(log_setup.random, "random", lambda: 0.1)
+    logging.debug("sampled")
+    assert [record["msg"] for record in lines(output)] == ["kept", "sampled"]
+
+
+def test_configure_replaces_previous_handler(output):
+    root = logging.getLogger()
+    first = log_setup.configure(level="INFO", fmt="json", debug_sample=1.0, stream=output)
+    second = log_setup.configure(level="INFO", fmt="json", debug_sample=1.0, stream=output)
+    assert first not in root.handlers and second in root.handlers
+    logging.info("once")
+    assert len(lines(output)) == 1
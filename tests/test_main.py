@@ -0,0 +1,26 @@
+import os
+
+import main
+import output_layout
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write("x")
+
+
+def test_sum_invoices_includes_shards_exactly(tmp_path, monkeypatch):
+    monkeypatch.setattr(output_layout, "current_layout", lambda: "date")
+    touch(str(tmp_path / "[¥0.10]00000001.pdf"))
+    touch(str(tmp_path / "2024-01" / "[¥0.20]00000002.pdf"))
+    touch(str(tmp_path / "2024-02" / "[¥1.00]00000003.pdf"))
+    touch(str(tmp_path / "scan.pdf"))
+
+    main.sum_invoices(str(tmp_path))
+    assert os.path.exists(tmp_path / "1.30.txt")
+
+    # 已有的合计文件被重命名而不是新建
+    touch(str(tmp_path / "[¥2.00]00000004.pdf"))
+    main.sum_invoices(str(tmp_path))
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith(".txt")) == ["3.30.txt"]
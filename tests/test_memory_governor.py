@@ -0,0 +1,84 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import memory_governor
+from memory_governor import BufferPool, PixelBudget
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    budget = PixelBudget(100)
+    monkeypatch.setattr(memory_governor, "_budget", budget)
+    return budget
+
+
+def test_budget_waits_for_release(budget):
+    budget.acquire(60)
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: (budget.acquire(60), acquired.set()))
+    waiter.start()
+    assert not acquired.wait(0.05)
+    budget.release(60)
+    assert acquired.wait(2)
+    waiter.join()
+    assert budget.in_use == 60
+
+
+def test_oversized_request_runs_alone(budget):
+    # 超出预算的单个请求在预算空闲时直接放行，避免永久等待
+    budget.acquire(500)
+    assert budget.in_use == 500
+    budget.release(500)
+    assert budget.in_use == 0
+
+
+def test_disabled_budget_never_blocks():
+    budget = PixelBudget(0)
+    budget.acquire(10 ** 9)
+    budget.acquire(10 ** 9)
+    assert budget.in_use == 0
+
+
+def test_reservation_release_is_idempotent_and_tracks_job_peak(budget):
+    with memory_governor.job("a.pdf") as stats:
+        first = memory_governor.reserve(40)
+        with memory_governor.reserve(30):
+            assert budget.in_use == 70
+        first.release()
+        first.release()
+        assert budget.in_use == 0
+    assert stats.peak == 70 and stats.current == 0
+
+
+def test_page_bytes_rounds_up_pixels():
+    a4 = SimpleNamespace(width=595, height=842)
+    assert memory_governor.page_bytes(a4, 72) == 595 * 842
+    assert memory_governor.page_bytes(a4, 300) == 2480 * 3509
+    assert memory_governor.page_bytes(a4, 72, n=3) == 595 * 842 * 3
+
+
+def test_buffer_pool_reuses_similar_sizes():
+    np = pytest.importorskip("numpy")
+    pool = BufferPool(max_buffers=1)
+    gray = np.arange(12, dtype=np.uint8).reshape(3, 4)
+    copy = pool.copy(gray)
+    assert copy.tolist() == gray.tolist()
+    base = copy.base
+    pool.give(copy)
+    # 大小相近时复用同一块内存，过小的请求重新分配
+    reused = pool.take((2, 5))
+    assert reused.base is base or reused.base.base is base
+    pool.give(reused)
+    assert pool.take((1, 2)).size == 2
+    # 池满后归还的缓冲区被丢弃
+    pool.give(np.empty(12, dtype=np.uint8))
+    assert len(pool._free) == 1
+
+
+def test_job_without_renders(budget):
+    # 未安装 PyMuPDF 时收缩缓存失败只记录警告
+    with memory_governor.job("b.pdf") as stats:
+        pass
+    assert stats.peak == 0
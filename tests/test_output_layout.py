@@ -0,0 +1,28 @@
+import os
+
+import output_layout
+
+
+def touch(path):
+    with open(path, "w") as f:
+        f.write("x")
+    return path
+
+
+def test_place_keeps_file_already_at_target_name(tmp_path):
+    path = touch(str(tmp_path / "12345678.pdf"))
+    assert output_layout.place(path, "12345678.pdf", layout="flat") == path
+    assert os.listdir(tmp_path) == ["12345678.pdf"]
+
+
+def test_place_avoids_overwriting_other_files(tmp_path):
+    touch(str(tmp_path / "12345678.pdf"))
+    source = touch(str(tmp_path / "scan.pdf"))
+    new_path = output_layout.place(source, "12345678.pdf", layout="flat")
+    assert os.path.basename(new_path) == "12345678_1.pdf"
+    assert sorted(os.listdir(tmp_path)) == ["12345678.pdf", "12345678_1.pdf"]
+
+
+def test_only_amount_prefix_marks_processed():
+    assert output_layout.looks_processed("[¥1.00]12345678.pdf")
+    assert not output_layout.looks_processed("20240101.pdf")
@@ -0,0 +1,56 @@
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import page_pipeline
+
+
+class FakePool:
+    """按 clip 是否为空返回预设结果的进程池替身"""
+    dpi = 300
+
+    def __init__(self, region_result, page_result):
+        self.results = {True: region_result, False: page_result}
+        self.calls = []
+
+    def submit(self, file_path, page_num, clip=None):
+        self.calls.append(clip)
+        future = Future()
+        future.set_result(self.results[clip is not None])
+        return future
+
+
+class FakeCache:
+    def __init__(self):
+        self.entries = {}
+
+    def put(self, key, region):
+        self.entries[key] = region
+
+
+PAGE = SimpleNamespace(x0=0, y0=0, width=600.0, height=800.0)
+
+
+def test_pool_uses_region_first():
+    pool = FakePool(("data", (0, 0, 30, 30)), ("page", (0, 0, 30, 30)))
+    cache = FakeCache()
+    future = page_pipeline._pool_page_job(pool, "a.pdf", 0, PAGE, (0, 0, 100, 80), cache, "k", True)
+    assert future.result() == "data"
+    assert pool.calls == [(0, 0, 100, 80)]
+    assert cache.entries == {}
+
+
+def test_pool_falls_back_to_full_page_and_learns():
+    pool = FakePool((None, None), ("page", (300, 600, 600, 900)))
+    cache = FakeCache()
+    future = page_pipeline._pool_page_job(pool, "a.pdf", 0, PAGE, (0, 0, 100, 80), cache, "k", True)
+    assert future.result() == "page"
+    assert pool.calls == [(0, 0, 100, 80), None]
+    x0, y0, x1, y1 = cache.entries["k"]
+    assert 0 < x0 < x1 <= 1 and 0 < y0 < y1 <= 1
+
+
+def test_pool_without_cache_scans_full_page():
+    pool = FakePool(("data", None), (None, None))
+    future = page_pipeline._pool_page_job(pool, "a.pdf", 0, None, None, None, None, False)
+    assert future.result() is None
+    assert pool.calls == [None]
@@ -0,0 +1,27 @@
+import os
+
+import executors
+import profiler
+import worker_pool
+
+
+def test_profiled_call_runs_stages_in_calling_thread(tmp_path, monkeypatch):
+    monkeypatch.setitem(profiler._settings, "enabled", True)
+    monkeypatch.setitem(profiler._settings, "threshold_ms", 0)
+    monkeypatch.setitem(profiler._settings, "profiles_dir", str(tmp_path / "profiles"))
+    source = tmp_path / "a.pdf"
+    source.write_bytes(b"%PDF")
+
+    def process(path):
+        return (executors.backend("decode"), worker_pool.enabled(),
+                type(executors.get_executor("decode")).__name__)
+
+    assert profiler.call(str(source), process, str(source)) == ("serial", False, "SerialExecutor")
+    assert len(os.listdir(tmp_path / "profiles")) == 1
+    # 剖析结束后恢复原来的后端
+    assert not executors.forced_serial()
+
+
+def test_unprofiled_call_keeps_backends(tmp_path, monkeypatch):
+    monkeypatch.setitem(profiler._settings, "enabled", False)
+    assert profiler.call("missing.pdf", executors.forced_serial) is False
@@ -0,0 +1,71 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import qr_location_cache
+from config_manager import config
+from qr_location_cache import QRLocationCache, box_to_region, fingerprint
+
+RECT = SimpleNamespace(x0=0, y0=0, width=600.0, height=800.0)
+
+
+class FakePage:
+    def __init__(self, words, rotation=0):
+        self.rect = RECT
+        self.rotation = rotation
+        self.words = words
+
+    def get_text(self, kind, sort=False):
+        return [(x, y, x + 10, y + 10, word, 0, 0, 0) for x, y, word in self.words]
+
+
+def test_lru_evicts_least_recently_used(tmp_path):
+    cache = QRLocationCache(str(tmp_path / "cache.json"), max_entries=2)
+    cache.put("a", (0, 0, 0.1, 0.1))
+    cache.put("b", (0, 0, 0.2, 0.2))
+    assert cache.get("a") == (0, 0, 0.1, 0.1)
+    cache.put("c", (0, 0, 0.3, 0.3))
+    assert cache.get("b") is None and cache.get("a") is not None and len(cache) == 2
+
+
+def test_saves_every_n_puts_and_reloads(tmp_path):
+    path = tmp_path / "data" / "cache.json"
+    cache = QRLocationCache(str(path), save_every=2)
+    cache.put("a", (0.123456, 0, 1, 1))
+    assert not path.exists()
+    cache.put("b", (0, 0, 1, 1))
+    assert json.loads(path.read_text())["a"] == [0.1235, 0, 1, 1]
+    assert QRLocationCache(str(path)).get("a") == (0.1235, 0, 1, 1)
+
+
+def test_corrupt_file_starts_empty(tmp_path):
+    path = tmp_path / "cache.json"
+    path.write_text("{not json")
+    assert len(QRLocationCache(str(path))) == 0
+
+
+def test_box_to_region_adds_padding_and_clip_origin():
+    assert box_to_region(RECT, (60, 80, 120, 160), dpi=72) == pytest.approx((0.08, 0.08, 0.22, 0.22))
+    clip = SimpleNamespace(x0=300, y0=400)
+    # 300 DPI 下的像素框换算回点，再加上裁剪区域的原点
+    assert box_to_region(RECT, (0, 0, 250, 250), dpi=300, clip=clip) == pytest.approx((0.48, 0.48, 0.62, 0.595))
+
+
+def test_box_to_region_is_clamped_to_page():
+    assert box_to_region(RECT, (0, 0, 600, 800), dpi=72) == (0.0, 0.0, 1.0, 1.0)
+
+
+def test_fingerprint_ignores_numbers_but_not_layout():
+    template = [(50, 40, "电子发票"), (300, 40, "发票号码"), (400, 40, "24110000000012345678"), (50, 500, "¥100.00")]
+    other_invoice = [(50, 40, "电子发票"), (300, 40, "发票号码"), (400, 40, "24110000000087654321"),
+                     (50, 500, "¥3.50")]
+    assert fingerprint(FakePage(template)) == fingerprint(FakePage(other_invoice))
+    assert fingerprint(FakePage(template)) != fingerprint(FakePage(template, rotation=90))
+    moved = [(50, 40, "电子发票"), (100, 40, "发票号码")]
+    assert fingerprint(FakePage(template)) != fingerprint(FakePage(moved))
+
+
+def test_cache_can_be_disabled(monkeypatch):
+    monkeypatch.setitem(config._config, "qr_cache_enabled", False)
+    assert qr_location_cache.get_cache() is None
@@ -0,0 +1,78 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import qr_preprocess  # noqa: E402
+from config_manager import config  # noqa: E402
+
+
+class FakePixmap:
+    def __init__(self, data, width, height, stride, n=1):
+        self.samples_mv = memoryview(bytes(data))
+        self.width, self.height, self.stride, self.n = width, height, stride, n
+
+
+def finder_image(size=400, x=40, y=40, unit=4):
+    """白底上画出 25 模块二维码的三个定位图形"""
+    image = np.full((size, size), 255, dtype=np.uint8)
+    for fx, fy in ((x, y), (x + 18 * unit, y), (x, y + 18 * unit)):
+        image[fy:fy + 7 * unit, fx:fx + 7 * unit] = 0
+        image[fy + unit:fy + 6 * unit, fx + unit:fx + 6 * unit] = 255
+        image[fy + 2 * unit:fy + 5 * unit, fx + 2 * unit:fx + 5 * unit] = 0
+    return image
+
+
+@pytest.fixture
+def preprocess_config(monkeypatch):
+    monkeypatch.setitem(config._config, "qr_downscale", 1)
+    monkeypatch.setitem(config._config, "qr_binarize", True)
+    monkeypatch.setitem(config._config, "qr_locate", True)
+
+
+def test_pixmap_to_gray_skips_row_padding():
+    gray = qr_preprocess.pixmap_to_gray(FakePixmap(range(12), width=4, height=2, stride=6))
+    assert gray.tolist() == [[0, 1, 2, 3], [6, 7, 8, 9]]
+
+
+def test_downscale_averages_blocks():
+    gray = np.arange(16, dtype=np.uint8).reshape(4, 4)
+    assert qr_preprocess.downscale(gray, 1) is gray
+    assert qr_preprocess.downscale(gray, 2).tolist() == [[2, 4], [10, 12]]
+
+
+def test_adaptive_threshold_keeps_dark_marks_only():
+    gray = np.full((60, 60), 255, dtype=np.uint8)
+    gray[20:40, 20:40] = 0
+    binary = qr_preprocess.adaptive_threshold(gray)
+    assert (binary == np.where(gray == 0, 0, 255)).all()
+
+
+def test_locate_qr_finds_finder_patterns():
+    box = qr_preprocess.locate_qr(finder_image())
+    assert box is not None
+    x0, y0, x1, y1 = box
+    assert x0 <= 40 and y0 <= 40 and x1 >= 140 and y1 >= 140
+    assert x1 - x0 < 300 and y1 - y0 < 300
+
+
+def test_locate_qr_blank_page():
+    assert qr_preprocess.locate_qr(np.full((100, 100), 255, dtype=np.uint8)) is None
+
+
+def test_candidates_end_with_full_page(preprocess_config):
+    gray = finder_image()
+    candidates = list(qr_preprocess.decode_candidates_with_origin(gray))
+    # 定位成功时先尝试裁剪区域（二值图、灰度图），最后是整页灰度图和整页二值图
+    assert len(candidates) == 4
+    assert candidates[0][1] <= 40 and candidates[0][2] <= 40
+    assert candidates[0][0].shape == candidates[1][0].shape
+    assert [c[0].shape for c in candidates[2:]] == [gray.shape, gray.shape]
+    assert [c[1:] for c in candidates[2:]] == [(0, 0, 1), (0, 0, 1)]
+
+
+def test_candidates_without_binarize_or_locate(preprocess_config, monkeypatch):
+    monkeypatch.setitem(config._config, "qr_binarize", False)
+    monkeypatch.setitem(config._config, "qr_locate", False)
+    gray = finder_image()
+    candidates = list(qr_preprocess.decode_candidates(gray))
+    assert len(candidates) == 1 and candidates[0] is gray
@@ -0,0 +1,85 @@
+import pytest
+
+from rollups import RollupStore, from_cents, to_cents
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = RollupStore(str(tmp_path / "data" / "rollups.db"))
+    yield store
+    store.close()
+
+
+def by_key(rows):
+    return {row["key"]: (row["amount"], row["count"]) for row in rows}
+
+
+def test_cents_are_exact():
+    assert to_cents("0.1") + to_cents("0.2") == to_cents("0.3")
+    assert to_cents("1234.56") == 123456
+    assert to_cents(None) == 0 and to_cents("abc") == 0
+    assert str(from_cents(123456)) == "1234.56"
+
+
+def test_aggregates_each_dimension(store):
+    store.record("00000001", "100.10", date="20240115", seller="S1", invoice_type="电子发票(普通发票)")
+    store.record("00000002", "0.20", date="20240130", seller="S2", invoice_type="电子发票(普通发票)")
+    store.record("00000003", "50.00", date="20240201", seller="S1", invoice_type="增值税专用发票")
+
+    assert store.total() == {"key": "", "amount": "150.30", "count": 3}
+    assert by_key(store.query("month")) == {"2024-01": ("100.30", 2), "2024-02": ("50.00", 1)}
+    assert by_key(store.query("seller")) == {"S1": ("150.10", 2), "S2": ("0.20", 1)}
+    assert by_key(store.query("type")) == {"电子发票(普通发票)": ("100.30", 2), "增值税专用发票": ("50.00", 1)}
+
+
+def test_duplicate_invoice_is_counted_once(store):
+    assert store.record("00000001", "10.00", date="20240115")
+    assert not store.record("00000001", "10.00", date="20240115")
+    assert not store.record(None, "5.00")
+    assert store.total() == {"key": "", "amount": "10.00", "count": 1}
+
+
+def test_same_number_under_different_codes_counts_twice(store):
+    assert store.record("00000001", "10.00", invoice_code="011001900111")
+    assert store.record("00000001", "20.00", invoice_code="011001900222")
+    assert not store.record("00000001", "20.00", invoice_code="011001900222")
+    assert store.total() == {"key": "", "amount": "30.00", "count": 2}
+
+
+def test_number_only_schema_is_migrated(tmp_path):
+    import sqlite3
+    path = str(tmp_path / "rollups.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE invoices (invoice_number TEXT PRIMARY KEY, amount_cents INTEGER NOT NULL, "
+                 "month TEXT, seller TEXT, invoice_type TEXT, path TEXT, recorded_at TEXT NOT NULL)")
+    conn.execute("INSERT INTO invoices VALUES ('00000001', 1000, '2024-01', NULL, NULL, NULL, '')")
+    conn.commit()
+    conn.close()
+
+    store = RollupStore(path)
+    try:
+        assert not store.record("00000001", "10.00")
+        assert store.record("00000001", "10.00", invoice_code="011001900111")
+    finally:
+        store.close()
+
+
+def test_missing_fields_group_as_unknown(store):
+    store.record("00000001", None)
+    assert by_key(store.query("month")) == {"unknown": ("0.00", 1)}
+    assert by_key(store.query("seller")) == {"unknown": ("0.00", 1)}
+
+
+def test_rollups_persist(tmp_path):
+    path = str(tmp_path / "rollups.db")
+    store = RollupStore(path)
+    store.record("00000001", "1.00", date="20240101")
+    store.close()
+    reopened = RollupStore(path)
+    assert reopened.total()["amount"] == "1.00"
+    reopened.close()
+
+
+def test_unknown_dimension(store):
+    with pytest.raises(ValueError):
+        store.query("week")
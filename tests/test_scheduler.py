@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import PriorityScheduler
+
+
+@pytest.fixture
+def make_scheduler():
+    created = []
+
+    def make(*args, **kwargs):
+        scheduler = PriorityScheduler(*args, **kwargs)
+        created.append(scheduler)
+        return scheduler
+    yield make
+    for scheduler in created:
+        scheduler.shutdown()
+
+
+def blocker(scheduler, priority_class="interactive"):
+    """提交一个占住线程的任务，返回放行用的 Event"""
+    started, release = threading.Event(), threading.Event()
+    scheduler.submit(priority_class, lambda: (started.set(), release.wait(5)))
+    assert started.wait(5)
+    return release
+
+
+def run_order(scheduler, release, age_catchup_by=0.0):
+    order = []
+    with scheduler._cond:
+        catchup = scheduler.submit("catchup", order.append, "catchup")
+        interactive = scheduler.submit("interactive", order.append, "interactive")
+        scheduler._queues["catchup"][0].enqueued -= age_catchup_by
+    release.set()
+    catchup.result(5)
+    interactive.result(5)
+    return order
+
+
+def test_interactive_runs_before_backlog(make_scheduler):
+    scheduler = make_scheduler(1, reserved=0, aging_seconds=30)
+    assert run_order(scheduler, blocker(scheduler)) == ["interactive", "catchup"]
+
+
+def test_aged_backlog_is_not_starved(make_scheduler):
+    scheduler = make_scheduler(1, reserved=0, aging_seconds=30)
+    # 等待 100 秒后得分 2 - 100/30 低于刚提交的交互任务
+    assert run_order(scheduler, blocker(scheduler), age_catchup_by=100) == ["catchup", "interactive"]
+
+
+def test_reserved_thread_stays_free_for_uploads(make_scheduler):
+    scheduler = make_scheduler(2, reserved=1)
+    release = blocker(scheduler, "watch")
+    second_watch = scheduler.submit("watch", lambda: "watch")
+    time.sleep(0.05)
+    assert scheduler.stats()["watch"] == {"queued": 1, "running": 1, "limit": 1}
+    assert scheduler.submit("interactive", lambda: "upload").result(5) == "upload"
+    release.set()
+    assert second_watch.result(5) == "watch"
+
+
+def test_class_limit(make_scheduler):
+    scheduler = make_scheduler(3, limits={"catchup": 1}, reserved=0)
+    release = blocker(scheduler, "catchup")
+    queued = scheduler.submit("catchup", lambda: "done")
+    assert scheduler.submit("watch", lambda: "watch").result(5) == "watch"
+    assert scheduler.stats()["catchup"]["queued"] == 1
+    release.set()
+    assert queued.result(5) == "done"
+
+
+def test_errors_unknown_class_and_shutdown(make_scheduler):
+    scheduler = make_scheduler(1, reserved=0)
+    with pytest.raises(ValueError):
+        scheduler.submit("bulk", print)
+    with pytest.raises(ZeroDivisionError):
+        scheduler.submit("watch", lambda: 1 / 0).result(5)
+
+    release = blocker(scheduler)
+    pending = scheduler.submit("catchup", lambda: None)
+    shutdown = threading.Thread(target=scheduler.shutdown)
+    shutdown.start()
+    time.sleep(0.05)
+    assert pending.cancelled()
+    release.set()
+    shutdown.join(5)
+    with pytest.raises(RuntimeError):
+        scheduler.submit("interactive", print)
@@ -0,0 +1,102 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip("watchdog")
+
+from snapshot_observer import SnapshotObserver  # noqa: E402
+
+
+class Recorder:
+    def __init__(self):
+        self.events = []
+
+    def dispatch(self, event):
+        name = type(event).__name__
+        if name == "FileMovedEvent":
+            self.events.append((name, event.src_path, event.dest_path))
+        else:
+            self.events.append((name, event.src_path))
+
+
+def write(path, data=b"x"):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def age(path, seconds=3600):
+    """把 mtime 调到过去，使目录不再处于“刚变化”的窗口、文件不再是热文件"""
+    past = time.time_ns() - int(seconds * 1e9)
+    os.utime(path, ns=(past, past))
+
+
+@pytest.fixture
+def watched(tmp_path):
+    recorder = Recorder()
+    observer = SnapshotObserver(min_interval=0.01, max_interval=0.02)
+    watch = observer.schedule(recorder, str(tmp_path), recursive=True)
+    return observer, watch, recorder
+
+
+def test_initial_snapshot_emits_nothing(tmp_path):
+    write(tmp_path / "old.pdf")
+    recorder = Recorder()
+    SnapshotObserver().schedule(recorder, str(tmp_path))
+    assert recorder.events == []
+
+
+def test_create_rename_delete(tmp_path, watched):
+    observer, watch, recorder = watched
+    a = write(tmp_path / "a.pdf")
+    observer._poll(watch)
+    b = str(tmp_path / "b.pdf")
+    os.rename(a, b)
+    observer._poll(watch)
+    os.remove(b)
+    observer._poll(watch)
+    assert recorder.events == [("FileCreatedEvent", a), ("FileMovedEvent", a, b), ("FileDeletedEvent", b)]
+
+
+def test_growing_file_emits_modified(tmp_path, watched):
+    observer, watch, recorder = watched
+    path = write(tmp_path / "a.pdf")
+    observer._poll(watch)
+    write(path, b"longer content")
+    observer._poll(watch)
+    assert recorder.events == [("FileCreatedEvent", path), ("FileModifiedEvent", path)]
+
+
+def test_unchanged_directory_is_not_listed(tmp_path, watched, monkeypatch):
+    observer, watch, recorder = watched
+    path = write(tmp_path / "a.pdf")
+    age(path)
+    age(tmp_path)
+    observer._poll(watch)
+    recorder.events.clear()
+
+    def fail(*args):
+        raise AssertionError("目录 mtime 未变化时不应重新列出")
+    monkeypatch.setattr(observer, "_scan_dir", fail)
+    assert observer._poll(watch) == 0
+
+
+def test_new_subdirectory_is_followed_when_recursive(tmp_path, watched):
+    observer, watch, recorder = watched
+    sub = tmp_path / "sub"
+    sub.mkdir()
+    inner = write(sub / "a.pdf")
+    observer._poll(watch)
+    assert ("DirCreatedEvent", str(sub)) in recorder.events
+    assert ("FileCreatedEvent", inner) in recorder.events
+
+
+def test_interval_backs_off_when_idle(tmp_path):
+    observer = SnapshotObserver(min_interval=0.01, max_interval=0.02)
+    observer.schedule(Recorder(), str(tmp_path))
+    observer.start()
+    time.sleep(0.2)
+    observer.stop()
+    observer.join(1)
+    assert observer.interval == 0.02 and not observer.is_alive()
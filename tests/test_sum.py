@@ -0,0 +1,60 @@
+import os
+from decimal import Decimal
+
+import sum as invoice_sum
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write("x")
+
+
+def test_extract_amount_is_exact():
+    assert invoice_sum.extract_amount("[¥0.10]00000001.pdf") == Decimal("0.10")
+    assert invoice_sum.extract_amount("[¥1.2.3]00000001.pdf") == Decimal("0")
+    assert invoice_sum.extract_amount("scan.pdf") == Decimal("0")
+
+
+def test_scan_folder_counts_only_processed_files(tmp_path):
+    touch(str(tmp_path / "[¥0.10]00000001.pdf"))
+    touch(str(tmp_path / "[¥0.20]00000002.pdf"))
+    touch(str(tmp_path / "scan.pdf"))
+    touch(str(tmp_path / "sub" / "[¥5.00]00000003.pdf"))
+
+    subtotal, count, subdirs = invoice_sum.scan_folder(str(tmp_path))
+    assert (subtotal, count) == (Decimal("0.30"), 2)
+    assert subdirs == [str(tmp_path / "sub")]
+    assert invoice_sum.scan_folder(str(tmp_path / "missing")) == (Decimal("0"), 0, [])
+
+
+def test_folder_totals_walk_the_whole_tree(tmp_path):
+    touch(str(tmp_path / "[¥0.10]00000001.pdf"))
+    for i in range(30):
+        touch(str(tmp_path / f"d{i}" / "e" / f"[¥0.10]{i:08d}.pdf"))
+
+    totals = {folder: (subtotal, count) for folder, subtotal, count in invoice_sum.iter_folder_totals(str(tmp_path), 2)}
+    assert len(totals) == 61
+    assert sum(subtotal for subtotal, _ in totals.values()) == Decimal("3.10")
+    assert sum(count for _, count in totals.values()) == 31
+
+
+def test_main_renames_existing_total_file(tmp_path, capsys):
+    touch(str(tmp_path / "[¥0.10]00000001.pdf"))
+    touch(str(tmp_path / "[¥0.20]00000002.pdf"))
+    touch(str(tmp_path / "0.00.txt"))
+
+    invoice_sum.main(str(tmp_path))
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith(".txt")) == ["0.30.txt"]
+    assert "¥0.30" in capsys.readouterr().out
+
+
+def test_main_recursive_prints_subtotals_and_total(tmp_path, capsys):
+    touch(str(tmp_path / "a" / "[¥1.00]00000001.pdf"))
+    touch(str(tmp_path / "b" / "[¥2.50]00000002.pdf"))
+
+    invoice_sum.main_recursive(str(tmp_path), workers=2)
+    out = capsys.readouterr().out
+    assert "¥1.00\t1\t" in out and "¥2.50\t1\t" in out
+    assert out.strip().endswith("Total amount: ¥3.50 (2 invoices)")
+    assert not any(name.endswith(".txt") for name in os.listdir(tmp_path))
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("multipart")
+pytest.importorskip("aiofiles")
+
+import upload_stream  # noqa: E402
+
+BOUNDARY = "testboundary"
+
+
+class FakeRequest:
+    """只提供 headers 和 stream() 的请求替身，按 chunk_size 分块送出请求体"""
+
+    def __init__(self, body, chunk_size=7, content_type=f"multipart/form-data; boundary={BOUNDARY}"):
+        self.headers = {"content-type": content_type}
+        self.body = body
+        self.chunk_size = chunk_size
+
+    async def stream(self):
+        for start in range(0, len(self.body), self.chunk_size):
+            yield self.body[start:start + self.chunk_size]
+        yield b""
+
+
+class DisconnectingRequest(FakeRequest):
+    """送出 cut 字节后像客户端断开那样抛出异常"""
+
+    def __init__(self, body, cut):
+        super().__init__(body)
+        self.cut = cut
+
+    async def stream(self):
+        yield self.body[:self.cut]
+        raise ConnectionResetError("client disconnected")
+
+
+def multipart_body(*parts):
+    body = b""
+    for name, filename, content in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + content + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+def collect(request, directory, **kwargs):
+    async def run():
+        return [part async for part in upload_stream.iter_upload_parts(request, directory, **kwargs)]
+    return asyncio.run(run())
+
+
+def test_memory_mode_keeps_content_without_files(tmp_path):
+    body = multipart_body(("files", "a.pdf", b"%PDF-1.4 a"), ("files", "b.pdf", b"x" * 2048))
+    parts = collect(FakeRequest(body), None, max_file_mb=1 / 1024)
+
+    assert [part.filename for part in parts] == ["a.pdf", "b.pdf"]
+    assert parts[0].data == b"%PDF-1.4 a" and parts[0].path is None and parts[0].error is None
+    assert parts[1].data is None and parts[1].error
+
+
+def test_disk_mode_writes_each_file(tmp_path):
+    body = multipart_body(("files", "a.pdf", b"first"), ("files", "a.pdf", b"second"))
+    parts = collect(FakeRequest(body), str(tmp_path), max_file_mb=1)
+
+    assert [part.size for part in parts] == [5, 6]
+    assert parts[0].path != parts[1].path
+    assert [open(part.path, "rb").read() for part in parts] == [b"first", b"second"]
+    assert all(part.data is None and part.error is None for part in parts)
+
+
+def test_fields_are_yielded_in_order_when_requested(tmp_path):
+    body = multipart_body(("paths", None, "发票/a.pdf".encode()), ("files", "b.pdf", b"b"),
+                          ("paths", None, b"c.pdf"))
+
+    parts = collect(FakeRequest(body), str(tmp_path), max_file_mb=1, fields=True)
+    assert [type(part).__name__ for part in parts] == ["FormField", "UploadedPart", "FormField"]
+    assert [parts[0].value, parts[2].value] == ["发票/a.pdf", "c.pdf"]
+    assert parts[0].name == "paths"
+
+    # 默认忽略普通字段
+    parts = collect(FakeRequest(body), str(tmp_path), max_file_mb=1)
+    assert [part.filename for part in parts] == ["b.pdf"]
+
+
+def test_oversize_field_is_rejected(tmp_path):
+    body = multipart_body(("paths", None, b"x" * (upload_stream._MAX_FIELD_BYTES + 1)))
+    with pytest.raises(upload_stream.MalformedUpload):
+        collect(FakeRequest(body, chunk_size=4096), str(tmp_path), max_file_mb=1, fields=True)
+
+
+def test_non_multipart_request_is_rejected(tmp_path):
+    with pytest.raises(upload_stream.MalformedUpload):
+        collect(FakeRequest(b"{}", content_type="application/json"), str(tmp_path), max_file_mb=1)
+    with pytest.raises(upload_stream.MalformedUpload):
+        collect(FakeRequest(b"", content_type="multipart/form-data"), str(tmp_path), max_file_mb=1)
+
+
+def test_filename_directories_are_stripped(tmp_path):
+    upload_dir = tmp_path / "uploads"
+    upload_dir.mkdir()
+    body = multipart_body(("files", "../../evil.pdf", b"a"), ("files", "..\\dir\\win.pdf", b"b"))
+    parts = collect(FakeRequest(body), str(upload_dir), max_file_mb=1)
+
+    assert [part.filename for part in parts] == ["evil.pdf", "win.pdf"]
+    assert sorted(p.name for p in upload_dir.iterdir()) == ["evil.pdf", "win.pdf"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["uploads"]
+
+
+def test_oversize_file_is_removed(tmp_path):
+    body = multipart_body(("files", "big.pdf", b"x" * 4096), ("files", "small.pdf", b"ok"))
+    parts = collect(FakeRequest(body, chunk_size=512), str(tmp_path), max_file_mb=2 / 1024)
+
+    assert parts[0].error and parts[0].size > 2048
+    assert not (tmp_path / "big.pdf").exists()
+    assert parts[1].error is None and (tmp_path / "small.pdf").read_bytes() == b"ok"
+
+
+def test_partial_file_is_removed_on_disconnect(tmp_path):
+    body = multipart_body(("files", "done.pdf", b"complete"), ("files", "half.pdf", b"y" * 1000))
+    request = DisconnectingRequest(body, cut=body.index(b"y" * 1000) + 100)
+
+    async def run():
+        received = []
+        with pytest.raises(ConnectionResetError):
+            async for part in upload_stream.iter_upload_parts(request, str(tmp_path), max_file_mb=1):
+                received.append(part)
+        return received
+
+    received = asyncio.run(run())
+    assert [part.filename for part in received] == ["done.pdf"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["done.pdf"]
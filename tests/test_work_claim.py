@@ -0,0 +1,118 @@
+import os
+import time
+
+import output_layout
+import work_claim
+from invoice_processor import InvoiceResult
+from work_claim import CLAIM_DIR, FAILED_DIR, HEARTBEAT_FILE, NOT_CLAIMED, WorkClaimer
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write("x")
+    return path
+
+
+def result(success):
+    outcome = InvoiceResult("x")
+    if success:
+        outcome.new_name = "x.pdf"
+    return outcome
+
+
+def test_only_one_node_claims_a_file(tmp_path):
+    path = touch(str(tmp_path / "sub" / "a.pdf"))
+    first = WorkClaimer(str(tmp_path), node_id="n1")
+    second = WorkClaimer(str(tmp_path), node_id="n2")
+    claimed = first.claim(path)
+    assert claimed is not None and os.path.exists(claimed) and not os.path.exists(path)
+    assert work_claim.is_claim_path(claimed)
+    assert first.origin_of(claimed) == path
+    assert second.claim(path) is None
+
+
+def test_process_returns_not_claimed_for_missing_file(tmp_path):
+    claimer = WorkClaimer(str(tmp_path), node_id="n1")
+    assert claimer.process(str(tmp_path / "gone.pdf"), lambda p: result(True)) is NOT_CLAIMED
+
+
+def test_archived_file_is_left_alone(tmp_path):
+    path = touch(str(tmp_path / "a.pdf"))
+    claimer = WorkClaimer(str(tmp_path), node_id="n1")
+
+    def archive(claimed):
+        # 输出仍归档到文件原来所在的目录
+        return output_layout.place(claimed, "[¥1.00]12345678.pdf", layout="flat")
+
+    placed = claimer.process(path, archive)
+    assert placed == str(tmp_path / "[¥1.00]12345678.pdf")
+    assert os.listdir(claimer.node_dir) == []
+    assert os.listdir(claimer.failed_dir) == []
+
+
+def test_failed_file_moves_to_failed(tmp_path):
+    path = touch(str(tmp_path / "a.pdf"))
+    claimer = WorkClaimer(str(tmp_path), node_id="n1")
+    claimer.process(path, lambda claimed: result(False))
+    assert os.listdir(claimer.failed_dir) == ["a.pdf"]
+    assert not os.path.exists(path)
+
+
+def test_exception_moves_to_failed(tmp_path):
+    path = touch(str(tmp_path / "a.pdf"))
+    claimer = WorkClaimer(str(tmp_path), node_id="n1")
+
+    def boom(claimed):
+        raise RuntimeError("boom")
+
+    try:
+        claimer.process(path, boom)
+    except RuntimeError:
+        pass
+    assert os.listdir(claimer.failed_dir) == ["a.pdf"]
+
+
+def test_successful_unrenamed_file_returns_to_origin(tmp_path):
+    # 未拆分的多发票文件识别成功但保持原名
+    path = touch(str(tmp_path / "sub" / "merged.pdf"))
+    claimer = WorkClaimer(str(tmp_path), node_id="n1")
+    claimer.process(path, lambda claimed: result(True))
+    assert os.path.exists(path)
+    assert os.listdir(claimer.failed_dir) == []
+    assert output_layout.was_placed(path)
+
+
+def test_recover_stale_node(tmp_path):
+    root = str(tmp_path)
+    dead = WorkClaimer(root, node_id="dead")
+    alive = WorkClaimer(root, node_id="alive", lease_seconds=60)
+    path = touch(str(tmp_path / "sub" / "a.pdf"))
+    dead.claim(path)
+    dead.heartbeat()
+    old = time.time() - 600
+    os.utime(os.path.join(dead.node_dir, HEARTBEAT_FILE), (old, old))
+
+    assert alive.recover_stale() == 1
+    assert os.path.exists(path)
+    assert not os.path.exists(dead.node_dir)
+
+
+def test_live_node_is_not_recovered(tmp_path):
+    root = str(tmp_path)
+    busy = WorkClaimer(root, node_id="busy")
+    other = WorkClaimer(root, node_id="other", lease_seconds=60)
+    claimed = busy.claim(touch(str(tmp_path / "a.pdf")))
+    busy.heartbeat()
+    assert other.recover_stale() == 0
+    assert os.path.exists(claimed)
+
+
+def test_failed_dir_is_never_recovered(tmp_path):
+    root = str(tmp_path)
+    claimer = WorkClaimer(root, node_id="n1", lease_seconds=1)
+    claimer.process(touch(str(tmp_path / "a.pdf")), lambda claimed: result(False))
+    old = time.time() - 600
+    os.utime(os.path.join(root, CLAIM_DIR, FAILED_DIR), (old, old))
+    assert claimer.recover_stale() == 0
+    assert os.listdir(claimer.failed_dir) == ["a.pdf"]
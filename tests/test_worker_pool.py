@@ -0,0 +1,74 @@
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import pytest
+
+import worker_pool
+from worker_pool import _ChainedFuture
+
+
+def test_chained_future_keeps_first_outcome_and_runs_callbacks_once():
+    future = _ChainedFuture(Future())
+    seen = []
+    future.add_done_callback(lambda f: seen.append(f.result()))
+    future.set_result(("data", (0, 0, 1, 1)))
+    future.set_exception(RuntimeError("late"))
+    future.add_done_callback(lambda f: seen.append("late"))
+
+    assert future.done()
+    assert future.result() == ("data", (0, 0, 1, 1))
+    assert seen == [("data", (0, 0, 1, 1)), "late"]
+
+
+def test_chained_future_exception_is_raised():
+    future = _ChainedFuture(Future())
+    future.set_exception(ValueError("render failed"))
+    with pytest.raises(ValueError):
+        future.result()
+
+
+def test_cancel_before_render_starts_resolves_empty():
+    future = _ChainedFuture(Future())
+    future.cancel()
+    assert future.cancelled and future.result(timeout=0) == (None, None)
+
+
+def test_cancel_while_rendering_only_marks():
+    render = Future()
+    render.set_running_or_notify_cancel()
+    future = _ChainedFuture(render)
+    future.cancel()
+    assert future.cancelled and not future.done()
+    with pytest.raises(TimeoutError):
+        future.result(timeout=0)
+
+
+def test_unlink_releases_segment_and_ignores_missing():
+    shm = shared_memory.SharedMemory(create=True, size=16)
+    name = shm.name
+    shm.close()
+    worker_pool._unlink(name)
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+    worker_pool._unlink(name)
+
+
+def test_decode_shared_reads_strided_gray_pixels():
+    pytest.importorskip("numpy")
+    pytest.importorskip("pyzbar.pyzbar")
+    # 宽 4、高 2、单通道、行跨度 8 的空白图像：读取不越界且识别不到二维码
+    shm = shared_memory.SharedMemory(create=True, size=16)
+    try:
+        shm.buf[:16] = bytes([255] * 16)
+        assert worker_pool._decode_shared((shm.name, 4, 2, 1, 8)) == (None, None)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_pool_disabled_by_default_and_in_serial_context():
+    import executors
+    if not worker_pool.enabled():
+        assert worker_pool.get_pool() is None
+    with executors.serial():
+        assert not worker_pool.enabled() and worker_pool.get_pool() is None
@@ -0,0 +1,154 @@
+"""
+流式解析上传的 multipart 请求体
+
+FastAPI 的 List[UploadFile] 要等整个请求体缓存完才调用处理函数。这里直接读取 request.stream()
+交给 python-multipart 解析，每个文件部分边接收边用 aiofiles 分块写入目录，
+一个部分接收完就生成一次，调用方可以立即提交处理，上传与处理重叠进行。
+
+    async for part in iter_upload_parts(request, "uploads"):
+        ...   # part.path 已完整写入；part.error 不为空时该文件被拒绝
+
+fields=True 时普通表单字段也按出现顺序以 FormField 生成（如 /extract 的 paths）。
+directory 为 None 时文件内容只保存在内存中（part.data），供没有可写磁盘的 Serverless 部署使用。
+"""
+import logging
+import os
+import time
+import aiofiles
+from multipart.multipart import MultipartParser, parse_options_header
+from config_manager import config
+from file_processor import unique_path
+import metrics
+
+_MB = 1024 * 1024
+# 普通表单字段的大小上限，字段值保存在内存中
+_MAX_FIELD_BYTES = 64 * 1024
+
+
+class MalformedUpload(ValueError):
+    """请求体不是合法的 multipart/form-data"""
+
+
+class UploadedPart:
+    """一个已接收完的文件部分"""
+    __slots__ = ("filename", "path", "data", "size", "error")
+
+    def __init__(self, filename, path):
+        self.filename = filename
+        self.path = path
+        self.data = None      # directory 为 None 时的文件内容
+        self.size = 0
+        self.error = None
+
+
+class FormField:
+    """一个普通表单字段"""
+    __slots__ = ("name", "value")
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+
+def _boundary(request):
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise MalformedUpload("请求不是 multipart/form-data")
+    return params[b"boundary"]
+
+
+async def iter_upload_parts(request, directory, max_file_mb=None, fields=False):
+    """
+    逐个生成请求中已写入 directory（为 None 时保存在内存中）的文件部分；没有文件名的普通表单字段
+    在 fields 为真时以 FormField 生成，否则忽略。超过 upload_max_file_mb 的文件停止接收并删除，以带 error 的部分返回
+    """
+    max_file_mb = max_file_mb if max_file_mb is not None else config.get("upload_max_file_mb", 50)
+    max_bytes = int(max_file_mb * _MB) if max_file_mb > 0 else None
+    # python-multipart 的回调是同步的：先记录事件，每喂入一块数据后再异步处理
+    events = []
+    callbacks = {
+        "on_part_begin": lambda: events.append(("begin", None)),
+        "on_header_field": lambda data, start, end: events.append(("field", data[start:end])),
+        "on_header_value": lambda data, start, end: events.append(("value", data[start:end])),
+        "on_header_end": lambda: events.append(("header_end", None)),
+        "on_headers_finished": lambda: events.append(("headers_done", None)),
+        "on_part_data": lambda data, start, end: events.append(("data", data[start:end])),
+        "on_part_end": lambda: events.append(("end", None)),
+    }
+    parser = MultipartParser(_boundary(request), callbacks)
+
+    headers = {}
+    field = value = b""
+    part = out = form_field = None
+    started = 0.0
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                parser.write(chunk)
+            else:
+                parser.finalize()
+            for kind, data in events:
+                if kind == "begin":
+                    headers, field, value = {}, b"", b""
+                elif kind == "field":
+                    field += data
+                elif kind == "value":
+                    value += data
+                elif kind == "header_end":
+                    headers[field.lower()] = value
+                    field = value = b""
+                elif kind == "headers_done":
+                    _, options = parse_options_header(headers.get(b"content-disposition", b""))
+                    filename = options.get(b"filename")
+                    if filename:
+                        # 只保留文件名部分，防止路径穿越
+                        filename = os.path.basename(filename.decode("utf-8", "replace").replace("\\", "/"))
+                        started = time.perf_counter()
+                        if directory is None:
+                            part = UploadedPart(filename, None)
+                            part.data = bytearray()
+                        else:
+                            part = UploadedPart(filename, unique_path(directory, filename))
+                            out = await aiofiles.open(part.path, "wb")
+                    elif fields and options.get(b"name"):
+                        form_field = FormField(options[b"name"].decode("utf-8", "replace"), bytearray())
+                elif kind == "data" and form_field is not None:
+                    form_field.value += data
+                    if len(form_field.value) > _MAX_FIELD_BYTES:
+                        raise MalformedUpload(f"表单字段 {form_field.name} 过大")
+                elif kind == "end" and form_field is not None:
+                    form_field.value = form_field.value.decode("utf-8", "replace")
+                    finished, form_field = form_field, None
+                    yield finished
+                elif kind == "data" and part is not None and part.error is None:
+                    part.size += len(data)
+                    if max_bytes is not None and part.size > max_bytes:
+                        part.error = f"文件超过大小上限 {max_file_mb} MB"
+                        part.data = None
+                        if out is not None:
+                            await out.close()
+                            os.remove(part.path)
+                            out = None
+                    elif out is not None:
+                        await out.write(data)
+                    else:
+                        part.data += data
+                elif kind == "end" and part is not None:
+                    if out is not None:
+                        await out.close()
+                        out = None
+                    if part.error is None:
+                        if part.data is not None:
+                            part.data = bytes(part.data)
+                        metrics.stage_duration.observe(time.perf_counter() - started, stage="upload_save")
+                    finished, part = part, None
+                    yield finished
+            events.clear()
+    finally:
+        # 客户端中途断开时删除写了一半的文件
+        if out is not None:
+            await out.close()
+            try:
+                os.remove(part.path)
+            except OSError as e:
+                logging.error(f"删除未完成的上传文件失败 {part.path}: {e}")
@@ -1,27 +1,36 @@
-from fastapi import FastAPI, UploadFile, File, Form, Request, BackgroundTasks, HTTPException, Depends
-from fastapi.responses import JSONResponse, HTMLResponse, FileResponse, RedirectResponse
+from fastapi import FastAPI, Form, Request, HTTPException, Depends
+from fastapi.responses import JSONResponse, HTMLResponse, FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import uvicorn
 import os
 import logging
-from typing import List
 import shutil
+import tempfile
 from datetime import datetime, timedelta
 import zipfile
 import asyncio
-from pathlib import Path
 from config_manager import config
-from pdf_processor import process_special_pdf
-from ofd_processor import process_ofd
-import re
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from invoice_processor import InvoiceProcessor, SUPPORTED_EXTENSIONS
+from snapshot_observer import create_observer
+from event_coalescer import EventCoalescer
 import threading
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 import secrets
 import hashlib
 import json
+import metrics
+import profiler
+import output_layout
+import rollups
+import scheduler
+import work_claim
+import journal
+import archive_ingest
+import upload_stream
+import admission
+import log_setup
+import executors
 
 app = FastAPI(title="发票处理系统")
 
@@ -37,6 +46,19 @@ templates = Jinja2Templates(directory="templates")
 
 security = HTTPBasic()
 
+# Web 上传和监控目录先读文本层（电子发票最快），扫描件再识别二维码；不拆分多发票PDF
+WEB_PDF_STRATEGIES = ("text", "qr")
+
+# 监控目录同时接收发票和导出的压缩包
+WATCH_EXTENSIONS = SUPPORTED_EXTENSIONS + archive_ingest.ARCHIVE_EXTENSIONS
+
+def is_watch_candidate(file_name):
+    return journal.is_candidate(file_name, WATCH_EXTENSIONS)
+
+def web_processor(rename_with_amount, layout=None, track=True):
+    return InvoiceProcessor(layout=layout, track=track, rename_with_amount=rename_with_amount,
+                            pdf_strategies=WEB_PDF_STRATEGIES, multi_invoice=False)
+
 def verify_admin(credentials: HTTPBasicCredentials = Depends(security)):
     """验证管理员密码"""
     # 从配置文件获取管理员密码的哈希值，如果不存在则使用默认密码 "admin"
@@ -58,32 +80,74 @@ def verify_admin(credentials: HTTPBasicCredentials = Depends(security)):
         )
     return credentials
 
-class InvoiceHandler(FileSystemEventHandler):
-    def on_created(self, event):
-        if event.is_directory:
-            return
-        
-        file_path = event.src_path
-        if file_path.lower().endswith(('.pdf', '.ofd')):
-            try:
-                relative_path = os.path.relpath(file_path, config.get("watch_dir", "./watch"))
-                logging.info(f"检测到新文件: {relative_path}")
-                
-                ext = os.path.splitext(file_path)[1].lower()
-                
-                # 使用Watch目录的配置
-                config.set("rename_with_amount", config.get("watch_rename_with_amount", False))
+class InvoiceHandler(EventCoalescer):
+    """收集 Watch 目录中新建/移入的发票文件，合并成批次后统一处理"""
+
+    def __init__(self, watch_dir):
+        super().__init__(self.process_batch, extensions=WATCH_EXTENSIONS, recursive=True)
+        # 多节点共享监控目录时先认领再处理
+        self.claimer = work_claim.get_claimer(watch_dir)
+
+    def process_batch(self, paths, priority_class="watch"):
+        # 使用Watch目录的配置；任务交给调度器，不阻塞事件线程
+        rename_with_amount = config.get("watch_rename_with_amount", False)
+        pool = scheduler.get_scheduler()
+        processor = web_processor(rename_with_amount)
+        # 同一批次的文件共用 job_id
+        with log_setup.trace(priority_class, job=True):
+            for file_path in paths:
+                pool.submit(priority_class, self.process_one, file_path, processor)
+
+    def process_one(self, file_path, processor):
+        metrics.queue_depth.inc(queue="watch")
+        try:
+            with journal.track(file_path):
+                self._process_one(file_path, processor)
+        finally:
+            metrics.queue_depth.dec(queue="watch")
+
+    def _process_one(self, file_path, processor):
+        try:
+            relative_path = os.path.relpath(file_path, config.get("watch_dir", "./watch"))
+            logging.info(f"检测到新文件: {relative_path}")
+            
+            with metrics.timed("watch_process"):
+                if archive_ingest.is_archive(file_path):
+                    self.run(file_path, archive_ingest.ingest_file, processor)
+                else:
+                    self.run(file_path, processor.process)
                 
-                if ext == '.pdf':
-                    process_special_pdf(file_path)
-                elif ext == '.ofd':
-                    process_ofd(file_path, "tmp", False)
-                    
-            except Exception as e:
-                logging.error(f"处理文件失败 {file_path}: {e}")
-            finally:
-                # 恢复原始配置
-                config.set("rename_with_amount", config.get("webui_rename_with_amount", False))
+        except Exception as e:
+            logging.error(f"处理文件失败 {file_path}: {e}")
+
+    def run(self, file_path, fn, *args, **kwargs):
+        if self.claimer is not None:
+            return self.claimer.process(file_path, fn, *args, **kwargs)
+        return fn(file_path, *args, **kwargs)
+
+    def catch_up(self, watch_dir):
+        """把启动前就已存在、尚未处理的文件以最低优先级补扫"""
+        processing_journal = journal.get_journal()
+        if processing_journal is not None:
+            # 只重放未完成的文件并列出有变化的目录
+            paths = processing_journal.recover(is_watch_candidate)
+        else:
+            paths = []
+            stack = [watch_dir]
+            while stack:
+                try:
+                    with os.scandir(stack.pop()) as entries:
+                        for entry in entries:
+                            if entry.is_dir(follow_symlinks=False):
+                                if not entry.name.startswith("."):
+                                    stack.append(entry.path)
+                            elif is_watch_candidate(entry.name) and entry.is_file(follow_symlinks=False):
+                                paths.append(entry.path)
+                except (FileNotFoundError, PermissionError):
+                    continue
+        if paths:
+            logging.info(f"补扫监控目录中的 {len(paths)} 个待处理文件")
+            self.process_batch(paths, priority_class="catchup")
 
 def start_file_monitor():
     """启动文件监控"""
@@ -91,10 +155,14 @@ def start_file_monitor():
     if not os.path.exists(watch_dir):
         os.makedirs(watch_dir, exist_ok=True)
         
-    event_handler = InvoiceHandler()
-    observer = Observer()
+    journal.open_journal(watch_dir, recursive=True)
+    event_handler = InvoiceHandler(watch_dir)
+    observer = create_observer()
     observer.schedule(event_handler, watch_dir, recursive=True)
+    event_handler.start()
     observer.start()
+    if config.get("watch_catchup", True):
+        threading.Thread(target=event_handler.catch_up, args=(watch_dir,), daemon=True).start()
     
     logging.info(f"开始监控目录: {watch_dir} (包含子目录)")
     return observer
@@ -102,43 +170,52 @@ def start_file_monitor():
 # 存储文件上传时间的字典
 file_upload_times = {}
 
+def _remove_expired_files():
+    """删除超过30分钟的上传文件和超过1小时的处理后文件（在 io 执行器中运行）"""
+    current_time = datetime.now()
+    # 检查并删除过期文件；上传处理可能同时写入记录，遍历快照
+    expired_files = []
+    for file_path, upload_time in list(file_upload_times.items()):
+        if current_time - upload_time > timedelta(minutes=30):
+            if os.path.exists(file_path):
+                try:
+                    os.remove(file_path)
+                    logging.info(f"已删除过期文件: {file_path}")
+                except Exception as e:
+                    logging.error(f"删除文件失败 {file_path}: {e}")
+            expired_files.append(file_path)
+    
+    # 从记录中移除已删除的文件
+    for file_path in expired_files:
+        file_upload_times.pop(file_path, None)
+    
+    # 清理处理后的文件（分片布局下包含各分片子目录）
+    watch_dir = config.get("watch_dir", "./watch")
+    if os.path.exists(watch_dir):
+        removed_from = set()
+        for entry in output_layout.iter_processed_files(watch_dir):
+            file_path = entry.path
+            file_age = current_time - datetime.fromtimestamp(entry.stat().st_mtime)
+            # 删除超过1小时的处理后文件
+            if file_age > timedelta(hours=1):
+                try:
+                    os.remove(file_path)
+                    removed_from.add(os.path.dirname(file_path))
+                    logging.info(f"已删除过期处理后文件: {file_path}")
+                except Exception as e:
+                    logging.error(f"删除文件失败 {file_path}: {e}")
+        # 分片合计中去掉已删除的文件
+        output_layout.refresh_shard_totals(removed_from)
+
+async def run_io(fn, *args):
+    """在 io 阶段的执行器中运行同步文件操作，不阻塞事件循环"""
+    return await asyncio.get_running_loop().run_in_executor(executors.get_executor("io"), fn, *args)
+
 async def cleanup_old_files():
     """定期清理超过30分钟的上传文件和处理后的文件"""
     while True:
         try:
-            current_time = datetime.now()
-            # 检查并删除过期文件
-            expired_files = []
-            for file_path, upload_time in file_upload_times.items():
-                if current_time - upload_time > timedelta(minutes=30):
-                    if os.path.exists(file_path):
-                        try:
-                            os.remove(file_path)
-                            logging.info(f"已删除过期文件: {file_path}")
-                        except Exception as e:
-                            logging.error(f"删除文件失败 {file_path}: {e}")
-                    expired_files.append(file_path)
-            
-            # 从记录中移除已删除的文件
-            for file_path in expired_files:
-                file_upload_times.pop(file_path, None)
-            
-            # 清理处理后的文件
-            watch_dir = config.get("watch_dir", "./watch")
-            if os.path.exists(watch_dir):
-                for filename in os.listdir(watch_dir):
-                    if filename.startswith("[¥") and os.path.isfile(os.path.join(watch_dir, filename)):
-                        file_path = os.path.join(watch_dir, filename)
-                        file_stat = os.stat(file_path)
-                        file_age = current_time - datetime.fromtimestamp(file_stat.st_mtime)
-                        # 删除超过1小时的处理后文件
-                        if file_age > timedelta(hours=1):
-                            try:
-                                os.remove(file_path)
-                                logging.info(f"已删除过期处理后文件: {file_path}")
-                            except Exception as e:
-                                logging.error(f"删除文件失败 {file_path}: {e}")
-                
+            await run_io(_remove_expired_files)
         except Exception as e:
             logging.error(f"清理文件时发生错误: {e}")
         
@@ -147,7 +224,8 @@ async def cleanup_old_files():
 
 @app.on_event("startup")
 async def startup_event():
-    """启动时开始运行清理任务"""
+    """启动时确定各阶段执行后端并开始运行清理任务"""
+    await asyncio.to_thread(executors.autotune)
     asyncio.create_task(cleanup_old_files())
 
 @app.get("/", response_class=HTMLResponse)
@@ -170,7 +248,7 @@ def create_zip_file(files_info):
     zip_filename = f"processed_invoices_{timestamp}.zip"
     zip_path = os.path.join("downloads", zip_filename)
     
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+    with metrics.timed("zip"), zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
         for info in files_info:
             if info["success"] and info.get("new_path"):
                 # 将文件添加到ZIP中，使用新文件名作为ZIP中的名称
@@ -181,86 +259,274 @@ def create_zip_file(files_info):
     
     return zip_path
 
+def _process_upload(file_path, processor):
+    """在调度器线程中处理单个上传文件，返回 InvoiceResult"""
+    with metrics.timed("upload_process"):
+        return profiler.call(file_path, processor.process, file_path)
+
+def _process_upload_archive(file_path, processor):
+    """从上传的压缩包中逐个读取成员处理，识别后的成员写入 uploads 目录，返回每个成员的结果"""
+    with metrics.timed("upload_process"):
+        return archive_ingest.process_archive(file_path, processor, output_dir="uploads")
+
+async def _run_upload(fn, *args):
+    """以交互优先级提交到调度器并等待结果"""
+    future = scheduler.get_scheduler().submit("interactive", fn, *args)
+    return await asyncio.wrap_future(future)
+
+def _client_id(request):
+    """区分客户端；只有来自 trusted_proxies 的请求才采用 X-Forwarded-For"""
+    peer = request.client.host if request.client else None
+    return admission.get_controller().client_id(peer, request.headers.get("x-forwarded-for", ""))
+
+def _rejected_response(e):
+    return JSONResponse(
+        status_code=e.status_code,
+        content={"success": False, "error": e.reason},
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+def _admit(request):
+    """按准入控制接收一个上传请求，返回 (凭据, None)；被拒绝时返回 (None, 错误响应)"""
+    try:
+        declared_bytes = int(request.headers.get("content-length") or 0)
+        return admission.get_controller().acquire(_client_id(request), declared_bytes), None
+    except admission.Rejected as e:
+        logging.warning(f"拒绝上传请求 {request.url.path} ({e.status_code}): {e.reason}")
+        return None, _rejected_response(e)
+    except ValueError:
+        return None, JSONResponse(status_code=400, content={"success": False, "error": "Content-Length 无效"})
+
 @app.post("/upload")
-async def upload_files(files: List[UploadFile] = File(...)):
-    """处理上传的文件并返回ZIP包下载链接"""
+async def upload_files(request: Request):
+    """处理上传的文件并返回ZIP包下载链接；超出准入限制时立即返回 429/503"""
+    ticket, rejected = _admit(request)
+    if rejected is not None:
+        return rejected
+    try:
+        with log_setup.trace("upload", job=True):
+            return await _handle_upload(request, ticket)
+    finally:
+        admission.get_controller().release(ticket)
+
+async def _handle_upload(request, ticket):
+    """每个文件接收完即开始处理，不等整个请求体上传完"""
     results = []
     processed_files = []
     
     try:
         # 使用Web UI的配置
-        config.set("rename_with_amount", config.get("webui_rename_with_amount", False))
+        processor = web_processor(config.get("webui_rename_with_amount", False), layout="flat", track=False)
         
-        for file in files:
-            try:
-                # 保存上传的文件
-                file_path = os.path.join("uploads", file.filename)
-                with open(file_path, "wb") as buffer:
-                    shutil.copyfileobj(file.file, buffer)
-                
+        # 边接收边以交互优先级提交处理
+        saved = []
+        stream_error = None
+        max_files = config.get("upload_max_files", 500)
+        # 未声明 Content-Length 时按实际接收的文件大小计入待处理字节数
+        declared = ticket.nbytes > 0
+        try:
+            async for part in upload_stream.iter_upload_parts(request, "uploads"):
+                try:
+                    if len(saved) >= max_files:
+                        raise RuntimeError(f"文件数量超过上限 {max_files}")
+                    if not declared and not part.error:
+                        ticket.add_bytes(part.size)
+                except Exception:
+                    if not part.error:
+                        os.remove(part.path)
+                    raise
+                metrics.queue_depth.inc(queue="upload")
+                if part.error:
+                    saved.append((part, None))
+                    continue
                 # 记录文件上传时间（用于自动清理）
-                file_upload_times[file_path] = datetime.now()
-                
-                # 处理文件
-                ext = os.path.splitext(file.filename)[1].lower()
-                result = None
-                amount = None
-                if ext == '.pdf':
-                    result = process_special_pdf(file_path)
-                    if result:
-                        try:
-                            amount_match = re.search(r'\[¥(\d+\.\d{2})\]', os.path.basename(result))
-                            if amount_match:
-                                amount = amount_match.group(1)
-                        except Exception as e:
-                            logging.warning(f"提取金额失败: {e}")
-                elif ext == '.ofd':
-                    result = process_ofd(file_path, "tmp", False)
-                    if result:
-                        try:
-                            amount_match = re.search(r'\[¥(\d+\.\d{2})\]', os.path.basename(result))
-                            if amount_match:
-                                amount = amount_match.group(1)
-                        except Exception as e:
-                            logging.warning(f"提取金额失败: {e}")
-                
-                # 准备结果
-                success = result is not None
-                new_name = os.path.basename(result) if success else None
-                results.append({
-                    "filename": file.filename,
-                    "success": success,
-                    "amount": amount,
-                    "new_name": new_name,
-                    "new_path": result if success else None
-                })
+                file_upload_times[part.path] = datetime.now()
+                # 压缩包成员直接从保存的压缩包中读取，不解压到磁盘
+                fn = _process_upload_archive if archive_ingest.is_archive(part.filename) else _process_upload
+                saved.append((part, asyncio.ensure_future(_run_upload(fn, part.path, processor))))
+        except Exception as e:
+            # 已接收完的文件照常返回结果
+            logging.error(f"接收上传文件失败: {e}")
+            stream_error = str(e)
+            if not saved and isinstance(e, admission.Rejected):
+                return _rejected_response(e)
+        
+        if not saved:
+            return JSONResponse(status_code=400, content={"success": False, "error": stream_error or "未上传文件"})
+        
+        outcomes = await asyncio.gather(
+            *(job for _, job in saved if job is not None), return_exceptions=True)
+        outcomes = iter(outcomes)
+        
+        for part, job in saved:
+            try:
+                if job is None:
+                    raise RuntimeError(part.error)
+                result = next(outcomes)
+                if isinstance(result, Exception):
+                    raise result
                 
-                if success:
-                    processed_files.append(result)
+                # 准备结果；压缩包中的每个成员各占一条
+                members = result if isinstance(result, list) else [result]
+                for member in members:
+                    success = member.path is not None
+                    entry = {
+                        "filename": member.source if isinstance(result, list) else part.filename,
+                        "success": success,
+                        "amount": member.amount,
+                        "new_name": os.path.basename(member.path) if success else None,
+                        "new_path": member.path
+                    }
+                    if member.error:
+                        entry["error"] = member.error
+                    results.append(entry)
+                    
+                    if success:
+                        processed_files.append(member.path)
+                        if isinstance(result, list):
+                            file_upload_times[member.path] = datetime.now()
                 
             except Exception as e:
                 logging.error(f"处理文件失败: {e}")
                 results.append({
-                    "filename": file.filename,
+                    "filename": part.filename,
                     "success": False,
                     "error": str(e)
                 })
                 continue
+            finally:
+                metrics.queue_depth.dec(queue="upload")
         
+        response = {"success": True, "results": results}
+        if stream_error:
+            response["error"] = stream_error
         # 创建ZIP文件（如果有成功处理的文件）
         if processed_files:
-            zip_path = create_zip_file([r for r in results if r["success"]])
-            download_url = f"/download/{os.path.basename(zip_path)}"
-            return {"success": True, "results": results, "download_url": download_url}
-        
-        return {"success": True, "results": results}
+            zip_path = await run_io(create_zip_file, [r for r in results if r["success"]])
+            response["download_url"] = f"/download/{os.path.basename(zip_path)}"
+        return response
     
     except Exception as e:
         logging.error(f"处理上传文件时出错: {e}")
         return {"success": False, "error": str(e)}
-    finally:
-        # 恢复原始配置
-        config.set("rename_with_amount", config.get("webui_rename_with_amount", False))
+
+# /extract 每行输出的字段
+EXTRACT_FIELDS = ("invoice_code", "invoice_number", "amount", "date", "seller", "invoice_type", "strategy", "error")
+
+def _resolve_watch_path(path):
+    """把客户端给出的相对路径限制在监控目录内"""
+    watch_dir = os.path.realpath(config.get("watch_dir", "./watch"))
+    full_path = os.path.realpath(os.path.join(watch_dir, path))
+    if os.path.commonpath([watch_dir, full_path]) != watch_dir:
+        raise ValueError(f"路径不在监控目录内: {path}")
+    return full_path
+
+def _extract_one(name, file_path, processor, remove=False):
+    """在调度器线程中读取文件并在内存中识别，不重命名也不归档；remove 为真时读取后删除该文件"""
+    with metrics.timed("extract_process"):
+        with open(file_path, "rb") as f:
+            data = f.read()
+        if remove:
+            os.remove(file_path)
+        return profiler.call(name, processor.process, name, data=data)
+
+def _extract_record(index, name, result=None, error=None):
+    record = {"index": index, "filename": name, "success": result is not None and result.success}
+    for field in EXTRACT_FIELDS:
+        record[field] = getattr(result, field) if result is not None else None
+    if error is not None:
+        record["error"] = error
+    return record
+
+@app.post("/extract")
+async def extract_files(request: Request):
+    """
+    只识别发票号码、金额和日期，供系统间调用：不保存、不重命名、不打包。
+    multipart 表单中 files 为上传的文件，paths 为监控目录下的相对路径；
+    与 /upload 一样经过准入控制，文件边接收边写入临时目录并提交识别，
+    每个文件完成后立即输出一行 NDJSON，同时处理的文件数不超过 extract_concurrency
+    """
+    ticket, rejected = _admit(request)
+    if rejected is not None:
+        return rejected
+    directory = tempfile.mkdtemp(prefix="extract-")
+
+    def finish():
+        admission.get_controller().release(ticket)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    try:
+        # 任务在请求的 trace 中创建，各文件的日志共用 job_id
+        with log_setup.trace("extract", job=True):
+            tasks, stream_error = await _receive_extract(request, ticket, directory)
+    except BaseException:
+        finish()
+        raise
+    if not tasks:
+        finish()
+        if isinstance(stream_error, admission.Rejected):
+            return _rejected_response(stream_error)
+        return JSONResponse(status_code=400, content={"error": str(stream_error or "未提供文件或路径")})
+
+    async def stream():
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield json.dumps(await finished, ensure_ascii=False) + "\n"
+            if stream_error:
+                yield json.dumps({"error": str(stream_error)}, ensure_ascii=False) + "\n"
+        finally:
+            # 客户端断开时取消尚未开始的文件
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await run_io(finish)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+async def _receive_extract(request, ticket, directory):
+    """接收 /extract 的请求体，每个文件或路径到达即提交识别；返回 (任务列表, 接收时的异常)"""
+    processor = web_processor(False, layout="flat", track=False)
+    semaphore = asyncio.Semaphore(max(1, config.get("extract_concurrency", 4)))
+    max_files = config.get("upload_max_files", 500)
+    declared = ticket.nbytes > 0
+
+    async def run(index, name, file_path=None, watch_path=None, error=None):
+        if error is not None:
+            return _extract_record(index, name, error=error)
+        async with semaphore:
+            metrics.queue_depth.inc(queue="extract")
+            try:
+                if watch_path is not None:
+                    file_path = _resolve_watch_path(watch_path)
+                future = scheduler.get_scheduler().submit(
+                    "interactive", _extract_one, name, file_path, processor, watch_path is None)
+                return _extract_record(index, name, await asyncio.wrap_future(future))
+            except Exception as e:
+                logging.error(f"提取发票信息失败 {name}: {e}")
+                return _extract_record(index, name, error=str(e))
+            finally:
+                metrics.queue_depth.dec(queue="extract")
+
+    tasks = []
+    try:
+        async for part in upload_stream.iter_upload_parts(request, directory, fields=True):
+            if isinstance(part, upload_stream.FormField):
+                if part.name != "paths":
+                    continue
+                job = run(len(tasks), part.value, watch_path=part.value)
+            else:
+                if not declared and not part.error:
+                    ticket.add_bytes(part.size)
+                job = run(len(tasks), part.filename, file_path=part.path, error=part.error)
+            if len(tasks) >= max_files:
+                job.close()
+                raise RuntimeError(f"文件数量超过上限 {max_files}")
+            tasks.append(asyncio.ensure_future(job))
+    except Exception as e:
+        # 已接收的文件照常输出结果
+        logging.error(f"接收提取请求失败: {e}")
+        return tasks, e
+    return tasks, None
 
 @app.get("/download/{filename}")
 async def download_file(filename: str):
@@ -281,13 +547,44 @@ async def download_file(filename: str):
     # 设置回调以在发送完成后删除文件
     async def delete_file():
         try:
-            os.remove(file_path)
+            await run_io(os.remove, file_path)
         except Exception as e:
             logging.error(f"删除ZIP文件失败 {file_path}: {e}")
     
     response.background = delete_file
     return response
 
+@app.get("/health")
+async def health():
+    """负载状态：准入计数和调度器队列深度；饱和时返回 503，负载均衡器据此绕开本节点"""
+    controller = admission.get_controller()
+    content = {
+        "status": "saturated" if controller.saturated() else "ok",
+        "admission": controller.status(),
+        "queues": scheduler.get_scheduler().stats(),
+        "executors": executors.describe(),
+    }
+    if content["status"] == "saturated":
+        return JSONResponse(status_code=503, content=content,
+                            headers={"Retry-After": str(controller.retry_after)})
+    return content
+
+@app.get("/metrics")
+async def get_metrics():
+    """以 Prometheus 格式导出处理指标"""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/rollups")
+async def get_rollups(dimension: str = "total"):
+    """查询发票金额汇总（total/month/seller/type）"""
+    store = rollups.get_store()
+    if store is None:
+        return JSONResponse(status_code=404, content={"error": "汇总未启用"})
+    try:
+        return {"dimension": dimension, "rows": store.query(dimension)}
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
 @app.get("/config")
 async def get_config():
     """获取当前配置"""
@@ -361,6 +658,27 @@ async def update_watch_config(
             content={"success": False, "error": str(e)}
         )
 
+@app.get("/admin/profiling")
+async def get_profiling(credentials: HTTPBasicCredentials = Depends(verify_admin)):
+    """查看剖析模式状态及已保存的剖析文件"""
+    return profiler.status()
+
+@app.post("/admin/profiling")
+async def update_profiling(
+    credentials: HTTPBasicCredentials = Depends(verify_admin),
+    enabled: bool = Form(...),
+    threshold_ms: int = Form(None)
+):
+    """开启或关闭慢文件剖析模式（需要密码验证）"""
+    try:
+        profiler.configure(enabled=enabled, threshold_ms=threshold_ms)
+        return {"success": True, **profiler.status()}
+    except Exception as e:
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "error": str(e)}
+        )
+
 @app.post("/user/config")
 async def update_user_config(
     rename_with_amount: bool = Form(...)
@@ -376,57 +694,63 @@ async def update_user_config(
             content={"success": False, "error": str(e)}
         )
 
-@app.post("/clear-cache")
-async def clear_cache():
-    """清理缓存文件"""
-    try:
-        # 清理上传目录
-        cleared_files = []
-        for filename in os.listdir("uploads"):
-            file_path = os.path.join("uploads", filename)
-            if os.path.isfile(file_path):
-                try:
-                    os.remove(file_path)
-                    cleared_files.append(file_path)
-                    # 从记录中移除
-                    file_upload_times.pop(file_path, None)
-                except Exception as e:
-                    logging.error(f"删除文件失败 {file_path}: {e}")
-        
-        # 清理临时目录
-        if os.path.exists("tmp"):
-            for filename in os.listdir("tmp"):
-                file_path = os.path.join("tmp", filename)
-                if os.path.isfile(file_path):
-                    try:
-                        os.remove(file_path)
-                        cleared_files.append(file_path)
-                    except Exception as e:
-                        logging.error(f"删除文件失败 {file_path}: {e}")
-        
-        # 清理下载目录
-        for filename in os.listdir("downloads"):
-            file_path = os.path.join("downloads", filename)
+def _clear_cache_files():
+    """删除上传、临时、下载目录中的文件和监控目录中已处理的发票，返回已删除的路径"""
+    # 清理上传目录
+    cleared_files = []
+    for filename in os.listdir("uploads"):
+        file_path = os.path.join("uploads", filename)
+        if os.path.isfile(file_path):
+            try:
+                os.remove(file_path)
+                cleared_files.append(file_path)
+                # 从记录中移除
+                file_upload_times.pop(file_path, None)
+            except Exception as e:
+                logging.error(f"删除文件失败 {file_path}: {e}")
+    
+    # 清理临时目录
+    if os.path.exists("tmp"):
+        for filename in os.listdir("tmp"):
+            file_path = os.path.join("tmp", filename)
             if os.path.isfile(file_path):
                 try:
                     os.remove(file_path)
                     cleared_files.append(file_path)
                 except Exception as e:
                     logging.error(f"删除文件失败 {file_path}: {e}")
-        
-        # 清理处理后的文件（如果用户确认）
-        watch_dir = config.get("watch_dir", "./watch")
-        if os.path.exists(watch_dir):
-            for filename in os.listdir(watch_dir):
-                # 只删除带金额标记的已处理文件
-                if filename.startswith("[¥") and os.path.isfile(os.path.join(watch_dir, filename)):
-                    file_path = os.path.join(watch_dir, filename)
-                    try:
-                        os.remove(file_path)
-                        cleared_files.append(file_path)
-                    except Exception as e:
-                        logging.error(f"删除文件失败 {file_path}: {e}")
-        
+    
+    # 清理下载目录
+    for filename in os.listdir("downloads"):
+        file_path = os.path.join("downloads", filename)
+        if os.path.isfile(file_path):
+            try:
+                os.remove(file_path)
+                cleared_files.append(file_path)
+            except Exception as e:
+                logging.error(f"删除文件失败 {file_path}: {e}")
+    
+    # 清理处理后的文件（如果用户确认）
+    watch_dir = config.get("watch_dir", "./watch")
+    if os.path.exists(watch_dir):
+        # 只删除带金额标记的已处理文件（分片布局下包含各分片子目录）
+        removed_from = set()
+        for entry in output_layout.iter_processed_files(watch_dir):
+            file_path = entry.path
+            try:
+                os.remove(file_path)
+                cleared_files.append(file_path)
+                removed_from.add(os.path.dirname(file_path))
+            except Exception as e:
+                logging.error(f"删除文件失败 {file_path}: {e}")
+        output_layout.refresh_shard_totals(removed_from)
+    return cleared_files
+
+@app.post("/clear-cache")
+async def clear_cache():
+    """清理缓存文件"""
+    try:
+        cleared_files = await run_io(_clear_cache_files)
         return {"success": True, "message": f"成功清理 {len(cleared_files)} 个缓存文件"}
     except Exception as e:
         logging.error(f"清理缓存失败: {e}")
@@ -438,11 +762,11 @@ def start_web_server():
     uvicorn.run(app, host="0.0.0.0", port=port)
 
 if __name__ == "__main__":
-    # 配置日志
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s'
-    )
+    # 配置日志（级别和格式取自 log_level / log_format）
+    log_setup.configure()
+    
+    # 在调度器和进程池创建前确定各阶段执行后端
+    executors.autotune()
     
     # 启动文件监控
     observer = start_file_monitor()
@@ -1,40 +1,43 @@
-from fastapi import FastAPI, UploadFile, File, Form, Request, HTTPException, Depends
-from fastapi.responses import JSONResponse, HTMLResponse, FileResponse
+from fastapi import FastAPI, Form, Request, HTTPException, Depends
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from fastapi.templating import Jinja2Templates
 import os
+import io
 import logging
-from typing import List
-import shutil
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timedelta
 import zipfile
-from pathlib import Path
-import re
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 import secrets
 import hashlib
 import json
-import fitz  # PyMuPDF
-import cv2
-import numpy as np
-from PIL import Image
+import upload_stream
 
+# fitz/cv2/numpy 在首次处理请求时才导入，以缩短冷启动时间；
+# 只使用识别/提取函数，不导入 invoice_processor（汇总库、进程池、归档布局等服务端组件）
 app = FastAPI(title="发票处理系统")
 
-# 配置日志
-logging.basicConfig(level=logging.INFO)
-
 # 静态文件和模板配置
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
 security = HTTPBasic()
 
+@app.on_event("startup")
+async def configure_logging():
+    """在服务启动时而非导入时配置日志（级别和格式取自 log_level / log_format）"""
+    import log_setup
+    log_setup.configure()
+
 # 简化的配置管理
 class Config:
     def __init__(self):
         self.config = {
             "webui_rename_with_amount": True,
+            # 单个文件的大小上限；请求体只在内存中接收，不写 /tmp
+            "upload_max_file_mb": 10,
             "admin_password_hash": hashlib.sha256("admin".encode()).hexdigest()
         }
     
@@ -49,103 +52,66 @@ class Config:
 
 config = Config()
 
-def scan_qrcode(image_path):
-    """使用OpenCV扫描图片中的二维码"""
+def scan_qrcode(image):
+    """使用OpenCV扫描灰度图中的二维码（先经过灰度/二值化/定位裁剪预处理）；也接受图片路径"""
+    import cv2
+    import numpy as np
+    from qr_preprocess import decode_candidates
     try:
-        # 读取图片
-        image = cv2.imread(image_path)
+        if isinstance(image, str):
+            # 直接以灰度读取图片
+            image = cv2.imread(image, cv2.IMREAD_GRAYSCALE)
         if image is None:
             return None
             
         # 创建QR码检测器
         qr_detector = cv2.QRCodeDetector()
         
-        # 检测和解码QR码
-        retval, decoded_info, points, straight_qrcode = qr_detector.detectAndDecodeMulti(image)
-        
-        if retval and decoded_info:
-            # 返回第一个检测到的QR码内容
-            for info in decoded_info:
-                if info:  # 确保内容不为空
-                    return info
+        # 从小到大依次尝试候选图像
+        for candidate in decode_candidates(image):
+            info, points, _ = qr_detector.detectAndDecode(np.ascontiguousarray(candidate))
+            if info:  # 确保内容不为空
+                return info
         
         return None
     except Exception as e:
         logging.error(f"扫描二维码失败: {e}")
         return None
 
-def extract_information(data_str):
-    """从二维码数据中提取发票号码和金额"""
-    invoice_number = None
-    amount = None
-    
-    try:
-        # 提取发票号码（支持20位和8位格式）
-        invoice_match = re.search(r"\b\d{20}\b|\b\d{8}\b", data_str)
-        if invoice_match:
-            invoice_number = invoice_match.group(0)
-        
-        # 提取金额
-        amount_patterns = [
-            r"(\d+\.\d+)(?=,)",
-            r"金额[:：]\s*(\d+\.\d+)",
-            r"¥\s*(\d+\.\d+)",
-            r"[^\d](\d+\.\d+)[^\d]"
-        ]
-        
-        for pattern in amount_patterns:
-            amount_match = re.search(pattern, data_str)
-            if amount_match:
-                amount = "{:.2f}".format(float(amount_match.group(1)))
-                break
-    except Exception as e:
-        logging.error(f"提取信息失败: {e}")
-    
-    return invoice_number, amount
+SUPPORTED_EXTENSIONS = ('.pdf', '.ofd')
 
-def process_pdf(file_path):
-    """处理PDF文件"""
-    try:
-        # 转换第一页为图片
-        doc = fitz.open(file_path)
-        page = doc[0]
-        pix = page.get_pixmap(dpi=300)
-        image_path = f"{file_path}_page0.png"
-        pix.save(image_path)
-        
-        # 扫描二维码
-        qr_data = scan_qrcode(image_path)
-        
-        # 清理临时文件
-        os.remove(image_path)
-        doc.close()
-        
-        if qr_data:
-            invoice_number, amount = extract_information(qr_data)
-            if not amount:  # 如果二维码中没有金额，尝试从文本中提取
-                text = ""
-                with fitz.open(file_path) as doc:
-                    for page in doc:
-                        text += page.get_text()
-                amount_match = re.search(r"¥\s*(\d+\.\d+)", text)
-                if amount_match:
-                    amount = "{:.2f}".format(float(amount_match.group(1)))
-            
+def process_document(data, filename):
+    """
+    在内存中处理上传的 PDF/OFD：从请求字节直接打开文档，用 OpenCV 识别二维码（PDF 只看首页），
+    必要时从同一文档的文本层补充发票号码和金额；返回 (新文件名, 金额)，不写任何文件
+    """
+    import fitz
+    from qr_preprocess import pixmap_to_gray
+    from data_extractor import INVOICE_NUMBER_RE, extract_information, extract_max_amount
+    from pdf_processor import create_new_filename
+    ext = os.path.splitext(filename)[1].lower()
+    invoice_number = amount = None
+    with fitz.open(stream=data, filetype=ext[1:]) as doc:
+        for page_num in ([0] if ext == ".pdf" else range(len(doc))):
+            pix = doc.load_page(page_num).get_pixmap(dpi=300, colorspace=fitz.csGRAY)
+            qrcode_data = scan_qrcode(pixmap_to_gray(pix))
+            del pix
+            if qrcode_data:
+                invoice_number, amount = extract_information(qrcode_data)
+                break
+        # 与 InvoiceProcessor 相同：没有二维码时从文本取号码，8位号码或缺少金额时以文本中的最大金额为准
+        if ext == ".pdf" and (not invoice_number or not amount or len(invoice_number) == 8):
+            text = "".join(page.get_text() for page in doc)
+            if not invoice_number:
+                numbers = INVOICE_NUMBER_RE.findall(text)
+                invoice_number = numbers[0] if numbers else None
             if invoice_number:
-                # 创建新文件名
-                new_name = invoice_number
-                if amount and config.get("webui_rename_with_amount"):
-                    new_name = f"{invoice_number}_{amount}"
-                new_name += ".pdf"
-                
-                # 在临时目录中创建新文件
-                new_path = os.path.join("/tmp", new_name)
-                shutil.copy2(file_path, new_path)
-                return new_path, amount
-    except Exception as e:
-        logging.error(f"处理PDF文件失败: {e}")
-    
-    return None, None
+                amount = extract_max_amount(text) or amount
+    if not invoice_number:
+        return None, None
+    new_name = create_new_filename(invoice_number, amount, filename,
+                                   rename_with_amount=config.get("webui_rename_with_amount"))
+    return new_name, amount
 
 def verify_admin(credentials: HTTPBasicCredentials = Depends(security)):
     """验证管理员密码"""
@@ -176,57 +142,71 @@ async def home(request: Request):
         }
     )
 
+# 最近生成的ZIP包保存在内存中等待下载：名称 -> (内容, 生成时间)
+_zip_store = OrderedDict()
+_ZIP_STORE_MAX = 16
+_ZIP_STORE_TTL = timedelta(minutes=30)
+
 def create_zip_file(files_info):
-    """创建包含处理后文件的ZIP包"""
+    """在内存中创建包含处理后文件的ZIP包，返回ZIP文件名"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    zip_filename = f"processed_invoices_{timestamp}.zip"
-    zip_path = f"/tmp/{zip_filename}"
+    zip_filename = f"processed_invoices_{timestamp}_{secrets.token_hex(4)}.zip"
     
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        used_names = set()
         for info in files_info:
-            if info["success"] and info.get("new_path"):
-                zipf.write(
-                    info["new_path"],
-                    os.path.basename(info["new_path"])
-                )
+            if info["success"] and info.get("data") is not None:
+                # 同名文件加序号，避免ZIP中出现重复条目
+                name = info["new_name"]
+                base, ext = os.path.splitext(name)
+                counter = 1
+                while name in used_names:
+                    name = f"{base}_{counter}{ext}"
+                    counter += 1
+                used_names.add(name)
+                zipf.writestr(name, info["data"])
     
-    return zip_path
+    now = datetime.now()
+    for name, (_, created) in list(_zip_store.items()):
+        if now - created > _ZIP_STORE_TTL:
+            del _zip_store[name]
+    _zip_store[zip_filename] = (buffer.getvalue(), now)
+    while len(_zip_store) > _ZIP_STORE_MAX:
+        _zip_store.popitem(last=False)
+    return zip_filename
 
 @app.post("/upload")
-async def upload_files(files: List[UploadFile] = File(...)):
-    """处理上传的文件并返回ZIP包下载链接"""
+async def upload_files(request: Request):
+    """
+    处理上传的文件并返回ZIP包下载链接。请求体流式解析到内存（Starlette 的 UploadFile
+    超过 1MB 会落盘到 /tmp），单个文件超过 upload_max_file_mb 时拒绝该文件
+    """
     results = []
     processed_files = []
     
     try:
-        for file in files:
+        async for file in upload_stream.iter_upload_parts(request, None, config.get("upload_max_file_mb")):
             try:
-                # 保存上传的文件到临时目录
-                file_path = f"/tmp/{file.filename}"
-                with open(file_path, "wb") as buffer:
-                    shutil.copyfileobj(file.file, buffer)
-                
-                # 处理文件
-                new_path = None
+                if file.error:
+                    raise ValueError(file.error)
+                new_name = None
                 amount = None
+                data = file.data
                 
-                if file.filename.lower().endswith('.pdf'):
-                    new_path, amount = process_pdf(file_path)
+                if file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                    new_name, amount = await run_in_threadpool(process_document, data, file.filename)
                 
                 file_info = {
                     "filename": file.filename,
-                    "success": new_path is not None,
-                    "new_name": os.path.basename(new_path) if new_path else None,
-                    "new_path": new_path,
+                    "success": new_name is not None,
+                    "new_name": new_name,
                     "amount": amount
                 }
                 
                 results.append(file_info)
-                if new_path:
-                    processed_files.append(file_info)
-                
-                # 清理原始上传文件
-                os.remove(file_path)
+                if new_name:
+                    processed_files.append(dict(file_info, data=data))
                 
             except Exception as e:
                 logging.error(f"处理文件失败 {file.filename}: {e}")
@@ -237,19 +217,15 @@ async def upload_files(files: List[UploadFile] = File(...)):
                 })
         
         # 如果有成功处理的文件，创建ZIP包
-        zip_path = None
-        if processed_files:
-            zip_path = create_zip_file(processed_files)
-            # 清理处理后的文件
-            for file_info in processed_files:
-                if file_info.get("new_path") and os.path.exists(file_info["new_path"]):
-                    os.remove(file_info["new_path"])
+        zip_filename = create_zip_file(processed_files) if processed_files else None
         
         return JSONResponse(content={
             "results": results,
-            "download_url": f"/download/{os.path.basename(zip_path)}" if zip_path else None
+            "download_url": f"/download/{zip_filename}" if zip_filename else None
         })
         
+    except upload_stream.MalformedUpload as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
     except Exception as e:
         logging.error(f"批量处理文件失败: {e}")
         return JSONResponse(
@@ -259,18 +235,18 @@ async def upload_files(files: List[UploadFile] = File(...)):
 
 @app.get("/download/{filename}")
 async def download_file(filename: str):
-    """下载处理后的ZIP文件"""
-    file_path = f"/tmp/{filename}"
-    if not os.path.exists(file_path):
+    """从内存中下载处理后的ZIP文件"""
+    entry = _zip_store.get(filename)
+    if entry is None:
         return JSONResponse(
             status_code=404,
             content={"error": "文件不存在"}
         )
     
-    return FileResponse(
-        file_path,
+    return StreamingResponse(
+        io.BytesIO(entry[0]),
         media_type="application/zip",
-        filename=filename
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
     )
 
 @app.get("/admin", response_class=HTMLResponse)
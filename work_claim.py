@@ -0,0 +1,231 @@
+"""
+多节点共享同一监控目录（NFS/SMB）时的任务认领
+
+每个节点处理文件前先把它原子地重命名到 <监控目录>/.processing/<节点ID>/ 下，
+重命名成功者获得该文件，失败者（文件已不存在）直接跳过，从而避免重复处理。
+子目录中的文件以 URL 编码的相对路径作为认领文件名，便于恢复到原位置。
+
+各节点定期更新自己目录下的 .heartbeat 文件；心跳超过租约时间未更新的节点被视为
+已退出，其目录中尚未处理完的文件会被其它节点移回监控目录重新处理。
+处理后仍留在认领目录中的文件（识别失败等）移入 .processing/failed/，需人工检查。
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from urllib.parse import quote, unquote
+from config_manager import config
+from file_processor import unique_path
+import output_layout
+
+CLAIM_DIR = ".processing"
+FAILED_DIR = "failed"
+HEARTBEAT_FILE = ".heartbeat"
+
+# process 未认领到文件（已被其它节点处理）时的返回值
+NOT_CLAIMED = object()
+
+
+def enabled():
+    return bool(config.get("claim_enabled", False))
+
+
+def default_node_id():
+    return config.get("node_id") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def is_claim_path(path):
+    """路径是否位于认领目录中（监控器应忽略这些文件的事件）"""
+    return CLAIM_DIR in os.path.normpath(path).split(os.sep)
+
+
+def _succeeded(outcome):
+    success = getattr(outcome, "success", None)
+    return bool(outcome) if success is None else bool(success)
+
+
+class WorkClaimer:
+    """在共享目录 root 上为本节点认领、处理并回收文件"""
+
+    def __init__(self, root, node_id=None, lease_seconds=None):
+        self.root = os.path.abspath(root)
+        self.node_id = node_id or default_node_id()
+        self.lease_seconds = float(lease_seconds or config.get("claim_lease_seconds", 120))
+        self.claim_root = os.path.join(self.root, CLAIM_DIR)
+        self.node_dir = os.path.join(self.claim_root, self.node_id)
+        self.failed_dir = os.path.join(self.claim_root, FAILED_DIR)
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(self.node_dir, exist_ok=True)
+        os.makedirs(self.failed_dir, exist_ok=True)
+
+    # -- 认领与处理 ----------------------------------------------------
+
+    def claim(self, path):
+        """把文件原子地移入本节点目录，成功返回认领后的路径，已被其它节点认领时返回 None"""
+        relative = os.path.relpath(os.path.abspath(path), self.root)
+        claimed = os.path.join(self.node_dir, quote(relative, safe=""))
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            logging.debug("文件已被其它节点认领: %s", path)
+            return None
+        logging.debug("节点 %s 认领文件: %s", self.node_id, path)
+        return claimed
+
+    def origin_of(self, claimed):
+        return os.path.join(self.root, unquote(os.path.basename(claimed)))
+
+    def process(self, path, fn, *args, **kwargs):
+        """
+        认领 path 后调用 fn(认领后的路径, *args, **kwargs)，输出仍归档到文件原来所在的目录；
+        未认领到时返回 NOT_CLAIMED。fn 返回 InvoiceResult 时按其 success 判断成败，否则按返回值真假；
+        处理成功但文件未被改名（如未拆分的多发票文件）时移回原位置，失败时移入 failed
+        """
+        claimed = self.claim(path)
+        if claimed is None:
+            return NOT_CLAIMED
+        outcome = None
+        try:
+            with output_layout.output_base(os.path.dirname(self.origin_of(claimed))):
+                outcome = fn(claimed, *args, **kwargs)
+            return outcome
+        finally:
+            if os.path.exists(claimed):
+                if _succeeded(outcome):
+                    self._restore(claimed)
+                else:
+                    self._move_to_failed(claimed)
+
+    def _restore(self, claimed):
+        origin = self.origin_of(claimed)
+        # 经 place 归档，监控器会忽略这次移动产生的事件
+        restored = output_layout.place(claimed, os.path.basename(origin),
+                                       base_dir=os.path.dirname(origin), layout="flat")
+        logging.info(f"文件已处理且保持原名，已移回: {restored}")
+
+    def _move_to_failed(self, claimed):
+        target = unique_path(self.failed_dir, unquote(os.path.basename(claimed)).replace(os.sep, "_"))
+        try:
+            os.rename(claimed, target)
+            logging.warning(f"文件处理后未被归档，已移入: {target}")
+        except OSError as e:
+            logging.error(f"移动未处理文件失败 {claimed}: {e}")
+
+    # -- 心跳与失效租约回收 --------------------------------------------
+
+    def heartbeat(self):
+        heartbeat_path = os.path.join(self.node_dir, HEARTBEAT_FILE)
+        try:
+            with open(heartbeat_path, "a"):
+                pass
+            os.utime(heartbeat_path)
+        except OSError as e:
+            logging.error(f"更新节点心跳失败: {e}")
+
+    def _release(self, node_dir, name):
+        """把认领目录中的文件移回原位置；并发回收时只有一个节点能成功"""
+        origin = os.path.join(self.root, unquote(name))
+        os.makedirs(os.path.dirname(origin), exist_ok=True)
+        target = unique_path(os.path.dirname(origin), os.path.basename(origin))
+        try:
+            os.rename(os.path.join(node_dir, name), target)
+            return target
+        except FileNotFoundError:
+            return None
+
+    def _release_all(self, node_dir):
+        released = 0
+        try:
+            with os.scandir(node_dir) as entries:
+                names = [entry.name for entry in entries if entry.name != HEARTBEAT_FILE]
+        except FileNotFoundError:
+            return 0
+        for name in names:
+            if self._release(node_dir, name):
+                released += 1
+        return released
+
+    def recover_stale(self):
+        """回收心跳超时节点的未完成文件，返回回收的文件数"""
+        now = time.time()
+        recovered = 0
+        try:
+            with os.scandir(self.claim_root) as entries:
+                nodes = [entry for entry in entries
+                         if entry.is_dir(follow_symlinks=False) and entry.name not in (FAILED_DIR, self.node_id)]
+        except FileNotFoundError:
+            return 0
+        for node in nodes:
+            heartbeat_path = os.path.join(node.path, HEARTBEAT_FILE)
+            try:
+                last_seen = os.stat(heartbeat_path).st_mtime
+            except FileNotFoundError:
+                # 刚创建、还没写心跳的节点以目录时间为准
+                try:
+                    last_seen = os.stat(node.path).st_mtime
+                except FileNotFoundError:
+                    continue
+            if now - last_seen <= self.lease_seconds:
+                continue
+            count = self._release_all(node.path)
+            recovered += count
+            if count:
+                logging.warning(f"节点 {node.name} 心跳超时，已回收 {count} 个未完成文件")
+            try:
+                os.remove(heartbeat_path)
+            except FileNotFoundError:
+                pass
+            try:
+                os.rmdir(node.path)
+            except OSError:
+                pass
+        return recovered
+
+    def _run(self):
+        interval = max(1.0, self.lease_seconds / 3)
+        while not self._stop.is_set():
+            self.heartbeat()
+            try:
+                self.recover_stale()
+            except Exception as e:
+                logging.error(f"回收失效认领失败: {e}")
+            self._stop.wait(interval)
+
+    def start(self):
+        # 同一节点ID上次异常退出时遗留的文件先放回监控目录
+        self.heartbeat()
+        count = self._release_all(self.node_dir)
+        if count:
+            logging.warning(f"已放回本节点上次遗留的 {count} 个文件")
+        self._thread = threading.Thread(target=self._run, name="work-claim", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        # 正常退出时移除心跳，让其它节点可以立即回收
+        try:
+            os.remove(os.path.join(self.node_dir, HEARTBEAT_FILE))
+        except FileNotFoundError:
+            pass
+
+
+_claimers = {}
+_claimers_lock = threading.Lock()
+
+
+def get_claimer(root):
+    """返回 root 对应的全局认领器；未启用多节点模式时返回 None"""
+    if not enabled():
+        return None
+    key = os.path.abspath(root)
+    with _claimers_lock:
+        claimer = _claimers.get(key)
+        if claimer is None:
+            claimer = _claimers[key] = WorkClaimer(key).start()
+            logging.info(f"多节点认领模式已启用: 节点 {claimer.node_id}, 目录 {key}")
+        return claimer
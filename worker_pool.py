@@ -0,0 +1,231 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from config_manager import config
+import executors
+
+# 渲染进程把像素写入共享内存，识别进程按名称挂载读取，
+# 主进程只传递 (名称, 宽, 高, 通道数, 行跨度) 这样的描述元组，避免 pickle 整页像素
+
+
+def _warm_up():
+    """子进程启动时导入依赖并在极小的文档上预热"""
+    import fitz
+    doc = fitz.open()
+    page = doc.new_page(width=72, height=72)
+    page.get_pixmap(dpi=36, colorspace=fitz.csGRAY)
+    doc.close()
+    try:
+        import numpy  # noqa: F401
+        from pyzbar.pyzbar import decode
+        decode((bytes(64 * 64), 64, 64))
+    except ImportError as e:
+        logging.debug("预热识别依赖失败: %s", e)
+    try:
+        import cv2  # noqa: F401
+    except ImportError:
+        pass
+
+
+def _ping():
+    return os.getpid()
+
+
+def _render_to_shared(file_path, page_num, dpi, clip):
+    """在渲染进程中渲染单页灰度图并写入共享内存，返回描述元组"""
+    import fitz
+    with fitz.open(file_path) as doc:
+        page = doc.load_page(page_num)
+        rect = fitz.Rect(clip) if clip else None
+        pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, clip=rect)
+    # 渲染进程长期存活，MuPDF 缓存同样需要限制
+    from memory_governor import limit_store
+    limit_store()
+    samples = pix.samples_mv
+    shm = shared_memory.SharedMemory(create=True, size=max(len(samples), 1))
+    try:
+        shm.buf[:len(samples)] = samples
+        return (shm.name, pix.width, pix.height, pix.n, pix.stride)
+    finally:
+        del samples
+        shm.close()
+
+
+def _decode_shared(desc):
+    """在识别进程中挂载共享内存并识别二维码，返回 (二维码数据, 在渲染图中的像素框)"""
+    import numpy as np
+    from pyzbar.pyzbar import decode
+    from qr_preprocess import decode_candidates_with_origin
+    name, width, height, n, stride = desc
+    shm = shared_memory.SharedMemory(name=name)
+    rows = gray = candidates = None
+    try:
+        rows = np.ndarray((height, stride), dtype=np.uint8, buffer=shm.buf)
+        gray = rows[:, :width * n:n]
+        candidates = decode_candidates_with_origin(gray)
+        for candidate, x0, y0, scale in candidates:
+            decoded = decode(candidate)
+            if decoded:
+                left, top, w, h = decoded[0].rect
+                box = (x0 + left * scale, y0 + top * scale, x0 + (left + w) * scale, y0 + (top + h) * scale)
+                return decoded[0].data.decode("utf-8"), box
+        return None, None
+    finally:
+        # 释放对共享内存的所有引用后才能关闭
+        if candidates is not None:
+            candidates.close()
+        rows = gray = candidates = candidate = None
+        shm.close()
+
+
+def _unlink(name):
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+        shm.close()
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.error(f"释放共享内存失败 {name}: {e}")
+
+
+class RenderDecodePool:
+    """预热的渲染/识别进程池"""
+
+    def __init__(self, render_workers=None, decode_workers=None, dpi=300):
+        cpus = os.cpu_count() or 1
+        self.dpi = dpi
+        self.render_workers = render_workers or max(1, cpus // 2)
+        self.decode_workers = decode_workers or max(1, cpus - self.render_workers)
+        # 使用 spawn，避免 fork 带有线程的 Web 进程
+        ctx = multiprocessing.get_context("spawn")
+        self._render = ProcessPoolExecutor(self.render_workers, mp_context=ctx, initializer=_warm_up)
+        self._decode = ProcessPoolExecutor(self.decode_workers, mp_context=ctx, initializer=_warm_up)
+
+    def warm(self):
+        """提前拉起全部子进程，使首个请求不承担启动成本"""
+        futures = [self._render.submit(_ping) for _ in range(self.render_workers)]
+        futures += [self._decode.submit(_ping) for _ in range(self.decode_workers)]
+        for future in futures:
+            future.result()
+        logging.info(f"进程池已预热: 渲染 {self.render_workers} 个, 识别 {self.decode_workers} 个")
+
+    def submit(self, file_path, page_num, clip=None):
+        """提交单页（或 clip 区域）渲染+识别，返回 (二维码数据, 像素框) 的 Future"""
+        render_future = self._render.submit(_render_to_shared, file_path, page_num, self.dpi, clip)
+        result = _ChainedFuture(render_future)
+
+        def on_rendered(f):
+            try:
+                desc = f.result()
+            except Exception as e:
+                result.set_exception(e)
+                return
+            if result.cancelled:
+                # 结果已不再需要（例如前面的页已识别成功），跳过识别
+                _unlink(desc[0])
+                result.set_result((None, None))
+                return
+            decode_future = self._decode.submit(_decode_shared, desc)
+
+            def on_decoded(df):
+                _unlink(desc[0])
+                try:
+                    result.set_result(df.result())
+                except Exception as e:
+                    result.set_exception(e)
+            decode_future.add_done_callback(on_decoded)
+
+        render_future.add_done_callback(on_rendered)
+        return result
+
+    def shutdown(self):
+        self._render.shutdown(wait=True, cancel_futures=True)
+        self._decode.shutdown(wait=True, cancel_futures=True)
+
+
+class _ChainedFuture:
+    """渲染→识别两级任务的结果占位"""
+
+    def __init__(self, render_future):
+        self._render_future = render_future
+        self._event = threading.Event()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self.cancelled = False
+
+    def set_result(self, value):
+        if not self._event.is_set():
+            self._result = value
+        self._finish()
+
+    def set_exception(self, exc):
+        if not self._event.is_set():
+            self._exception = exc
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def done(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        # 尚未开始的渲染直接取消；已在运行的任务只标记为不再需要
+        self.cancelled = True
+        if self._render_future.cancel():
+            self.set_result((None, None))
+
+    def result(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise TimeoutError("等待渲染/识别结果超时")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def enabled():
+    """worker_pool_enabled，或渲染/识别阶段的执行后端为 process；executors.serial() 期间不使用"""
+    if executors.forced_serial():
+        return False
+    return (config.get("worker_pool_enabled", False)
+            or executors.backend("render") == "process" or executors.backend("decode") == "process")
+
+
+def get_pool():
+    """返回全局进程池；未启用时返回 None"""
+    global _pool
+    if not enabled():
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = RenderDecodePool(
+                render_workers=int(config.get("render_workers", 0)) or executors.workers_for("render"),
+                decode_workers=int(config.get("decode_workers", 0)) or executors.workers_for("decode"),
+            )
+            _pool.warm()
+            atexit.register(_pool.shutdown)
+        return _pool